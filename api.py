@@ -1,63 +1,293 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-import ollama
-import subprocess
-import threading
-import time
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+import asyncio
+import httpx
+import inspect
+import logging
+import os
 import json
-import requests
-from search import WebSearch
+import time
+from contextlib import aclosing, asynccontextmanager
+from search import AsyncWebSearch
+from scheduler import ModelScheduler, QueueFullError
+from cache import ResponseCache, request_key
+from sessions import SessionBusyError, SessionStore
+from state import open_state
+from store import ConversationStore
+from downloads import DownloadManager, JobStore
+from batch import BatchRunner, BatchStore
+from compare import CompareScheduler
+from catalog import ModelCatalog
+from backends import RETRYABLE_ERRORS, BackendPool
+from startup import StartupOrchestrator
+from metrics import ChatMetrics, MetricsMiddleware, Registry
+from think_parser import ThinkStreamParser
+from rag import WebContextBuilder, inject_context, last_user_message
+from context import ContextManager, parse_budgets
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 不阻塞启动：Ollama就绪检查和模型预加载在后台进行，/readyz反映进度
+    startup.start()
+    backend_pool.start()
+    model_catalog.start()
+    await batch_runner.start()
+    # 重启或崩溃前没有完成的下载，等超时后由某个worker接着下载
+    resume_downloads = asyncio.create_task(download_manager.resume_interrupted())
+    yield
+    resume_downloads.cancel()
+    await batch_runner.stop()
+    await startup.stop()
+    await model_catalog.stop()
+    # 关闭共享连接池
+    await web_search.aclose()
+    await backend_pool.aclose()
+    await shared_state.close()
+    if download_state is not shared_state:
+        await download_state.close()
 
-# 用于存储下载状态的字典
-download_status = {}
 
-def download_model(model_name: str):
-    try:
-        process = subprocess.Popen(
-            ["ollama", "pull", model_name],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
-        
-        download_status[model_name] = {"status": "downloading", "progress": 0}
-        
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                if "downloading" in output.lower():
-                    try:
-                        progress = int(output.split('%')[0].split()[-1])
-                        download_status[model_name] = {"status": "downloading", "progress": progress}
-                    except:
-                        pass
-        
-        if process.returncode == 0:
-            download_status[model_name] = {"status": "completed", "progress": 100}
-        else:
-            error = process.stderr.read()
-            download_status[model_name] = {"status": "failed", "error": error}
-            
-    except Exception as e:
-        download_status[model_name] = {"status": "failed", "error": str(e)}
+app = FastAPI(lifespan=lifespan)
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+# httpx会为每个到Ollama的请求打一条INFO日志
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger("api")
+
+# Prometheus指标和请求追踪；TRACE_LOG=1时每个聊天请求结束后输出一行JSON日志
+metrics_registry = Registry()
+chat_metrics = ChatMetrics(
+    metrics_registry,
+    trace_buffer=int(os.getenv("TRACE_BUFFER", "200")),
+    log_traces=os.getenv("TRACE_LOG", "0") == "1"
+)
+app.add_middleware(MetricsMiddleware, registry=metrics_registry)
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# 多个Ollama后端用逗号分隔，未设置时只用OLLAMA_HOST
+OLLAMA_HOSTS = [h.strip() for h in os.getenv("OLLAMA_HOSTS", OLLAMA_HOST).split(",") if h.strip()]
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+
+# Ollama后端池，每个后端一个复用的httpx连接池；按模型亲和和负载路由，连接失败时切换后端
+backend_pool = BackendPool(
+    OLLAMA_HOSTS,
+    timeout=httpx.Timeout(None, connect=10.0),
+    max_connections=OLLAMA_MAX_CONNECTIONS,
+    health_interval=float(os.getenv("BACKEND_HEALTH_INTERVAL", "5")),
+    swap_penalty=float(os.getenv("BACKEND_SWAP_PENALTY", "2"))
+)
+
+# 按模型排队的调度器，避免Ollama内部无限排队和频繁切换模型；并发和驻留模型数按后端数量放大
+scheduler = ModelScheduler(
+    max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", "32")),
+    max_inflight_per_model=int(os.getenv("SCHEDULER_MAX_INFLIGHT", "2")) * len(OLLAMA_HOSTS),
+    max_loaded_models=int(os.getenv("OLLAMA_MAX_LOADED_MODELS", "1")) * len(OLLAMA_HOSTS),
+    max_swap_delay=float(os.getenv("SCHEDULER_MAX_SWAP_DELAY", "10"))
+)
+QUEUE_POLL_INTERVAL = 1.0
+
+# 多模型对比：每个后端可用于同时驻留模型的内存（字节），0表示只按OLLAMA_MAX_LOADED_MODELS限制数量
+COMPARE_MEMORY_BYTES = int(os.getenv("COMPARE_MEMORY_BYTES", "0")) * len(OLLAMA_HOSTS)
+COMPARE_MAX_MODELS = int(os.getenv("COMPARE_MAX_MODELS", "8"))
+
+# 可选的响应缓存，RESPONSE_CACHE=1 时启用；RESPONSE_CACHE_PATH 为空时只用内存层
+response_cache = None
+if os.getenv("RESPONSE_CACHE", "0") == "1":
+    response_cache = ResponseCache(
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+        memory_bytes=int(os.getenv("RESPONSE_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024))),
+        disk_path=os.getenv("RESPONSE_CACHE_PATH", "data/response_cache.sqlite3") or None,
+        disk_bytes=int(os.getenv("RESPONSE_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+    )
+
+# 可选的语义缓存，SEMANTIC_CACHE=1 时启用：相似的单轮提问复用回答，需要先下载嵌入模型；
+# 只在启用时导入numpy
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "nomic-embed-text")
+semantic_cache = None
+if os.getenv("SEMANTIC_CACHE", "0") == "1":
+    from semantic_cache import SemanticCache
+    semantic_cache = SemanticCache(
+        lambda text: backend_pool.embed(SEMANTIC_CACHE_MODEL, text),
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000")),
+        ttl=float(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 3600)))
+    )
+
+# 异步网页搜索，共享连接池并缓存查询结果
+web_search = AsyncWebSearch(
+    timeout=float(os.getenv("SEARCH_TIMEOUT", "10")),
+    cache_ttl=float(os.getenv("SEARCH_CACHE_TTL", "600")),
+    cache_size=int(os.getenv("SEARCH_CACHE_SIZE", "1024")),
+    latency=metrics_registry.histogram(
+        "search_duration_seconds", "搜索和网页抓取耗时（不含缓存命中）", ("kind", "status")),
+    # 默认拒绝抓取本机和内网地址，只在本地测试时设为1
+    allow_private_pages=os.getenv("WEB_FETCH_ALLOW_PRIVATE", "0") == "1"
+)
+
+# 联网增强：搜索结果抓取、排序后注入提示词
+web_context = WebContextBuilder(
+    web_search, fetch_timeout=float(os.getenv("WEB_FETCH_TIMEOUT", "5")))
+
+# 多个worker之间共享的可变状态（会话、下载任务、批量任务的执行权）：
+# memory:// 只在单进程内有效；同一台机器多worker用 sqlite:///路径，多台机器用 redis://
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+STATE_URL = os.getenv(
+    "STATE_URL", "sqlite:///data/state.sqlite3" if WEB_CONCURRENCY > 1 else "memory://")
+shared_state = open_state(STATE_URL)
+# 下载任务重启后也要保留：共享状态只在内存中时，单独保存到SQLite文件
+download_state = shared_state
+if STATE_URL.startswith("memory://"):
+    download_state = open_state(
+        "sqlite:///" + os.getenv("DOWNLOAD_STATE_PATH", "data/downloads.sqlite3"))
+
+# 服务端会话，后续轮次只需发送新消息
+session_store = SessionStore(
+    shared_state,
+    max_sessions=int(os.getenv("SESSION_MAX", "1024")),
+    ttl=float(os.getenv("SESSION_TTL", str(24 * 3600)))
+)
+DEFAULT_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# 上下文窗口管理：按模型的上下文长度裁剪历史，会话中被移出窗口的轮次在后台总结
+context_manager = ContextManager(
+    default_tokens=int(os.getenv("CONTEXT_TOKENS", "4096")),
+    model_tokens=parse_budgets(os.getenv("CONTEXT_MODEL_TOKENS", "")),
+    reserve_tokens=int(os.getenv("CONTEXT_RESERVE_TOKENS", "1024"))
+)
+CONTEXT_SUMMARIZE = os.getenv("CONTEXT_SUMMARIZE", "1") == "1"
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "256"))
+
+# 对话和消息持久化，页面刷新或重启后仍然保留
+conversation_store = ConversationStore(os.getenv("CHAT_STORE_PATH", "data/chats.sqlite3"))
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+
+# 模型下载任务，状态保存在共享状态中（默认单独的SQLite文件），多个worker共享，重启后保留
+download_manager = DownloadManager(
+    backend_pool,
+    JobStore(download_state, stale_after=float(os.getenv("DOWNLOAD_STALE_AFTER", "30"))),
+    # 所有worker合计的同时下载数，名额保存在共享状态中
+    max_concurrent=int(os.getenv("DOWNLOAD_MAX_CONCURRENT", "2"))
+)
+
+# 模型列表缓存，合并所有后端的模型；下载完成后失效
+model_catalog = ModelCatalog(
+    backend_pool,
+    ttl=float(os.getenv("MODEL_CATALOG_TTL", "30")),
+    refresh_interval=float(os.getenv("MODEL_CATALOG_REFRESH", "15"))
+)
+download_manager.on_complete.append(model_catalog.invalidate)
+
+# 启动编排：轮询Ollama直到可用，把PRELOAD_MODELS预加载到内存，PRELOAD_PULL=1时先下载缺少的模型
+startup = StartupOrchestrator(
+    backend_pool,
+    models=[m.strip() for m in os.getenv("PRELOAD_MODELS", "").split(",") if m.strip()],
+    keep_alive=os.getenv("PRELOAD_KEEP_ALIVE", DEFAULT_KEEP_ALIVE),
+    pull_missing=os.getenv("PRELOAD_PULL", "0") == "1"
+)
+startup.on_loaded.append(scheduler.mark_resident)
+startup.on_loaded.append(model_catalog.invalidate)
 
 class Message(BaseModel):
     role: str
     content: str
 
-class ChatRequest(BaseModel):
+class SamplingOptions(BaseModel):
+    temperature: float = 0.7
+    top_p: float | None = None
+    num_ctx: int | None = None
+    keep_alive: str | None = None
+
+    def ollama_options(self):
+        options = {"temperature": self.temperature}
+        if self.top_p is not None:
+            options["top_p"] = self.top_p
+        if self.num_ctx is not None:
+            options["num_ctx"] = self.num_ctx
+        return options
+
+class WebSearchOptions(BaseModel):
+    web_search: bool = False
+    search_results: int = 3
+    context_tokens: int = 2000
+
+class ChatRequest(SamplingOptions, WebSearchOptions):
     model: str
     messages: list[Message]
-    temperature: float = 0.7
     stream: bool = False
+    cache: bool = True
+    # 拆分<think>推理过程和回答，流式时输出thought_delta/answer_delta/done事件
+    typed_events: bool = False
+
+class CompareRequest(SamplingOptions):
+    models: list[str]
+    messages: list[Message]
+    stream: bool = True
 
 class ChatResponse(BaseModel):
     response: str
+    sources: list[dict] = []
+    thought: str | None = None
+    usage: dict = {}
+    # 发送给模型的提示词token估计和裁剪情况
+    context: dict = {}
+
+def chat_response(content: str, sources: list, usage: dict, split: bool, context: dict = None):
+    if not split:
+        return ChatResponse(response=content, sources=sources, usage=usage, context=context or {})
+    thought, answer = split_thought(content)
+    return ChatResponse(response=answer, thought=thought, sources=sources, usage=usage,
+                        context=context or {})
+
+class SessionCreateRequest(SamplingOptions):
+    model: str
+    system_prompt: str = ""
+    # 从已有的对话迁移过来时带上历史
+    messages: list[Message] = []
+    # 绑定持久化的对话：不带messages时从对话记录恢复历史，每轮完成后写回
+    chat_id: str | None = None
+
+class SessionMessageRequest(WebSearchOptions):
+    content: str
+    stream: bool = False
+    typed_events: bool = False
+    # 可选：本轮起更新会话的模型和参数
+    model: str | None = None
+    system_prompt: str | None = None
+    temperature: float | None = None
+    top_p: float | None = None
+    num_ctx: int | None = None
+    keep_alive: str | None = None
+
+
+class ChatCreateRequest(BaseModel):
+    name: str
+    model: str
+    temperature: float = 0.7
+    system_prompt: str = ""
+    web_search: bool = False
+
+class ChatUpdateRequest(BaseModel):
+    name: str | None = None
+    model: str | None = None
+    temperature: float | None = None
+    system_prompt: str | None = None
+    web_search: bool | None = None
+
+class StoredMessage(Message):
+    thought: str | None = None
+    sources: list[dict] = []
+
+class AppendMessagesRequest(BaseModel):
+    messages: list[StoredMessage]
+
+
+class BatchRequestLine(SamplingOptions):
+    # 批量任务JSONL中的一行；也可以写成 {"custom_id": ..., "body": {...}}
+    custom_id: str | None = None
+    model: str
+    messages: list[Message]
 
 
 class SearchRequest(BaseModel):
@@ -65,77 +295,910 @@ class SearchRequest(BaseModel):
     num_results: int = 5
 
 
+class BatchSearchRequest(BaseModel):
+    queries: list[str]
+    num_results: int = 5
+
+
 @app.post("/search")
 async def search(request: SearchRequest):
     try:
-        results = WebSearch.search_duckduckgo(
-            request.query, request.num_results)
-        return {"results": [{"title": r.title, "snippet": r.snippet, "link": r.link} for r in results]}
+        results = await web_search.search(request.query, request.num_results)
+        return {"results": [r.to_dict() for r in results]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
 
-@app.post("/chat", response_model=ChatResponse)
-@app.post("/chat")
-async def chat(request: ChatRequest):
+
+@app.post("/search/batch")
+async def search_batch(request: BatchSearchRequest):
     try:
-        if request.stream:
+        result_lists, merged = await web_search.search_many(
+            request.queries, request.num_results)
+        return {
+            "results": [r.to_dict() for r in merged],
+            "per_query": {q: [r.to_dict() for r in results]
+                          for q, results in zip(request.queries, result_lists)}
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
+
+
+@app.get("/search/stats")
+async def search_stats():
+    return web_search.stats()
+
+
+def sse(data: dict) -> str:
+    return f"data: {json.dumps(data)}\n\n"
+
+
+USAGE_FIELDS = ("prompt_eval_count", "prompt_eval_duration", "eval_count",
+                "eval_duration", "load_duration", "total_duration")
+
+
+def usage_stats(chunk) -> dict:
+    # Ollama在最后一个chunk中给出token数和各阶段耗时（纳秒）
+    return {field: getattr(chunk, field, None) for field in USAGE_FIELDS
+            if getattr(chunk, field, None) is not None}
+
+
+class ContentFrames:
+    """把模型输出转换成SSE帧：默认原样发送content；typed模式下增量拆分为
+    thought_delta/answer_delta事件，并在结束时发送带用量统计的done事件"""
+
+    def __init__(self, typed: bool):
+        self.parser = ThinkStreamParser() if typed else None
+
+    def content(self, text: str):
+        if self.parser is None:
+            return [sse({'content': text})]
+        return [sse({'type': f'{kind}_delta', 'content': delta})
+                for kind, delta in self.parser.feed(text)]
+
+    def done(self, usage: dict = None, **extra):
+        if self.parser is None:
+            return []
+        frames = [sse({'type': f'{kind}_delta', 'content': delta})
+                  for kind, delta in self.parser.flush()]
+        frames.append(sse({
+            'type': 'done',
+            'usage': usage or {},
+            'thought_chars': self.parser.thought_chars,
+            'answer_chars': self.parser.answer_chars,
+            **extra
+        }))
+        return frames
+
+
+def split_thought(text: str):
+    parser = ThinkStreamParser()
+    parts = {"thought": "", "answer": ""}
+    for kind, delta in parser.feed(text) + parser.flush():
+        parts[kind] += delta
+    return parts["thought"], parts["answer"]
+
+
+def submit_to_scheduler(model: str):
+    try:
+        return scheduler.submit(model)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"服务器繁忙: {str(e)}",
+            headers={"Retry-After": "5", "X-Queue-Depth": str(e.depth)}
+        )
+
+
+async def queue_events(ticket):
+    # 排队期间推送当前位置，位置变化时才发送
+    last_position = None
+    while not ticket.granted.is_set():
+        position = scheduler.position(ticket)
+        if position != last_position:
+            yield sse({'queue': {'position': position, 'wait': round(ticket.wait_time, 2)}})
+            last_position = position
+        try:
+            await asyncio.wait_for(ticket.granted.wait(), QUEUE_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_web_context(messages: list, options: WebSearchOptions):
+    # 立即在后台开始搜索和抓取，与排队等待并行进行，返回 (消息, 来源) 的任务
+    async def prepare():
+        context, sources = await web_context.build(
+            last_user_message(messages), options.search_results, options.context_tokens)
+        return inject_context(messages, context), sources
+
+    return asyncio.ensure_future(prepare())
+
+
+async def summarize_history(model: str, messages: list) -> str:
+    # 用会话当前的模型总结（已经加载，不会触发切换），和普通请求一样经过调度器
+    ticket = scheduler.submit(model)
+    try:
+        await ticket.granted.wait()
+        response = await backend_pool.chat(
+            model=model,
+            messages=messages,
+            options={"temperature": 0.2, "num_predict": CONTEXT_SUMMARY_TOKENS},
+            keep_alive=DEFAULT_KEEP_ALIVE
+        )
+    finally:
+        scheduler.release(ticket)
+    _, summary = split_thought(response['message']['content'])
+    return summary
+
+
+if CONTEXT_SUMMARIZE:
+    context_manager.summarizer = summarize_history
+    context_manager.on_summary = session_store.save_summary
+
+
+async def run_chat(model: str, messages: list, options: dict, keep_alive=None,
+                   stream: bool = False, use_cache: bool = True,
+                   on_complete=None, on_finish=None, prepare=None, typed_events=False,
+                   context=None, endpoint="chat"):
+    # on_complete在完整生成回答后以 (回答全文, 来源) 调用，用于会话等需要保存结果的场景；
+    # on_finish在请求结束时总会调用（包括出错和客户端断开），可以是协程函数；
+    # prepare是可选的后台任务，在拿到调度名额后等待它得到最终的 (消息, 来源)；
+    # typed_events为True时流式输出拆分推理过程和回答的事件；
+    # context是上下文裁剪信息，随响应（流式时在done事件中）返回；endpoint用于指标分组
+    keep_alive = keep_alive or DEFAULT_KEEP_ALIVE
+    trace = chat_metrics.trace(endpoint, model)
+    if on_finish is not None:
+        finish_callback = on_finish
+        finished = []
+
+        async def on_finish():
+            if not finished:
+                finished.append(True)
+                result = finish_callback()
+                if inspect.isawaitable(result):
+                    await result
+    try:
+        return await _run_chat(model, messages, options, keep_alive, stream,
+                               use_cache, on_complete, on_finish, prepare, typed_events,
+                               context or {}, trace)
+    except BaseException as e:
+        trace.finish("rejected" if getattr(e, "status_code", None) == 429 else "error")
+        if prepare is not None:
+            prepare.cancel()
+        if on_finish is not None:
+            await on_finish()
+        raise
+
+
+async def _run_chat(model, messages, options, keep_alive, stream, use_cache,
+                    on_complete, on_finish, prepare, typed_events, context, trace):
+
+    cache_key = None
+    cached = None
+    if response_cache is not None and use_cache:
+        cache_key = request_key(model, messages, options)
+        cached = await response_cache.get(cache_key)
+    # 精确匹配没有命中时再按语义查找；未命中的查询结果保留向量，回答生成后写入
+    semantic = None
+    if cached is None and semantic_cache is not None and use_cache:
+        semantic = await semantic_cache.lookup(model, messages)
+        if semantic is not None:
+            cached = semantic.chunks
+    if cached is not None:
+        if on_complete is not None:
+            on_complete("".join(cached), [])
+        if on_finish is not None:
+            await on_finish()
+        trace.token()
+        trace.finish("cached")
+        # 命中缓存时不占用调度器和Ollama，按原来的分片重放
+        if stream:
+            async def replay():
+                frames = ContentFrames(typed_events)
+                for content in cached:
+                    for frame in frames.content(content):
+                        yield frame
+                for frame in frames.done(cached=True, context=context):
+                    yield frame
+            return StreamingResponse(replay(), media_type="text/event-stream")
+        return chat_response("".join(cached), [], {}, typed_events, context)
+
+    ticket = submit_to_scheduler(model)
+    try:
+        if stream:
             # 流式响应
             async def generate():
+                upstream = None
+                chunks = []
+                prompt, sources = messages, []
+                frames = ContentFrames(typed_events)
+                usage = {}
                 try:
-                    stream = ollama.chat(
-                        model=request.model,
-                        messages=[msg.dict() for msg in request.messages],
+                    async for event in queue_events(ticket):
+                        yield event
+                    trace.granted(ticket.wait_time)
+
+                    if prepare is not None:
+                        prompt, sources = await prepare
+                        yield sse({'sources': sources})
+
+                    upstream = await backend_pool.chat(
+                        model=model,
+                        messages=prompt,
+                        options=options,
+                        keep_alive=keep_alive,
                         stream=True
                     )
-                    
-                    for chunk in stream:
+
+                    # 只有在上一帧发送完成后才读取下一个chunk，慢客户端会通过TCP反压到Ollama
+                    async for chunk in upstream:
+                        trace.token()
                         content = chunk['message']['content']
-                        yield f"data: {json.dumps({'content': content})}\n\n"
-                        
+                        chunks.append(content)
+                        for frame in frames.content(content):
+                            yield frame
+                        if chunk.done:
+                            usage = usage_stats(chunk)
+
+                    for frame in frames.done(usage, context=context):
+                        yield frame
+                    trace.finish("ok", usage)
+
+                    # 只保存完整生成的回答，出错或客户端中途断开的不保存
+                    if on_complete is not None:
+                        on_complete("".join(chunks), sources)
+                    if semantic is not None:
+                        semantic_cache.put(semantic, chunks)
+                    if cache_key is not None:
+                        await response_cache.put(cache_key, chunks)
+
                 except Exception as e:
-                    yield f"data: {json.dumps({'error': str(e)})}\n\n"
-                    
+                    logger.warning("流式聊天请求失败 [%s] %s: %s", trace.id, model, e)
+                    trace.finish("error", usage)
+                    yield sse({'error': str(e)})
+                finally:
+                    # 客户端中途断开时记为cancelled，已经结束的请求不受影响
+                    trace.finish("cancelled", usage)
+                    # 客户端断开时Starlette会取消本生成器，关闭上游连接让Ollama停止生成
+                    if upstream is not None:
+                        await upstream.aclose()
+                    if prepare is not None:
+                        prepare.cancel()
+                    scheduler.release(ticket)
+                    if on_finish is not None:
+                        await on_finish()
+
             return StreamingResponse(generate(), media_type="text/event-stream")
         else:
             # 非流式响应
-            response = ollama.chat(
-                model=request.model,
-                messages=[msg.dict() for msg in request.messages],
-                stream=False
-            )
-            return ChatResponse(response=response['message']['content'])
-            
+            prompt, sources = messages, []
+            try:
+                await ticket.granted.wait()
+                trace.granted(ticket.wait_time)
+                if prepare is not None:
+                    prompt, sources = await prepare
+                response = await backend_pool.chat(
+                    model=model,
+                    messages=prompt,
+                    options=options,
+                    keep_alive=keep_alive,
+                    stream=False
+                )
+                content = response['message']['content']
+                # 先保存结果再调用on_finish，会话在释放时写回的状态要包含本轮回答
+                if on_complete is not None:
+                    on_complete(content, sources)
+            finally:
+                scheduler.release(ticket)
+                if on_finish is not None:
+                    await on_finish()
+            if semantic is not None:
+                semantic_cache.put(semantic, [content])
+            if cache_key is not None:
+                await response_cache.put(cache_key, [content])
+            usage = usage_stats(response)
+            trace.finish("ok", usage)
+            return chat_response(content, sources, usage, typed_events, context)
+
     except Exception as e:
+        logger.exception("聊天请求失败 [%s] %s", trace.id, model)
         raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
 
+
+def context_budget(model: str, options: dict, request: WebSearchOptions) -> int:
+    # 联网增强注入的资料也占用上下文
+    return context_manager.budget(
+        model, options, request.context_tokens if request.web_search else 0)
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    options = request.ollama_options()
+    messages, context = context_manager.fit(
+        [msg.dict() for msg in request.messages],
+        context_budget(request.model, options, request))
+    return await run_chat(
+        request.model,
+        messages,
+        options,
+        keep_alive=request.keep_alive,
+        stream=request.stream,
+        # 联网结果随时间变化，不走响应缓存
+        use_cache=request.cache and not request.web_search,
+        prepare=start_web_context(messages, request) if request.web_search else None,
+        typed_events=request.typed_events,
+        context=context
+    )
+
+
+async def compare_model(model: str, messages: list, options: dict, keep_alive, started: float,
+                        emit):
+    # 对比中的单个模型：和普通请求一样经过调度器，事件都带上模型名；出错只影响这个模型
+    trace = chat_metrics.trace("compare", model)
+    try:
+        ticket = scheduler.submit(model)
+    except QueueFullError as e:
+        trace.finish("rejected")
+        emit({"model": model, "error": f"服务器繁忙: {str(e)}"})
+        return
+    upstream = None
+    usage = {}
+    try:
+        await ticket.granted.wait()
+        trace.granted(ticket.wait_time)
+        granted = time.perf_counter()
+        emit({"model": model, "status": "started", "wait": round(ticket.wait_time, 3)})
+        fitted, _ = context_manager.fit(messages, context_manager.budget(model, options))
+        upstream = await backend_pool.chat(
+            model=model, messages=fitted, options=options, keep_alive=keep_alive, stream=True)
+        ttft, chunks = None, []
+        async for chunk in upstream:
+            trace.token()
+            content = chunk['message']['content']
+            if content:
+                if ttft is None:
+                    ttft = time.perf_counter() - granted
+                chunks.append(content)
+                emit({"model": model, "content": content})
+            if chunk.done:
+                usage = usage_stats(chunk)
+        elapsed = time.perf_counter() - granted
+        tokens = usage.get("eval_count") or len(chunks)
+        # 优先用Ollama统计的生成耗时，不包括加载模型和处理提示词的时间
+        generation = usage["eval_duration"] / 1e9 if usage.get("eval_duration") else \
+            elapsed - (ttft or 0)
+        stats = {
+            "start": round(granted - started, 3),
+            "wait": round(ticket.wait_time, 3),
+            "ttft": round(ttft, 3) if ttft is not None else None,
+            "total": round(elapsed, 3),
+            "tokens": tokens,
+            "tokens_per_second": round(tokens / generation, 2) if generation > 0 else None,
+            "load": round(usage["load_duration"] / 1e9, 3) if usage.get("load_duration") else None
+        }
+        trace.finish("ok", usage)
+        emit({"model": model, "done": True, "content": "".join(chunks), "stats": stats,
+              "usage": usage})
+    except Exception as e:
+        logger.warning("对比请求失败 [%s] %s: %s", trace.id, model, e)
+        trace.finish("error", usage)
+        emit({"model": model, "error": str(e)})
+    finally:
+        trace.finish("cancelled", usage)
+        if upstream is not None:
+            await upstream.aclose()
+        scheduler.release(ticket)
+
+
+async def compare_plan(models: list) -> CompareScheduler:
+    # 模型大小取自模型列表：已加载的用实际占用的显存，否则用模型文件大小近似
+    sizes, loaded = {}, set()
+    try:
+        payload, _ = await model_catalog.get()
+    except (httpx.HTTPError, ConnectionError):
+        payload = {"models": []}
+    for entry in payload["models"]:
+        if entry["name"] in models:
+            sizes[entry["name"]] = entry.get("size_vram") or entry.get("size") or None
+            if entry.get("loaded"):
+                loaded.add(entry["name"])
+    return CompareScheduler(models, sizes, loaded, memory_budget=COMPARE_MEMORY_BYTES,
+                            max_models=scheduler.max_loaded_models)
+
+
+def compare_summary(results: dict) -> dict:
+    ok = {m: r["stats"] for m, r in results.items() if "stats" in r}
+
+    def fastest(key, best):
+        return best((m for m in ok if ok[m][key] is not None), key=lambda m: ok[m][key],
+                    default=None)
+
+    return {
+        "fastest_ttft": fastest("ttft", min),
+        "fastest_tokens_per_second": fastest("tokens_per_second", max)
+    }
+
+
+@app.post("/chat/compare")
+async def chat_compare(request: CompareRequest):
+    # 同一个问题同时问多个模型：能同时驻留的模型并行运行，放不下的依次运行；
+    # 流式时各模型的输出复用同一个SSE连接，每个事件都带model字段
+    models = list(dict.fromkeys(request.models))
+    if not 2 <= len(models) <= COMPARE_MAX_MODELS:
+        raise HTTPException(status_code=400,
+                            detail=f"对比需要2到{COMPARE_MAX_MODELS}个不同的模型")
+    options = request.ollama_options()
+    messages = [msg.dict() for msg in request.messages]
+    keep_alive = request.keep_alive or DEFAULT_KEEP_ALIVE
+    plan = await compare_plan(models)
+    started = time.perf_counter()
+    events = plan.run(lambda model, emit: compare_model(
+        model, messages, options, keep_alive, started, emit))
+    header = {"order": plan.pending[:], "sizes": plan.sizes,
+              "memory_budget": plan.memory_budget, "max_models": plan.max_models}
+    results = {model: {} for model in models}
+
+    def record(event):
+        if event.get("done"):
+            results[event["model"]] = {"response": event["content"], "stats": event["stats"],
+                                       "usage": event["usage"]}
+        elif "error" in event:
+            results[event["model"]] = {"error": event["error"]}
+
+    if request.stream:
+        async def generate():
+            yield sse({"plan": header})
+            # 客户端断开时关闭事件生成器，取消还在运行的模型
+            async with aclosing(events):
+                async for event in events:
+                    record(event)
+                    if event.get("done"):
+                        # 完整回答在content事件中已经发送过
+                        event = {k: v for k, v in event.items() if k != "content"}
+                    yield sse(event)
+            yield sse({"done": True, "results": {m: r.get("stats") or r for m, r in results.items()},
+                       **compare_summary(results)})
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    async with aclosing(events):
+        async for event in events:
+            record(event)
+    for result in results.values():
+        if "response" in result:
+            result["thought"], result["response"] = split_thought(result["response"])
+    return {"plan": header, "results": results, **compare_summary(results)}
+
+
+@app.post("/sessions")
+async def create_session(request: SessionCreateRequest):
+    messages = [msg.dict() for msg in request.messages]
+    if request.chat_id is not None and not messages:
+        if await asyncio.to_thread(conversation_store.get_chat, request.chat_id) is None:
+            raise HTTPException(status_code=404, detail="对话不存在")
+        stored, _ = await asyncio.to_thread(
+            conversation_store.messages, request.chat_id, None, None)
+        messages = [{"role": m["role"], "content": m["content"]} for m in stored]
+    session = await session_store.create(
+        model=request.model,
+        system_prompt=request.system_prompt,
+        options=request.ollama_options(),
+        keep_alive=request.keep_alive,
+        messages=messages,
+        chat_id=request.chat_id
+    )
+    if request.chat_id is not None:
+        await asyncio.to_thread(
+            conversation_store.update_chat, request.chat_id, session_id=session.id)
+    return session.to_dict(include_messages=False)
+
+
+def get_session_or_404(session):
+    if session is None:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    return session
+
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    return get_session_or_404(await session_store.get(session_id)).to_dict()
+
+
+@app.get("/sessions/{session_id}/messages")
+async def get_session_messages(session_id: str):
+    return {"messages": get_session_or_404(await session_store.get(session_id)).messages}
+
+
+@app.post("/sessions/{session_id}/messages")
+async def send_session_message(session_id: str, request: SessionMessageRequest):
+    # 占用会话直到回答结束，期间其他worker上的请求也会收到409
+    try:
+        session = get_session_or_404(await session_store.acquire(session_id))
+    except SessionBusyError:
+        raise HTTPException(status_code=409, detail="会话正在生成回答")
+
+    if request.model is not None:
+        session.model = request.model
+    if request.system_prompt is not None:
+        session.system_prompt = request.system_prompt
+    for key in ("temperature", "top_p", "num_ctx"):
+        value = getattr(request, key)
+        if value is not None:
+            session.options[key] = value
+    if request.keep_alive is not None:
+        session.keep_alive = request.keep_alive
+
+    budget = context_budget(session.model, session.options, request)
+
+    def on_complete(answer, sources):
+        # 会话历史只保存回答，推理过程不再发给模型
+        thought, reply = split_thought(answer)
+        session.append_turn(request.content, reply)
+        context_manager.finish_turn(session, budget)
+        if session.chat_id is not None:
+            # 写回对话记录，推理过程和回答分开保存
+            asyncio.ensure_future(asyncio.to_thread(
+                conversation_store.add_messages, session.chat_id, [
+                    {"role": "user", "content": request.content},
+                    {"role": "assistant", "content": reply, "thought": thought.strip(),
+                     "sources": sources}
+                ]))
+
+    def on_finish():
+        # 写回本轮的修改并释放会话
+        return session_store.release(session)
+
+    messages, context = context_manager.session_prompt(session, request.content, budget)
+    return await run_chat(
+        session.model,
+        messages,
+        dict(session.options),
+        keep_alive=session.keep_alive,
+        stream=request.stream,
+        use_cache=not request.web_search,
+        on_complete=on_complete,
+        on_finish=on_finish,
+        prepare=start_web_context(messages, request) if request.web_search else None,
+        typed_events=request.typed_events,
+        context=context,
+        endpoint="session"
+    )
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not await session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="会话不存在")
+    return {"status": "deleted"}
+
+
+def get_chat_or_404(chat):
+    if chat is None:
+        raise HTTPException(status_code=404, detail="对话不存在")
+    return chat
+
+
+@app.get("/chats")
+async def list_chats():
+    # 对话列表只包含元数据和消息数，不加载消息内容
+    return {"chats": await asyncio.to_thread(conversation_store.list_chats)}
+
+
+@app.post("/chats")
+async def create_chat(request: ChatCreateRequest):
+    return await asyncio.to_thread(conversation_store.create_chat, **request.dict())
+
+
+@app.get("/chats/{chat_id}")
+async def get_chat(chat_id: str):
+    return get_chat_or_404(await asyncio.to_thread(conversation_store.get_chat, chat_id))
+
+
+@app.patch("/chats/{chat_id}")
+async def update_chat(chat_id: str, request: ChatUpdateRequest):
+    fields = request.dict(exclude_none=True)
+    return get_chat_or_404(
+        await asyncio.to_thread(conversation_store.update_chat, chat_id, **fields))
+
+
+@app.delete("/chats/{chat_id}")
+async def delete_chat(chat_id: str):
+    chat = get_chat_or_404(await asyncio.to_thread(conversation_store.get_chat, chat_id))
+    if chat["session_id"]:
+        await session_store.delete(chat["session_id"])
+    await asyncio.to_thread(conversation_store.delete_chat, chat_id)
+    return {"status": "deleted"}
+
+
+@app.get("/chats/{chat_id}/messages")
+async def get_chat_messages(chat_id: str, before: int | None = None, limit: int = CHAT_PAGE_SIZE):
+    # 从最新的消息往前分页，before为上一页最早一条消息的id
+    get_chat_or_404(await asyncio.to_thread(conversation_store.get_chat, chat_id))
+    messages, has_more = await asyncio.to_thread(
+        conversation_store.messages, chat_id, before, max(1, min(limit, 500)))
+    return {"messages": messages, "has_more": has_more}
+
+
+@app.post("/chats/{chat_id}/messages")
+async def append_chat_messages(chat_id: str, request: AppendMessagesRequest):
+    get_chat_or_404(await asyncio.to_thread(conversation_store.get_chat, chat_id))
+    await asyncio.to_thread(
+        conversation_store.add_messages, chat_id, [m.dict() for m in request.messages])
+    return {"status": "ok"}
+
+
+async def run_batch_request(request: dict) -> dict:
+    # 批量请求和普通请求一样经过调度器，不会挤占交互请求的并发名额
+    model = request["model"]
+    trace = chat_metrics.trace("batch", model)
+    try:
+        ticket = scheduler.submit(model)
+    except QueueFullError:
+        trace.finish("rejected")
+        raise
+    try:
+        await ticket.granted.wait()
+        trace.granted(ticket.wait_time)
+        messages, _ = context_manager.fit(
+            request["messages"], context_manager.budget(model, request["options"]))
+        response = await backend_pool.chat(
+            model=model,
+            messages=messages,
+            options=request["options"],
+            keep_alive=request["keep_alive"] or DEFAULT_KEEP_ALIVE
+        )
+    except BaseException:
+        trace.finish("error")
+        raise
+    finally:
+        scheduler.release(ticket)
+    usage = usage_stats(response)
+    trace.token()
+    trace.finish("ok", usage)
+    thought, answer = split_thought(response['message']['content'])
+    return {"content": answer, "thought": thought, "usage": usage}
+
+
+# 离线批量推理：提交JSONL，按模型分组、限制并发执行，进度保存在SQLite中，重启后继续
+batch_runner = BatchRunner(
+    BatchStore(os.getenv("BATCH_STATE_PATH", "data/batches.sqlite3")),
+    run_batch_request,
+    output_dir=os.getenv("BATCH_OUTPUT_DIR", "data/batches"),
+    state=shared_state,
+    concurrency=int(os.getenv("BATCH_CONCURRENCY", "2")),
+    max_attempts=int(os.getenv("BATCH_MAX_ATTEMPTS", "5"))
+)
+
+
+def parse_batch_lines(body: bytes) -> list:
+    items = []
+    for number, line in enumerate(body.decode("utf-8").splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            if "body" in data:
+                data = {**data["body"], "custom_id": data.get("custom_id")}
+            request = BatchRequestLine(**data)
+        except (ValueError, TypeError, ValidationError) as e:
+            raise HTTPException(status_code=400, detail=f"第{number}行格式错误: {str(e)}")
+        items.append({
+            "custom_id": request.custom_id or str(number),
+            "model": request.model,
+            "request": {
+                "model": request.model,
+                "messages": [m.dict() for m in request.messages],
+                "options": request.ollama_options(),
+                "keep_alive": request.keep_alive
+            }
+        })
+    if not items:
+        raise HTTPException(status_code=400, detail="批量任务为空")
+    return items
+
+
+@app.post("/batch")
+async def create_batch(request: Request):
+    # 请求体就是JSONL文件内容，例如 curl --data-binary @requests.jsonl
+    items = parse_batch_lines(await request.body())
+    job_id = await batch_runner.submit(items)
+    return {"id": job_id, "status": "queued", "total": len(items)}
+
+
+@app.get("/batch")
+async def list_batches():
+    return {"jobs": await asyncio.to_thread(batch_runner.store.list)}
+
+
+def get_batch_or_404(job):
+    if job is None:
+        raise HTTPException(status_code=404, detail="批量任务不存在")
+    return job
+
+
+@app.get("/batch/{job_id}")
+async def get_batch(job_id: str):
+    # 进度、各模型完成数、吞吐量（请求/秒、token/秒）和预计剩余时间
+    return get_batch_or_404(await asyncio.to_thread(batch_runner.store.get, job_id))
+
+
+@app.get("/batch/{job_id}/results")
+async def get_batch_results(job_id: str):
+    # 已完成的结果，任务进行中也可以读取
+    get_batch_or_404(await asyncio.to_thread(batch_runner.store.get, job_id))
+    path = batch_runner.output_path(job_id)
+    if not os.path.exists(path):
+        return Response(b"", media_type="application/x-ndjson")
+    return FileResponse(path, media_type="application/x-ndjson", filename=f"{job_id}.jsonl")
+
+
+@app.delete("/batch/{job_id}")
+async def cancel_batch(job_id: str):
+    get_batch_or_404(await asyncio.to_thread(batch_runner.store.get, job_id))
+    if not await batch_runner.cancel(job_id):
+        raise HTTPException(status_code=409, detail="批量任务已经结束")
+    return {"status": "cancelled"}
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
+
+@app.get("/cache/semantic")
+async def semantic_cache_stats():
+    # 命中率、相似度分布和最近命中的问题对，用于调整SEMANTIC_CACHE_THRESHOLD
+    if semantic_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, "model": SEMANTIC_CACHE_MODEL, **semantic_cache.stats()}
+
+
+@app.delete("/cache")
+async def clear_cache():
+    if response_cache is not None:
+        await response_cache.clear()
+    if semantic_cache is not None:
+        semantic_cache.clear()
+    return {"status": "cleared"}
+
+
+@app.get("/context/stats")
+async def context_stats():
+    return context_manager.stats()
+
+
+def register_collectors():
+    # 已经在各模块中计数的统计，抓取时读取
+    r = metrics_registry
+    r.callback("scheduler_queued_requests", "排队中的请求数", "gauge", ("model",),
+               lambda: {m: s["queued"] for m, s in scheduler.stats().items()})
+    r.callback("scheduler_inflight_requests", "正在处理的请求数", "gauge", ("model",),
+               lambda: {m: s["inflight"] for m, s in scheduler.stats().items()})
+    r.callback("scheduler_rejected_total", "队列已满被拒绝的请求数", "counter", ("model",),
+               lambda: {m: s["rejected"] for m, s in scheduler.stats().items()})
+    r.callback("backend_healthy", "后端健康状态", "gauge", ("host",),
+               lambda: {b.host: int(b.healthy) for b in backend_pool.backends})
+    r.callback("backend_inflight_requests", "后端正在处理的请求数", "gauge", ("host",),
+               lambda: {b.host: b.inflight for b in backend_pool.backends})
+    r.callback("backend_failovers_total", "切换到其他后端的次数", "counter", ("host",),
+               lambda: {b.host: b.failovers for b in backend_pool.backends})
+    r.callback("search_cache_lookups_total", "搜索缓存查询", "counter", ("result",),
+               lambda: {"hit": web_search.hits, "miss": web_search.misses})
+    r.callback("search_errors_total", "搜索和网页抓取失败次数", "counter", ("kind",),
+               lambda: dict(web_search.errors))
+    r.callback("context_summaries_total", "历史总结次数", "counter", ("status",),
+               lambda: {"ok": context_manager.summaries, "failed": context_manager.summary_failures})
+    if response_cache is not None:
+        def cache_lookups():
+            stats = response_cache.stats()
+            return {"memory": stats["memory_hits"], "disk": stats["disk_hits"],
+                    "miss": stats["misses"]}
+        r.callback("response_cache_lookups_total", "响应缓存查询", "counter", ("result",),
+                   cache_lookups)
+    if semantic_cache is not None:
+        r.callback("semantic_cache_lookups_total", "语义缓存查询", "counter", ("result",),
+                   lambda: {"hit": semantic_cache.hits, "miss": semantic_cache.misses,
+                            "skipped": semantic_cache.skipped, "error": semantic_cache.errors})
+        r.callback("semantic_cache_entries", "语义缓存条目数", "gauge", (),
+                   lambda: {(): len(semantic_cache)})
+
+
+register_collectors()
+
+
+@app.get("/healthz")
+async def healthz():
+    # 存活检查：只要事件循环能响应就返回200
+    return {"status": "ok", "uptime": startup.stats()["uptime"]}
+
+
+@app.get("/readyz")
+async def readyz():
+    # 就绪检查：Ollama可用且预加载完成后才返回200，之后所有后端都不可用时返回503
+    stats = startup.stats()
+    ready = startup.ready and any(b.healthy for b in backend_pool.backends)
+    return JSONResponse({**stats, "ready": ready}, status_code=200 if ready else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/traces")
+async def recent_traces(limit: int = 50):
+    # 最近结束的聊天请求的各阶段耗时，最新的在前
+    traces = list(chat_metrics.recent)[-limit:]
+    return {"traces": traces[::-1]}
+
+
+@app.get("/backends")
+async def backend_stats():
+    return backend_pool.stats()
+
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    return scheduler.stats()
+
 @app.get("/models")
-async def list_models():
+async def list_models(request: Request):
     try:
-        response = requests.get("http://localhost:11434/api/tags")
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        payload, etag = await model_catalog.get()
+    except (httpx.HTTPError, ConnectionError) as e:
         raise HTTPException(status_code=500, detail=f"Ollama服务错误: {str(e)}")
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
+
+
+@app.delete("/models/{model_name}")
+async def delete_model(model_name: str):
+    import ollama
+    try:
+        unreachable = await backend_pool.delete(model_name)
+    except ollama.ResponseError as e:
+        raise HTTPException(status_code=e.status_code if e.status_code > 0 else 500,
+                            detail=f"Ollama服务错误: {e.error}")
+    except RETRYABLE_ERRORS as e:
+        raise HTTPException(status_code=503, detail=f"无法连接Ollama服务: {e}")
+    model_catalog.invalidate()
+    # 不可达的后端恢复后会补删
+    return {"status": "deleted", "pending_hosts": unreachable}
 
 @app.post("/models/download/{model_name}")
-async def start_download(model_name: str, background_tasks: BackgroundTasks):
-    if model_name in download_status and download_status[model_name]["status"] == "downloading":
+async def start_download(model_name: str):
+    if not await download_manager.start(model_name):
         return {"status": "already_downloading"}
-    background_tasks.add_task(download_model, model_name)
     return {"status": "started"}
 
 @app.get("/models/download/{model_name}/status")
 async def get_download_status(model_name: str):
-    if model_name not in download_status:
+    job = await download_manager.status(model_name)
+    if job is None:
         raise HTTPException(status_code=404, detail="下载任务不存在")
-    return download_status[model_name]
+    return job
 
 
-@app.post("/search")
-async def search(request: SearchRequest):
-    try:
-        results = WebSearch.search_duckduckgo(
-            request.query, request.num_results)
-        return {"results": [{"title": r.title, "snippet": r.snippet, "link": r.link} for r in results]}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
+@app.get("/models/download/{model_name}/events")
+async def download_events(model_name: str):
+    # 以SSE推送下载进度（字节数、速度、预计剩余时间、当前层），直到下载结束
+    async def generate():
+        async for job in download_manager.events(model_name):
+            yield sse(job)
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+@app.delete("/models/download/{model_name}")
+async def cancel_download(model_name: str):
+    if not await download_manager.cancel(model_name):
+        raise HTTPException(status_code=404, detail="没有进行中的下载任务")
+    return {"status": "cancelling"}
+
+
+@app.get("/models/downloads")
+async def list_downloads():
+    return {"downloads": await download_manager.store.list()}
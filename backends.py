@@ -0,0 +1,327 @@
+import asyncio
+import time
+from collections import Counter
+
+import httpx
+
+# 这些错误说明请求没有到达Ollama或连接在生成第一个token前断开，可以换一个后端重试
+RETRYABLE_ERRORS = (httpx.TransportError, ConnectionError)
+
+
+class NoBackendError(Exception):
+    def __init__(self, model: str):
+        super().__init__(f"没有可用的Ollama后端处理模型 {model}")
+        self.model = model
+
+
+class Backend:
+    def __init__(self, host: str, timeout: httpx.Timeout, max_connections: int):
+        self.host = host
+        self.timeout = timeout
+        # 健康检查、预加载和ollama客户端共用同一个连接池
+        self._transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections
+        ))
+        self.http = httpx.AsyncClient(
+            base_url=host if "://" in host else f"http://{host}",
+            timeout=timeout,
+            transport=self._transport
+        )
+        self._client = None
+        self.healthy = True
+        self.inflight = 0
+        # 正在处理的请求按模型计数，突发请求还没等到健康检查时也能按模型亲和分配
+        self.inflight_models = Counter()
+        # 最近一次健康检查得到的已安装模型（/api/tags）和已加载模型（/api/ps）
+        self.models = []
+        self.running = []
+        self.checked_at = 0.0
+        self.last_error = None
+        # 删除模型时不可达，恢复后需要补删的模型
+        self.pending_deletes = set()
+        self.requests = 0
+        self.failures = 0
+        self.failovers = 0
+        self.eval_count = 0
+        self.total_ttft = 0.0
+        self.first_chunks = 0
+
+    @property
+    def client(self):
+        # ollama的类型定义导入需要约0.2秒，第一次发请求时才导入，不拖慢服务启动
+        if self._client is None:
+            import ollama
+            self._client = ollama.AsyncClient(
+                host=self.host, timeout=self.timeout, transport=self._transport)
+        return self._client
+
+    def has_model(self, model: str) -> bool:
+        return any(m["name"] == model for m in self.models)
+
+    def has_loaded(self, model: str) -> bool:
+        return self.inflight_models[model] > 0 or any(m["name"] == model for m in self.running)
+
+    def acquire(self, model: str):
+        self.inflight += 1
+        self.inflight_models[model] += 1
+        self.requests += 1
+
+    def release(self, model: str):
+        self.inflight -= 1
+        self.inflight_models[model] -= 1
+
+    def mark_failed(self, error: Exception):
+        self.healthy = False
+        self.failures += 1
+        self.last_error = str(error)
+
+    def stats(self):
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "inflight": self.inflight,
+            "loaded": [m["name"] for m in self.running],
+            "models": len(self.models),
+            "requests": self.requests,
+            "failures": self.failures,
+            "failovers": self.failovers,
+            "eval_count": self.eval_count,
+            "avg_ttft": self.total_ttft / self.first_chunks if self.first_chunks else 0.0,
+            "last_error": self.last_error,
+            "pending_deletes": sorted(self.pending_deletes),
+            "checked_at": self.checked_at
+        }
+
+
+class BackendStream:
+    """转发某个后端的流式响应，结束或关闭时释放该后端的并发计数"""
+
+    def __init__(self, backend: Backend, model: str, upstream, first):
+        self.backend = backend
+        self.model = model
+        self._upstream = upstream
+        self._pending = [first]
+        self._finished = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._pending:
+            chunk = self._pending.pop()
+        else:
+            try:
+                chunk = await self._upstream.__anext__()
+            except BaseException:
+                self._finish()
+                raise
+        if chunk.done:
+            self.backend.eval_count += chunk.eval_count or 0
+        return chunk
+
+    async def aclose(self):
+        try:
+            await self._upstream.aclose()
+        finally:
+            self._finish()
+
+    def _finish(self):
+        if not self._finished:
+            self._finished = True
+            self.backend.release(self.model)
+
+
+class BackendPool:
+    """多个Ollama后端：定时健康检查，按模型亲和（已加载 > 已安装）和当前并发数选择后端，
+    连接失败或在第一个token之前断开时换一个后端重试"""
+
+    def __init__(self, hosts: list, timeout: httpx.Timeout, max_connections: int = 32,
+                 health_interval: float = 5.0, health_timeout: float = 3.0,
+                 swap_penalty: float = 2.0):
+        self.backends = [Backend(host, timeout, max_connections) for host in hosts]
+        # 每次模型切换相当于多排swap_penalty个请求
+        self.swap_penalty = swap_penalty
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._task = None
+
+    def pick(self, model: str, exclude=()) -> Backend:
+        candidates = [b for b in self.backends if b not in exclude]
+        # 没有健康的后端时仍然尝试，可能只是健康检查还没恢复
+        healthy = [b for b in candidates if b.healthy] or candidates
+        if not healthy:
+            raise NoBackendError(model)
+        installed = [b for b in healthy if b.has_model(model)] or healthy
+        return min(installed, key=lambda b: (self.cost(b, model), b.requests))
+
+    def cost(self, backend: Backend, model: str) -> float:
+        # 排队的请求数，加上需要的模型切换：没加载该模型算一次，正在处理的其他模型每个也算一次
+        swaps = sum(1 for m, n in backend.inflight_models.items() if n > 0 and m != model)
+        if not backend.has_loaded(model):
+            swaps += 1
+        return backend.inflight + swaps * self.swap_penalty
+
+    async def chat(self, model: str, stream: bool = False, **kwargs):
+        import ollama
+        tried = []
+        while True:
+            backend = self.pick(model, tried)
+            tried.append(backend)
+            backend.acquire(model)
+            start = time.monotonic()
+            upstream = None
+            try:
+                if not stream:
+                    response = await backend.client.chat(model=model, stream=False, **kwargs)
+                    backend.eval_count += response.eval_count or 0
+                    backend.release(model)
+                    return response
+                upstream = await backend.client.chat(model=model, stream=True, **kwargs)
+                # 收到第一个chunk之前出错都可以透明地换后端
+                first = await upstream.__anext__()
+                backend.total_ttft += time.monotonic() - start
+                backend.first_chunks += 1
+                return BackendStream(backend, model, upstream, first)
+            except BaseException as e:
+                backend.release(model)
+                if upstream is not None:
+                    await upstream.aclose()
+                if isinstance(e, RETRYABLE_ERRORS):
+                    backend.mark_failed(e)
+                elif not (isinstance(e, ollama.ResponseError) and e.status_code == 404):
+                    # 其他错误（包括取消）直接抛出；模型不存在时可以换一个后端
+                    raise
+                if len(tried) == len(self.backends):
+                    raise
+                backend.failovers += 1
+
+    async def embed(self, model: str, text: str) -> list:
+        # 嵌入请求很短，不计入后端的并发数；连接失败时换一个后端
+        tried = []
+        while True:
+            backend = self.pick(model, tried)
+            tried.append(backend)
+            try:
+                response = await backend.http.post("/api/embed", json={"model": model, "input": text})
+                response.raise_for_status()
+                return response.json()["embeddings"][0]
+            except RETRYABLE_ERRORS as e:
+                backend.mark_failed(e)
+                if len(tried) == len(self.backends):
+                    raise
+                backend.failovers += 1
+
+    async def pull(self, model: str, stream: bool = True):
+        # 在所有健康的后端上同时下载，进度按后端区分层，全部完成后才报告success
+        import ollama
+        backends = [b for b in self.backends if b.healthy] or self.backends
+        queue = asyncio.Queue()
+
+        async def pull_one(backend):
+            try:
+                async for part in await backend.client.pull(model, stream=True):
+                    if part.status == "success":
+                        continue
+                    if part.digest:
+                        part = part.model_copy(update={"digest": f"{backend.host}/{part.digest}"})
+                    await queue.put(part)
+                await queue.put(None)
+            except BaseException as e:
+                await queue.put(e)
+
+        async def merged():
+            tasks = [asyncio.create_task(pull_one(b)) for b in backends]
+            try:
+                remaining = len(tasks)
+                while remaining:
+                    item = await queue.get()
+                    if item is None:
+                        remaining -= 1
+                    elif isinstance(item, BaseException):
+                        raise item
+                    else:
+                        yield item
+                yield ollama.ProgressResponse(status="success")
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        return merged()
+
+    async def delete(self, model: str) -> list:
+        # 在所有有这个模型的后端上删除。都没有删除成功时优先报告Ollama的错误（例如模型不存在），
+        # 全部不可达时才抛出连接错误。部分后端不可达时记下来，健康检查发现恢复后补删，
+        # 返回这些后端的地址
+        results = await asyncio.gather(
+            *[b.client.delete(model) for b in self.backends], return_exceptions=True)
+        unreachable = [b for b, r in zip(self.backends, results) if isinstance(r, RETRYABLE_ERRORS)]
+        errors = [r for r in results if isinstance(r, BaseException)]
+        for backend, result in zip(self.backends, results):
+            if backend in unreachable:
+                backend.mark_failed(result)
+        if len(errors) == len(results):
+            raise next((e for e in errors if not isinstance(e, RETRYABLE_ERRORS)), errors[0])
+        for backend in unreachable:
+            backend.pending_deletes.add(model)
+        return [b.host for b in unreachable]
+
+    async def _retry_deletes(self, backend: Backend):
+        import ollama
+        for model in list(backend.pending_deletes):
+            try:
+                await backend.client.delete(model)
+            except ollama.ResponseError:
+                # 模型已经不在了（例如在Ollama上手动删除过）
+                pass
+            except RETRYABLE_ERRORS:
+                return
+            backend.pending_deletes.discard(model)
+
+    async def check(self, backend: Backend):
+        try:
+            tags, ps = await asyncio.wait_for(asyncio.gather(
+                backend.http.get("/api/tags"), backend.http.get("/api/ps")), self.health_timeout)
+            tags.raise_for_status()
+            # 模型列表是补删之前取的，去掉需要补删的模型
+            deleting = set(backend.pending_deletes)
+            if deleting:
+                await self._retry_deletes(backend)
+            backend.models = [m for m in tags.json().get("models", []) if m["name"] not in deleting]
+            backend.running = ps.json().get("models", []) if ps.is_success else []
+            backend.healthy = True
+            backend.last_error = None
+        except Exception as e:
+            backend.healthy = False
+            backend.last_error = str(e) or type(e).__name__
+        backend.checked_at = time.time()
+
+    async def check_all(self):
+        await asyncio.gather(*[self.check(b) for b in self.backends])
+
+    async def _health_loop(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.health_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def aclose(self):
+        await self.stop()
+        # 连接池是共用的，关闭一个客户端就关闭了底层连接
+        for backend in self.backends:
+            await backend.http.aclose()
+
+    def stats(self):
+        return {"backends": [b.stats() for b in self.backends]}
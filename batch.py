@@ -0,0 +1,353 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from state import StateStore
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class BatchStore:
+    """批量任务和每一行请求保存在SQLite中，已完成的结果就是检查点，重启后从未完成的行继续"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batch_jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, total INTEGER NOT NULL, "
+            "elapsed REAL NOT NULL DEFAULT 0, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, finished_at REAL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batch_items ("
+            "job_id TEXT NOT NULL REFERENCES batch_jobs(id) ON DELETE CASCADE, "
+            "line INTEGER NOT NULL, custom_id TEXT, model TEXT NOT NULL, request TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', result TEXT, tokens INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (job_id, line))")
+        self._conn.commit()
+
+    def create(self, items: list) -> str:
+        # items: [{"custom_id", "model", "request"}]，按提交顺序编号
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO batch_jobs (id, status, total, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?)", (job_id, len(items), now, now))
+            self._conn.executemany(
+                "INSERT INTO batch_items (job_id, line, custom_id, model, request) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(job_id, line, item["custom_id"], item["model"],
+                  json.dumps(item["request"], ensure_ascii=False))
+                 for line, item in enumerate(items)])
+            self._conn.commit()
+        return job_id
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM batch_jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            counts = self._conn.execute(
+                "SELECT model, status, COUNT(*) AS n, SUM(tokens) AS tokens FROM batch_items "
+                "WHERE job_id = ? GROUP BY model, status", (job_id,)).fetchall()
+        return self._job(row, counts)
+
+    def list(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM batch_jobs ORDER BY created_at DESC").fetchall()
+        return [self.get(row["id"]) for row in rows]
+
+    def unfinished(self):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id FROM batch_jobs WHERE status IN ({','.join('?' * len(ACTIVE_STATUSES))}) "
+                "ORDER BY created_at", ACTIVE_STATUSES).fetchall()
+        return [row["id"] for row in rows]
+
+    def set_status(self, job_id: str, status: str, error: str = None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE batch_jobs SET status = ?, error = ?, updated_at = ?, finished_at = ? "
+                "WHERE id = ?",
+                (status, error, now, now if status in FINAL_STATUSES else None, job_id))
+            self._conn.commit()
+
+    def models(self, job_id: str):
+        # 还有未完成请求的模型，按第一次出现的顺序，重启后先继续中断时正在处理的模型
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT model FROM batch_items WHERE job_id = ? GROUP BY model "
+                "HAVING SUM(status = 'pending') > 0 ORDER BY MIN(line)", (job_id,)).fetchall()
+        return [row["model"] for row in rows]
+
+    def pending(self, job_id: str, model: str):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT line, custom_id, request FROM batch_items "
+                "WHERE job_id = ? AND model = ? AND status = 'pending' ORDER BY line",
+                (job_id, model)).fetchall()
+        return [(row["line"], row["custom_id"], json.loads(row["request"])) for row in rows]
+
+    def checkpoint(self, job_id: str, results: list, elapsed: float):
+        # 一个事务写入一批结果和累计运行时间，results: [(line, status, result, tokens)]
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE batch_items SET status = ?, result = ?, tokens = ? "
+                "WHERE job_id = ? AND line = ?",
+                [(status, json.dumps(result, ensure_ascii=False), tokens, job_id, line)
+                 for line, status, result, tokens in results])
+            self._conn.execute(
+                "UPDATE batch_jobs SET elapsed = elapsed + ?, updated_at = ? WHERE id = ?",
+                (elapsed, time.time(), job_id))
+            self._conn.commit()
+
+    def results(self, job_id: str):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT result FROM batch_items WHERE job_id = ? AND status != 'pending' "
+                "ORDER BY line", (job_id,)).fetchall()
+        return [json.loads(row["result"]) for row in rows]
+
+    def delete(self, job_id: str) -> bool:
+        with self._lock:
+            self._conn.execute("DELETE FROM batch_items WHERE job_id = ?", (job_id,))
+            cursor = self._conn.execute("DELETE FROM batch_jobs WHERE id = ?", (job_id,))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def _job(row, counts):
+        job = dict(row)
+        done = failed = tokens = 0
+        models = {}
+        for count in counts:
+            stats = models.setdefault(count["model"], {"total": 0, "done": 0, "failed": 0})
+            stats["total"] += count["n"]
+            if count["status"] == "done":
+                stats["done"] += count["n"]
+                done += count["n"]
+            elif count["status"] == "failed":
+                stats["failed"] += count["n"]
+                failed += count["n"]
+            tokens += count["tokens"] or 0
+        elapsed = job["elapsed"]
+        processed = done + failed
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        job.update({
+            "done": done,
+            "failed": failed,
+            "progress": int(processed * 100 / job["total"]) if job["total"] else 100,
+            "requests_per_second": round(rate, 3),
+            "tokens_per_second": round(tokens / elapsed, 1) if elapsed > 0 else 0.0,
+            "completion_tokens": tokens,
+            "eta": round((job["total"] - processed) / rate, 1) if rate > 0 else None,
+            "models": models
+        })
+        return job
+
+
+class BatchRunner:
+    """按提交顺序逐个执行批量任务：同一任务内按模型分组依次处理，避免来回切换模型，
+    每个模型内最多concurrency个请求并发；结果定期写入检查点并追加到输出JSONL。
+    多个worker时通过共享状态中的租约只让一个worker执行，提交和取消通过通知传给它"""
+
+    LEASE_KEY = "batch:runner"
+    CHANNEL = "batch"
+
+    def __init__(self, store: BatchStore, run, output_dir: str, state: StateStore,
+                 concurrency: int = 2, max_attempts: int = 3, checkpoint_interval: float = 1.0,
+                 lease: float = 30.0):
+        # run(request) -> {"content", "usage", ...}，由调用方经过调度器和后端池执行
+        self.store = store
+        self.run = run
+        self.output_dir = output_dir
+        self.state = state
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.checkpoint_interval = checkpoint_interval
+        self.lease = lease
+        self.owner = uuid.uuid4().hex
+        self._wake = asyncio.Event()
+        self._worker = None
+        self._current = None
+        self._cancelled = set()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def output_path(self, job_id: str) -> str:
+        return os.path.join(self.output_dir, f"{job_id}.jsonl")
+
+    async def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+            # 主动交出租约，其他worker不用等租约过期就能接手
+            await self.state.update(
+                self.LEASE_KEY, lambda lease: None if lease and lease["owner"] == self.owner
+                else lease)
+
+    async def submit(self, items: list) -> str:
+        job_id = await asyncio.to_thread(self.store.create, items)
+        await self.state.publish(self.CHANNEL, {"submitted": job_id})
+        return job_id
+
+    async def cancel(self, job_id: str) -> bool:
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return False
+        await asyncio.to_thread(self.store.set_status, job_id, "cancelled")
+        await self.state.publish(self.CHANNEL, {"cancelled": job_id})
+        return True
+
+    async def _lead(self) -> bool:
+        # 获取或续期租约；租约属于其他worker且未过期时返回False
+        now = time.time()
+
+        def lead(lease):
+            if lease and lease["owner"] != self.owner and lease["expires_at"] > now:
+                return lease
+            return {"owner": self.owner, "expires_at": now + self.lease}
+
+        return (await self.state.update(self.LEASE_KEY, lead))["owner"] == self.owner
+
+    async def _listen(self, events):
+        while True:
+            message = await events.get()
+            job_id = message.get("cancelled")
+            if job_id is not None and self._current is not None and self._current[0] == job_id:
+                self._cancelled.add(job_id)
+                self._current[1].cancel()
+            self._wake.set()
+
+    async def _renew(self, job_id, task):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if not await self._lead():
+                # 续期失败（例如本worker卡住超过租约时间），任务保持running由新的执行者继续
+                logger.warning("批量任务 %s 的执行权被其他worker接手", job_id)
+                self._cancelled.add(job_id)
+                task.cancel()
+                return
+
+    async def _loop(self):
+        async with self.state.subscribe(self.CHANNEL) as events:
+            listener = asyncio.create_task(self._listen(events))
+            try:
+                while True:
+                    self._wake.clear()
+                    jobs = []
+                    if await self._lead():
+                        # 包括重启前没有完成的任务
+                        jobs = await asyncio.to_thread(self.store.unfinished)
+                    if jobs:
+                        await self._execute_job(jobs[0])
+                        continue
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), self.lease / 2)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                listener.cancel()
+
+    async def _execute_job(self, job_id: str):
+        task = asyncio.create_task(self._run_job(job_id))
+        renew = asyncio.create_task(self._renew(job_id, task))
+        self._current = (job_id, task)
+        try:
+            await task
+        except asyncio.CancelledError:
+            # 只吞掉取消任务或交出执行权引起的取消；服务关闭时任务保持running，重启后继续
+            if job_id not in self._cancelled:
+                raise
+        except Exception as e:
+            logger.exception("批量任务 %s 失败", job_id)
+            await asyncio.to_thread(self.store.set_status, job_id, "failed", str(e))
+        finally:
+            renew.cancel()
+            self._current = None
+            self._cancelled.discard(job_id)
+
+    async def _run_job(self, job_id: str):
+        await asyncio.to_thread(self.store.set_status, job_id, "running")
+        path = self.output_path(job_id)
+        # 输出文件由检查点重建，上次中断时写了一半的结果不会重复
+        done = await asyncio.to_thread(self.store.results, job_id)
+        await asyncio.to_thread(self._write, path, done, "w")
+
+        for model in await asyncio.to_thread(self.store.models, job_id):
+            items = await asyncio.to_thread(self.store.pending, job_id, model)
+            logger.info("批量任务 %s: 模型 %s 剩余 %d 个请求", job_id, model, len(items))
+            await self._run_model(job_id, path, items)
+
+        await asyncio.to_thread(self.store.set_status, job_id, "completed")
+
+    async def _run_model(self, job_id: str, path: str, items: list):
+        results = []
+        last_checkpoint = time.monotonic()
+        queue = iter(items)
+
+        async def flush():
+            nonlocal last_checkpoint
+            batch = results[:]
+            results.clear()
+            now = time.monotonic()
+            elapsed, last_checkpoint = now - last_checkpoint, now
+            await asyncio.to_thread(self.store.checkpoint, job_id, batch, elapsed)
+            await asyncio.to_thread(self._write, path, [r[2] for r in batch], "a")
+
+        async def worker():
+            for line, custom_id, request in queue:
+                results.append(await self._execute(line, custom_id, request))
+                if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                    await flush()
+
+        try:
+            await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+        finally:
+            # 取消时也保存已经完成的结果
+            if results:
+                await asyncio.shield(flush())
+
+    async def _execute(self, line, custom_id, request):
+        result = {"custom_id": custom_id, "line": line, "model": request["model"]}
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                response = await self.run(request)
+                result.update(status="ok", response=response)
+                return line, "done", result, response.get("usage", {}).get("eval_count") or 0
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    result.update(status="error", error=str(e))
+                    return line, "failed", result, 0
+                logger.warning("批量请求第%d次失败，稍后重试: %s", attempt, e)
+                await asyncio.sleep(2 ** attempt)
+
+    @staticmethod
+    def _write(path, results, mode):
+        with open(path, mode, encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
@@ -0,0 +1,1490 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import HTMLResponse, StreamingResponse
+
+# 本地基准测试：用一个假的Ollama服务代替GPU，测量api.py的性能
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def create_fake_ollama(tokens=50, token_delay=0.02, load_delay=0.0,
+                       prompt_delay=0.0, think_tokens=0, pull_delay=0.05, num_ctx=0,
+                       parallel=0, latency=0.0, echo=False, embed_delay=0.005,
+                       embed_dim=1024, max_loaded=1, model_sizes=None, token_delays=None):
+    fake = FastAPI()
+    # 模拟Ollama同时驻留max_loaded个模型，加载新模型时换出最久未用的，需要额外的加载时间
+    fake.state.loaded = OrderedDict()
+    sizes = model_sizes or {}
+    # 正在生成的模型及其占用，用于检查同时运行的模型总大小
+    fake.state.active = {}
+    fake.state.peak_bytes = 0
+    fake.state.swaps = 0
+    # 模拟KV缓存：只有和上一次请求（含生成内容）不同的后缀需要计算，按字符计时
+    fake.state.kv = ""
+    fake.state.truncated = 0
+    fake.state.requests = 0
+    # 模拟OLLAMA_NUM_PARALLEL：同时只处理parallel个请求，0表示不限制
+    slots = asyncio.Semaphore(parallel) if parallel else None
+
+    async def load_model(model):
+        # 返回加载耗时，已驻留的模型为0
+        if model in fake.state.loaded:
+            fake.state.loaded.move_to_end(model)
+            return 0.0
+        fake.state.loaded[model] = True
+        while len(fake.state.loaded) > max_loaded:
+            fake.state.loaded.popitem(last=False)
+        fake.state.swaps += 1
+        fake.state.kv = ""
+        await asyncio.sleep(load_delay)
+        return load_delay
+
+    def render(messages):
+        return "".join(f"{m['role']}:{m['content']}\n" for m in messages)
+
+    async def evaluate_prompt(prompt):
+        if num_ctx and len(prompt) > num_ctx * 4:
+            # 超出上下文长度时Ollama截断提示词，前缀变化，KV缓存失效，截断后的内容全部重新计算
+            fake.state.truncated += 1
+            await asyncio.sleep(num_ctx * 4 * prompt_delay)
+            return len(prompt) - num_ctx * 4
+        cached = 0
+        for a, b in zip(prompt, fake.state.kv):
+            if a != b:
+                break
+            cached += 1
+        await asyncio.sleep((len(prompt) - cached) * prompt_delay)
+        return cached
+
+    def output_pieces(messages=()):
+        pieces = []
+        if echo:
+            # 回答以问题开头，基准测试可以据此判断缓存命中的是不是同一个问题
+            users = [m["content"] for m in messages if m["role"] == "user"]
+            pieces.append(f"re: {users[-1] if users else ''}\n")
+        if think_tokens:
+            pieces.append("<think>")
+            pieces.extend(f"thought{i} " for i in range(think_tokens))
+            pieces.append("</think>")
+        pieces.extend(f"tok{i} " for i in range(tokens))
+        return pieces
+
+    @fake.post("/api/chat")
+    async def fake_chat(body: dict):
+        fake.state.requests += 1
+        if slots is not None:
+            await slots.acquire()
+        try:
+            return await generate(body)
+        except BaseException:
+            if slots is not None:
+                slots.release()
+            raise
+
+    def begin(model):
+        fake.state.active[model] = fake.state.active.get(model, 0) + 1
+        fake.state.peak_bytes = max(fake.state.peak_bytes, sum(
+            sizes.get(m, 0) for m, n in fake.state.active.items() if n))
+
+    def end(model):
+        fake.state.active[model] -= 1
+
+    async def generate(body):
+        begin(body["model"])
+        try:
+            response = await respond(body)
+        except BaseException:
+            end(body["model"])
+            raise
+        if not isinstance(response, StreamingResponse):
+            end(body["model"])
+        return response
+
+    async def respond(body):
+        # latency: 每个请求固定的额外延迟（网络、调度等），与提示词长度无关
+        await asyncio.sleep(latency)
+        loaded = await load_model(body["model"])
+        # 不同模型的生成速度可以不同
+        delay = (token_delays or {}).get(body["model"], token_delay)
+        prompt = render(body.get("messages", []))
+        cached = await evaluate_prompt(prompt)
+        pieces = output_pieces(body.get("messages", []))
+        fake.state.kv = prompt + "assistant:" + "".join(pieces) + "\n"
+        final = {
+            "model": body["model"],
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "prompt_eval_count": len(prompt) - cached,
+            "eval_count": len(pieces),
+            "eval_duration": int(len(pieces) * delay * 1e9),
+            "load_duration": int(loaded * 1e9)
+        }
+
+        async def stream():
+            try:
+                for piece in pieces:
+                    await asyncio.sleep(delay)
+                    yield json.dumps({
+                        "model": body["model"],
+                        "message": {"role": "assistant", "content": piece},
+                        "done": False
+                    }) + "\n"
+                yield json.dumps(final) + "\n"
+            finally:
+                end(body["model"])
+                if slots is not None:
+                    slots.release()
+
+        if body.get("stream", True):
+            return StreamingResponse(stream(), media_type="application/x-ndjson")
+        await asyncio.sleep(len(pieces) * delay)
+        if slots is not None:
+            slots.release()
+        final["message"]["content"] = "".join(pieces)
+        return final
+
+    @fake.post("/api/generate")
+    async def fake_generate(body: dict):
+        # 只模拟不带prompt的预加载请求
+        await load_model(body["model"])
+        return {"model": body["model"], "response": "", "done": True, "done_reason": "load"}
+
+    @fake.post("/api/embed")
+    async def fake_embed(body: dict):
+        # 词袋哈希向量：用词相同的问题相似度高，换个说法（加减几个词）相似度略低
+        await asyncio.sleep(embed_delay)
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        embeddings = []
+        for text in inputs:
+            vector = [0.0] * embed_dim
+            for word in re.findall(r"\w+", text.lower()):
+                vector[zlib.crc32(word.encode("utf-8")) % embed_dim] += 1.0
+            embeddings.append(vector)
+        return {"model": body["model"], "embeddings": embeddings}
+
+    @fake.post("/api/pull")
+    async def fake_pull(body: dict):
+        # 两个层，每层分10次报告进度
+        async def stream():
+            yield json.dumps({"status": "pulling manifest"}) + "\n"
+            for layer in ("sha256:aaaa", "sha256:bbbb"):
+                for step in range(1, 11):
+                    await asyncio.sleep(pull_delay)
+                    yield json.dumps({"status": f"pulling {layer[7:]}", "digest": layer,
+                                      "total": 1000, "completed": step * 100}) + "\n"
+            for status in ("verifying sha256 digest", "writing manifest", "success"):
+                yield json.dumps({"status": status}) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @fake.get("/api/tags")
+    async def fake_tags():
+        # 假服务上什么模型都能运行，列出基准测试用到的名字
+        names = ["fake:latest"] + [f"model-{i}" for i in range(8)]
+        return {"models": [{"name": name, "model": name, "size": sizes.get(name, 0)}
+                           for name in names]}
+
+    @fake.get("/api/ps")
+    async def fake_ps():
+        return {"models": [{"name": name, "model": name, "size_vram": sizes.get(name, 0)}
+                           for name in fake.state.loaded]}
+
+    @fake.get("/_stats")
+    async def fake_stats():
+        return {"swaps": fake.state.swaps, "truncated": fake.state.truncated,
+                "requests": fake.state.requests, "peak_active_bytes": fake.state.peak_bytes}
+
+    return fake
+
+
+def results_page(query, num_results=30, filler=0, link_base="https://example.com"):
+    # 结构与html.duckduckgo.com相同的结果页，filler为每条结果附加的无关标记数量
+    items = []
+    for i in range(num_results):
+        items.append(f"""
+<div class="result results_links web-result">
+  <div class="links_main links_deep result__body">
+    <h2 class="result__title"><a class="result__a" href="https://example.com/{i}">{query} 结果 {i}</a></h2>
+    <a class="result__snippet" href="https://example.com/{i}">关于 {query} 的第 {i} 条摘要，<b>{query}</b> 相关内容。</a>
+    <div class="result__extras"><a class="result__url" href="{link_base}/{query.replace(' ', '-')}/{i}">example.com/{i}</a></div>
+    {'<span class="filler">x</span>' * filler}
+  </div>
+</div>""")
+    return f"""<!DOCTYPE html><html><head><title>{query}</title></head>
+<body><div id="links" class="results">{''.join(items)}</div></body></html>"""
+
+
+def create_stub_search(delay=0.05, page_delay=0.1, link_base=None):
+    stub = FastAPI()
+    stub.state.requests = 0
+
+    @stub.get("/html/", response_class=HTMLResponse)
+    async def html_search(q: str):
+        stub.state.requests += 1
+        await asyncio.sleep(delay)
+        return results_page(q, link_base=link_base or "https://example.com")
+
+    @stub.get("/page/{query}/{index}", response_class=HTMLResponse)
+    async def result_page(query: str, index: int):
+        await asyncio.sleep(page_delay)
+        paragraphs = "".join(f"<p>{query} 第{index}页第{i}段：关于 {query} 的详细说明。</p>"
+                             for i in range(40))
+        return f"<html><body><nav>导航</nav><article>{paragraphs}</article><script>x()</script></body></html>"
+
+    @stub.get("/_stats")
+    async def stub_stats():
+        return {"requests": stub.state.requests}
+
+    return stub
+
+
+class ServerThread:
+    def __init__(self, app, port):
+        self.server = uvicorn.Server(uvicorn.Config(
+            app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.url = f"http://127.0.0.1:{port}"
+        # 服务所在的事件循环，可以用run_coroutine_threadsafe在里面运行探测任务
+        self.loop = None
+
+    def _run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        await self.server.serve()
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def start_stack(env=None, **fake_kwargs):
+    # 先启动假Ollama，再通过OLLAMA_HOST让api.py连到它；api.py在导入时读取配置
+    fake = ServerThread(create_fake_ollama(**fake_kwargs), free_port())
+    os.environ["OLLAMA_HOST"] = fake.url
+    os.environ.update(env or {})
+    import api
+    return fake, ServerThread(api.app, free_port())
+
+
+async def stream_chat(http, url, model="fake:latest", content="hello"):
+    start = time.perf_counter()
+    ttft = None
+    async with http.stream("POST", f"{url}/chat", json={
+        "model": model,
+        "messages": [{"role": "user", "content": content}],
+        "stream": True
+    }) as response:
+        if response.status_code != 200:
+            return None, time.perf_counter() - start
+        async for line in response.aiter_lines():
+            if line.startswith("data: ") and ttft is None and '"content"' in line:
+                ttft = time.perf_counter() - start
+    return ttft, time.perf_counter() - start
+
+
+async def run_concurrency(url, concurrency):
+    async with httpx.AsyncClient(timeout=None) as http:
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *[stream_chat(http, url) for _ in range(concurrency)])
+        wall = time.perf_counter() - start
+    ttfts = sorted(r[0] for r in results)
+    totals = sorted(r[1] for r in results)
+    return {
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "max_ttft_s": round(ttfts[-1], 3),
+        "mean_total_s": round(sum(totals) / len(totals), 3)
+    }
+
+
+def bench_chat_concurrency(args):
+    # 不让调度器限流，只测事件循环本身能否并行处理多个流
+    fake, api_server = start_stack(env={"SCHEDULER_MAX_INFLIGHT": str(args.concurrency)},
+                                   tokens=args.tokens, token_delay=args.token_delay)
+    with fake, api_server:
+        single = asyncio.run(run_concurrency(api_server.url, 1))
+        parallel = asyncio.run(run_concurrency(api_server.url, args.concurrency))
+    print(json.dumps({"single": single, "parallel": parallel}, indent=2))
+    # 单个worker下如果事件循环没有被阻塞，并发的总耗时应接近单个流的耗时
+    print(f"并行/单流耗时比: {parallel['wall_s'] / single['wall_s']:.2f}")
+
+
+def bench_scheduler(args):
+    fake, api_server = start_stack(tokens=args.tokens, token_delay=args.token_delay,
+                                   load_delay=args.load_delay)
+    models = [f"model-{i}" for i in range(args.models)]
+
+    async def run():
+        async with httpx.AsyncClient(timeout=None) as http:
+            start = time.perf_counter()
+            results = await asyncio.gather(*[
+                stream_chat(http, api_server.url, model=models[i % len(models)])
+                for i in range(args.requests)])
+            wall = time.perf_counter() - start
+            stats = (await http.get(f"{api_server.url}/scheduler/stats")).json()
+            swaps = (await http.get(f"{fake.url}/_stats")).json()["swaps"]
+        return {
+            "wall_s": round(wall, 3),
+            "rejected": sum(1 for ttft, _ in results if ttft is None),
+            "model_swaps": swaps,
+            "scheduler": stats
+        }
+
+    with fake, api_server:
+        print(json.dumps(asyncio.run(run()), indent=2))
+
+
+def bench_cache(args):
+    cache_dir = tempfile.mkdtemp()
+    fake, api_server = start_stack(
+        env={"RESPONSE_CACHE": "1",
+             "RESPONSE_CACHE_PATH": os.path.join(cache_dir, "cache.sqlite3")},
+        tokens=args.tokens, token_delay=args.token_delay)
+
+    async def run():
+        async with httpx.AsyncClient(timeout=None) as http:
+            cold, warm = [], []
+            for i in range(args.prompts):
+                cold.append(await stream_chat(http, api_server.url, content=f"prompt {i}"))
+            for i in range(args.prompts):
+                warm.append(await stream_chat(http, api_server.url, content=f"prompt {i}"))
+            stats = (await http.get(f"{api_server.url}/cache/stats")).json()
+        mean = lambda xs: round(sum(xs) / len(xs) * 1000, 2)
+        return {
+            "cold_ttft_ms": mean([r[0] for r in cold]),
+            "cold_total_ms": mean([r[1] for r in cold]),
+            "warm_ttft_ms": mean([r[0] for r in warm]),
+            "warm_total_ms": mean([r[1] for r in warm]),
+            "cache": stats
+        }
+
+    with fake, api_server:
+        print(json.dumps(asyncio.run(run()), indent=2))
+
+
+async def read_stream(response, start):
+    ttft = None
+    text = ""
+    async for line in response.aiter_lines():
+        if line.startswith("data: "):
+            data = json.loads(line[6:])
+            if "content" in data:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                text += data["content"]
+    return ttft, text
+
+
+def bench_sessions(args):
+    fake, api_server = start_stack(tokens=args.tokens, token_delay=args.token_delay,
+                                   prompt_delay=args.prompt_delay, think_tokens=args.think_tokens)
+
+    async def resend_everything(http):
+        # 旧的webui方式：每轮发送完整历史，保存回答时去掉<think>部分
+        history, ttfts = [], []
+        for turn in range(args.turns):
+            history.append({"role": "user", "content": f"question {turn}"})
+            start = time.perf_counter()
+            async with http.stream("POST", f"{api_server.url}/chat", json={
+                "model": "fake:latest", "messages": history, "stream": True
+            }) as response:
+                ttft, text = await read_stream(response, start)
+            ttfts.append(ttft)
+            history.append({"role": "assistant", "content": text.split("</think>")[-1].strip()})
+        return ttfts
+
+    async def session_turns(http):
+        created = await http.post(f"{api_server.url}/sessions", json={"model": "fake:latest"})
+        session_id = created.json()["id"]
+        ttfts = []
+        for turn in range(args.turns):
+            start = time.perf_counter()
+            async with http.stream("POST", f"{api_server.url}/sessions/{session_id}/messages", json={
+                "content": f"question {turn}", "stream": True
+            }) as response:
+                ttft, _ = await read_stream(response, start)
+            ttfts.append(ttft)
+        return ttfts
+
+    async def run():
+        async with httpx.AsyncClient(timeout=None) as http:
+            resend = await resend_everything(http)
+            session = await session_turns(http)
+        ms = lambda xs: [round(x * 1000, 1) for x in xs]
+        return {
+            "resend_ttft_ms": ms(resend),
+            "session_ttft_ms": ms(session),
+            "resend_total_ttft_ms": round(sum(resend) * 1000, 1),
+            "session_total_ttft_ms": round(sum(session) * 1000, 1)
+        }
+
+    with fake, api_server:
+        print(json.dumps(asyncio.run(run()), indent=2))
+
+
+def bench_search(args):
+    stub = ServerThread(create_stub_search(delay=args.delay), free_port())
+    fake, api_server = start_stack(env={"SEARCH_URL": f"{stub.url}/html/"})
+
+    async def timed(coro):
+        start = time.perf_counter()
+        await coro
+        return time.perf_counter() - start
+
+    async def run():
+        async with httpx.AsyncClient(timeout=None) as http:
+            queries = [f"query {i}" for i in range(args.queries)]
+            search = lambda q: http.post(f"{api_server.url}/search", json={"query": q})
+            cold = await timed(asyncio.gather(*[search(q) for q in queries]))
+            warm = await timed(asyncio.gather(*[search(q) for q in queries]))
+            batch_queries = [f"batch {i}" for i in range(args.batch)]
+            batch = await timed(http.post(f"{api_server.url}/search/batch",
+                                          json={"queries": batch_queries}))
+            upstream = (await http.get(f"{stub.url}/_stats")).json()["requests"]
+        return {
+            "cold_qps": round(args.queries / cold, 1),
+            "warm_qps": round(args.queries / warm, 1),
+            f"batch_{args.batch}_queries_ms": round(batch * 1000, 1),
+            "upstream_requests": upstream
+        }
+
+    with stub, fake, api_server:
+        print(json.dumps(asyncio.run(run()), indent=2))
+
+
+# 真实的DuckDuckGo结果页，用 parse --record 录制；合成页面的结构过于规整，只在没有录制时使用
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "fixtures", "duckduckgo")
+RECORD_QUERIES = ["python asyncio tutorial", "deepseek r1 本地部署", "fastapi server sent events",
+                  "ollama gpu memory", "sqlite wal mode", "北京 天气", "rust vs go performance",
+                  "how to make sourdough bread"]
+
+# 子进程中运行一个解析后端：ru_maxrss包含C扩展（lxml、selectolax）内部的分配；
+# 后端为"-"时只读入页面不解析，作为基线
+PARSE_RSS_CODE = """
+import json, resource, sys
+import parsers
+pages = json.load(sys.stdin)
+if sys.argv[1] != "-":
+    for page in pages:
+        parsers.BACKENDS[sys.argv[1]](page, int(sys.argv[2]))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def parse_peak_rss(backend, pages, num_results):
+    # Linux上ru_maxrss的单位是KB
+    return int(subprocess.run(
+        [sys.executable, "-c", PARSE_RSS_CODE, backend, str(num_results)],
+        input=json.dumps(pages), capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout)
+
+
+def record_result_pages(directory, queries):
+    from search import HEADERS, SEARCH_URL
+
+    os.makedirs(directory, exist_ok=True)
+    with httpx.Client(headers=HEADERS, timeout=15, follow_redirects=True) as client:
+        for query in queries:
+            response = client.get(SEARCH_URL, params={"q": query})
+            response.raise_for_status()
+            name = re.sub(r"\W+", "-", query).strip("-").lower()
+            with open(os.path.join(directory, f"{name}.html"), "w", encoding="utf-8") as f:
+                f.write(response.text)
+            time.sleep(1)
+
+
+def load_result_pages(directory):
+    if not os.path.isdir(directory):
+        return []
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".html"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                pages.append(f.read())
+    return pages
+
+
+def bench_parse(args):
+    import parsers
+
+    if args.record:
+        record_result_pages(args.fixtures, RECORD_QUERIES)
+    pages = load_result_pages(args.fixtures)
+    source = "recorded"
+    if not pages:
+        print(f"{args.fixtures} 中没有录制的结果页，使用合成页面；用 parse --record 录制",
+              file=sys.stderr)
+        pages = [results_page(f"query {i}", num_results=30, filler=args.filler)
+                 for i in range(args.pages)]
+        source = "synthetic"
+    report = {"pages": len(pages), "source": source,
+              "page_kb": round(sum(len(p) for p in pages) / len(pages) / 1024, 1)}
+    baseline = parse_peak_rss("-", pages, args.num_results)
+    report["baseline_rss_kb"] = baseline
+    for name in parsers.available_backends():
+        parse = parsers.BACKENDS[name]
+        parse(pages[0], args.num_results)
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for page in pages:
+                parse(page, args.num_results)
+        elapsed = time.perf_counter() - start
+        peak = parse_peak_rss(name, pages, args.num_results)
+        report[name] = {
+            "ms_per_page": round(elapsed / (args.rounds * len(pages)) * 1000, 3),
+            "peak_rss_kb": peak,
+            # 相对只读入页面的进程多占用的峰值内存，包括导入解析库本身
+            "rss_over_baseline_kb": peak - baseline
+        }
+    print(json.dumps(report, indent=2))
+
+
+def bench_rag(args):
+    port = free_port()
+    stub = ServerThread(create_stub_search(delay=args.search_delay, page_delay=args.page_delay,
+                                           link_base=f"http://127.0.0.1:{port}/page"), port)
+    fake, api_server = start_stack(env={"SEARCH_URL": f"{stub.url}/html/",
+                                        "WEB_FETCH_ALLOW_PRIVATE": "1"},
+                                   tokens=args.tokens, token_delay=0.001)
+
+    async def ttft(http, web_search, content):
+        start = time.perf_counter()
+        async with http.stream("POST", f"{api_server.url}/chat", json={
+            "model": "fake:latest",
+            "messages": [{"role": "user", "content": content}],
+            "web_search": web_search,
+            "search_results": args.results,
+            "cache": False,
+            "stream": True
+        }) as response:
+            first, _ = await read_stream(response, start)
+        return first
+
+    async def run():
+        async with httpx.AsyncClient(timeout=None) as http:
+            plain = [await ttft(http, False, f"q{i}") for i in range(args.rounds)]
+            web = [await ttft(http, True, f"q{i}") for i in range(args.rounds)]
+        mean = lambda xs: round(sum(xs) / len(xs) * 1000, 1)
+        return {
+            "plain_ttft_ms": mean(plain),
+            "web_ttft_ms": mean(web),
+            # 串行搜索再逐个抓取网页时额外增加的延迟
+            "serial_fetch_estimate_ms": round((args.search_delay + args.results * args.page_delay) * 1000, 1)
+        }
+
+    with stub, fake, api_server:
+        print(json.dumps(asyncio.run(run()), indent=2))
+
+
+def bench_think_parser(args):
+    from think_parser import ThinkStreamParser
+
+    # 合成的deepseek-r1输出：长推理过程 + 回答，按token切分，标签会被切开
+    tokens = ["<th", "ink>\n"]
+    tokens += [f"step{i} " for i in range(args.tokens - args.answer_tokens)]
+    tokens += ["</", "think>\n\n"]
+    tokens += [f"word{i} " for i in range(args.answer_tokens)]
+
+    def old_client():
+        # 原来webui的做法：每个token拼接完整字符串并重新扫描标签
+        full_response = ""
+        thought_extracted = False
+        for content in tokens:
+            full_response += content
+            if not thought_extracted and "<think>" in full_response and "</think>" in full_response:
+                parts = full_response.split("</think>")
+                full_response = parts[1].strip()
+                thought_extracted = True
+        return full_response
+
+    def incremental():
+        parser = ThinkStreamParser()
+        answer = []
+        for content in tokens:
+            for kind, delta in parser.feed(content):
+                if kind == "answer":
+                    answer.append(delta)
+        parser.flush()
+        return "".join(answer)
+
+    report = {"tokens": len(tokens)}
+    for name, func in (("rescan_full_string", old_client), ("incremental_parser", incremental)):
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            func()
+        elapsed = (time.perf_counter() - start) / args.rounds
+        report[name] = {"ms_total": round(elapsed * 1000, 2),
+                        "us_per_token": round(elapsed / len(tokens) * 1e6, 3)}
+    print(json.dumps(report, indent=2))
+
+
+def bench_render(args):
+    from render import StreamRenderer
+
+    # 模拟一段带标题、列表和代码块的长回答，按token切分
+    paragraphs = []
+    for i in range(args.paragraphs):
+        if i % 4 == 3:
+            paragraphs.append("```python\n" + "\n\n".join(f"x{j} = {j}" for j in range(5)) + "\n```")
+        else:
+            paragraphs.append(f"### 第{i}段\n" + " ".join(f"word{i}_{j}" for j in range(args.words)))
+    answer = "\n\n".join(paragraphs)
+    tokens = [answer[i:i + 4] for i in range(0, len(answer), 4)]
+
+    class FakePlaceholder:
+        # 代替st.empty()：统计每次更新推送的字节数，并做一次和Streamlit类似的序列化
+        def __init__(self, stats):
+            self.stats = stats
+
+        def markdown(self, text):
+            self.stats["renders"] += 1
+            self.stats["bytes"] += len(json.dumps({"markdown": {"body": text}}).encode("utf-8"))
+
+    class FakeContainer:
+        def __init__(self, stats):
+            self.stats = stats
+
+        def empty(self):
+            self.stats["elements"] += 1
+            return FakePlaceholder(self.stats)
+
+    class FakeClock:
+        # 按token间隔推进的时钟，结果不受本机速度影响
+        def __init__(self):
+            self.now = 0.0
+
+        def __call__(self):
+            return self.now
+
+    def per_chunk(stats):
+        placeholder = FakeContainer(stats).empty()
+        full_response = ""
+        for token in tokens:
+            full_response += token
+            placeholder.markdown(full_response)
+
+    def throttled(stats):
+        clock = FakeClock()
+        renderer = StreamRenderer(FakeContainer(stats), interval=args.interval, clock=clock)
+        for token in tokens:
+            clock.now += args.token_delay
+            renderer.feed(token)
+        renderer.finish()
+        assert renderer.text == answer
+
+    report = {"tokens": len(tokens), "answer_bytes": len(answer.encode("utf-8"))}
+    for name, func in (("per_chunk", per_chunk), ("throttled_blocks", throttled)):
+        stats = {"renders": 0, "bytes": 0, "elements": 0}
+        start = time.process_time()
+        func(stats)
+        cpu = time.process_time() - start
+        report[name] = {**stats, "cpu_ms": round(cpu * 1000, 2),
+                        "bytes_per_answer_byte": round(stats["bytes"] / report["answer_bytes"], 1)}
+    print(json.dumps(report, indent=2))
+
+
+def bench_history(args):
+    store_dir = tempfile.mkdtemp()
+    fake, api_server = start_stack(
+        env={"CHAT_STORE_PATH": os.path.join(store_dir, "chats.sqlite3")})
+
+    def fake_message(i):
+        if i % 2 == 0:
+            return {"role": "user", "content": f"question {i} " + "lorem ipsum " * 10}
+        return {"role": "assistant", "content": f"answer {i}\n\n" + "dolor sit amet " * 60,
+                "thought": "thinking " * 40, "sources": []}
+
+    def render(messages):
+        # 代替st.chat_message + st.markdown：统计每次运行脚本要推送的元素和字节数
+        sent = 0
+        for message in messages:
+            for body in (message.get("thought"), message["content"]):
+                if body:
+                    sent += len(json.dumps({"markdown": {"body": body}}).encode("utf-8"))
+        return sent
+
+    def timed(func, rounds):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            result = func()
+        return round((time.perf_counter() - start) / rounds * 1000, 2), result
+
+    report = {}
+    with fake, api_server, httpx.Client(base_url=api_server.url, timeout=None) as http:
+        for size in args.sizes:
+            chat = http.post("/chats", json={"name": f"bench {size}", "model": "fake:latest"}).json()
+            messages = [fake_message(i) for i in range(size)]
+            for i in range(0, size, 500):
+                http.post(f"/chats/{chat['id']}/messages", json={"messages": messages[i:i + 500]})
+
+            # 原来的方式：全部消息在session_state中，每次运行脚本都重新渲染整个对话
+            full_ms, full_bytes = timed(lambda: render(messages), args.rounds)
+
+            # 打开对话（刷新页面）时：读取对话列表 + 最近一页消息
+            def open_chat():
+                http.get("/chats").raise_for_status()
+                page = http.get(f"/chats/{chat['id']}/messages").json()
+                return page["messages"], render(page["messages"])
+
+            open_ms, (window, _) = timed(open_chat, args.rounds)
+            # 之后每次运行脚本只渲染内存中已加载的窗口
+            rerun_ms, window_bytes = timed(lambda: render(window), args.rounds)
+            report[size] = {
+                "render_all_ms": full_ms,
+                "render_all_bytes": full_bytes,
+                "open_chat_ms": open_ms,
+                "rerun_window_ms": rerun_ms,
+                "rerun_window_bytes": window_bytes,
+                "window_messages": len(window)
+            }
+    print(json.dumps(report, indent=2))
+
+
+def bench_context(args):
+    # 假Ollama的上下文长度和预算一致，不裁剪时超出部分会被Ollama截断
+    fake, api_server = start_stack(tokens=args.tokens, token_delay=args.token_delay,
+                                   prompt_delay=args.prompt_delay, num_ctx=args.num_ctx)
+    import api
+
+    async def session_turns(http):
+        created = await http.post(f"{api_server.url}/sessions", json={"model": "fake:latest"})
+        session_id = created.json()["id"]
+        turns = []
+        for turn in range(args.turns):
+            start = time.perf_counter()
+            ttft, done = None, {}
+            async with http.stream("POST", f"{api_server.url}/sessions/{session_id}/messages", json={
+                "content": f"question {turn} " + "context " * args.question_words,
+                "stream": True, "typed_events": True
+            }) as response:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data = json.loads(line[6:])
+                    if data.get("type") == "answer_delta" and ttft is None:
+                        ttft = time.perf_counter() - start
+                    elif data.get("type") == "done":
+                        done = data
+            turns.append((ttft, done["context"]["prompt_tokens"],
+                          done["usage"].get("prompt_eval_count", 0)))
+        # 等后台总结完成
+        await asyncio.sleep(0.5)
+        return turns
+
+    def summarize(turns):
+        ms = [t[0] * 1000 for t in turns]
+        tokens = [t[1] for t in turns]
+        return {
+            "prompt_tokens_first": tokens[0],
+            "prompt_tokens_max": max(tokens),
+            "prompt_tokens_last": tokens[-1],
+            "evaluated_chars_total": sum(t[2] for t in turns),
+            "ttft_ms_first_10": round(sum(ms[:10]) / len(ms[:10]), 1),
+            "ttft_ms_last_10": round(sum(ms[-10:]) / len(ms[-10:]), 1)
+        }
+
+    async def run():
+        report = {}
+        async with httpx.AsyncClient(timeout=None) as http:
+            for name, window in (("unbounded", 10 ** 9), ("bounded", args.num_ctx)):
+                api.context_manager.default_tokens = window
+                before = (await http.get(f"{fake.url}/_stats")).json()["truncated"]
+                report[name] = summarize(await session_turns(http))
+                after = (await http.get(f"{fake.url}/_stats")).json()["truncated"]
+                report[name]["truncated_by_ollama"] = after - before
+            report["context"] = (await http.get(f"{api_server.url}/context/stats")).json()
+        return report
+
+    with fake, api_server:
+        print(json.dumps(asyncio.run(run()), indent=2))
+
+
+def bench_backends(args):
+    # 多个假Ollama，每个同时只处理一个请求、一次只驻留一个模型
+    fakes = [ServerThread(create_fake_ollama(
+        tokens=args.tokens, token_delay=args.token_delay, load_delay=args.load_delay,
+        parallel=1), free_port()) for _ in range(args.backends)]
+    os.environ["OLLAMA_HOSTS"] = ",".join(f.url for f in fakes)
+    os.environ["BACKEND_HEALTH_INTERVAL"] = "0.5"
+    import api
+    api_server = ServerThread(api.app, free_port())
+    models = [f"model-{i}" for i in range(args.models)]
+    all_backends = list(api.backend_pool.backends)
+
+    async def run_phase(http, name):
+        before = {f.url: (await http.get(f"{f.url}/_stats")).json() for f in fakes
+                  if f.server.started and not f.server.should_exit}
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            stream_chat(http, api_server.url, model=models[i % len(models)])
+            for i in range(args.requests)])
+        wall = time.perf_counter() - start
+        after = {url: (await http.get(f"{url}/_stats")).json() for url in before}
+        return {
+            "phase": name,
+            "wall_s": round(wall, 3),
+            "failed": sum(1 for ttft, _ in results if ttft is None),
+            "requests_per_backend": {url: after[url]["requests"] - before[url]["requests"]
+                                     for url in before},
+            "model_swaps": sum(after[url]["swaps"] - before[url]["swaps"] for url in before)
+        }
+
+    async def run():
+        report = []
+        async with httpx.AsyncClient(timeout=None) as http:
+            # 只用第一个后端作为对比
+            api.backend_pool.backends = all_backends[:1]
+            report.append(await run_phase(http, "single_backend"))
+            api.backend_pool.backends = all_backends
+            # 等后台健康检查更新各后端状态（连接池属于API服务的事件循环，不能在这里直接调用）
+            await asyncio.sleep(1)
+            report.append(await run_phase(http, "pool"))
+            # 停掉一个后端，健康检查发现之前的请求通过重试切换到其他后端
+            fakes[-1].__exit__()
+            report.append(await run_phase(http, "one_backend_down"))
+            report.append((await http.get(f"{api_server.url}/backends")).json())
+        return report
+
+    for fake in fakes:
+        fake.__enter__()
+    try:
+        with api_server:
+            print(json.dumps(asyncio.run(run()), indent=2))
+    finally:
+        for fake in fakes[:-1]:
+            fake.__exit__()
+
+
+def bench_metrics(args):
+    from metrics import ChatMetrics, Registry
+
+    # 指标本身的开销：每个chunk一次trace.token()，每个请求一次finish()
+    registry = Registry()
+    chat_metrics = ChatMetrics(registry)
+    usage = {"prompt_eval_count": 100, "prompt_eval_duration": 2 * 10 ** 8,
+             "eval_count": args.tokens, "eval_duration": 2 * 10 ** 9}
+    start = time.perf_counter()
+    for i in range(args.rounds):
+        trace = chat_metrics.trace("chat", f"model-{i % 4}")
+        trace.granted(0.01)
+        for _ in range(args.tokens):
+            trace.token()
+        trace.finish("ok", usage)
+    per_request = (time.perf_counter() - start) / args.rounds
+    start = time.perf_counter()
+    body = registry.render()
+    render_ms = (time.perf_counter() - start) * 1000
+
+    # 端到端：通过假Ollama跑一批流式请求，再读取/metrics和/traces
+    fake, api_server = start_stack(tokens=args.tokens, token_delay=0.001)
+
+    async def run():
+        async with httpx.AsyncClient(timeout=None) as http:
+            await asyncio.gather(*[stream_chat(http, api_server.url) for _ in range(args.requests)])
+            text = (await http.get(f"{api_server.url}/metrics")).text
+            traces = (await http.get(f"{api_server.url}/traces", params={"limit": 1})).json()
+        wanted = ("llm_requests_total", "llm_time_to_first_token_seconds_count",
+                  "llm_queue_wait_seconds_sum", "http_requests_total")
+        return {
+            "metrics": [line for line in text.splitlines() if line.startswith(wanted)],
+            "latest_trace": traces["traces"][0]
+        }
+
+    with fake, api_server:
+        report = asyncio.run(run())
+    print(json.dumps({
+        "trace_us_per_request": round(per_request * 1e6, 2),
+        "trace_us_per_token": round(per_request / args.tokens * 1e6, 3),
+        "render_ms": round(render_ms, 3),
+        "render_bytes": len(body),
+        **report
+    }, indent=2, ensure_ascii=False))
+
+
+def bench_batch(args):
+    state_dir = tempfile.mkdtemp()
+    fake, api_server = start_stack(
+        env={"BATCH_STATE_PATH": os.path.join(state_dir, "batches.sqlite3"),
+             "BATCH_OUTPUT_DIR": os.path.join(state_dir, "batches"),
+             "BATCH_CONCURRENCY": str(args.concurrency)},
+        tokens=args.tokens, token_delay=args.token_delay, load_delay=args.load_delay)
+    import api
+    models = [f"model-{i}" for i in range(args.models)]
+    # 夜间任务里不同模型的请求交错出现
+    lines = [{"custom_id": f"req-{i}", "model": models[i % len(models)],
+              "messages": [{"role": "user", "content": f"prompt {i}"}]}
+             for i in range(args.prompts)]
+
+    async def swaps(http):
+        return (await http.get(f"{fake.url}/_stats")).json()["swaps"]
+
+    async def sequential(http):
+        # 现在的做法：逐条调用/chat
+        before = await swaps(http)
+        start = time.perf_counter()
+        for line in lines:
+            response = await http.post(f"{api_server.url}/chat",
+                                       json={**line, "cache": False})
+            response.raise_for_status()
+        wall = time.perf_counter() - start
+        return {"wall_s": round(wall, 3), "requests_per_second": round(len(lines) / wall, 2),
+                "model_swaps": await swaps(http) - before}
+
+    async def batch(http):
+        before = await swaps(http)
+        body = "\n".join(json.dumps(line) for line in lines)
+        start = time.perf_counter()
+        job = (await http.post(f"{api_server.url}/batch", content=body)).json()
+        restarted = False
+        while True:
+            await asyncio.sleep(0.2)
+            status = (await http.get(f"{api_server.url}/batch/{job['id']}")).json()
+            if not restarted and status["progress"] >= 40:
+                # 模拟重启：停掉执行器再启动，从检查点继续
+                loop = api_server.loop
+                asyncio.run_coroutine_threadsafe(api.batch_runner.stop(), loop).result()
+                asyncio.run_coroutine_threadsafe(api.batch_runner.start(), loop).result()
+                restarted = status["done"]
+            if status["status"] in ("completed", "failed", "cancelled"):
+                break
+        wall = time.perf_counter() - start
+        results = (await http.get(f"{api_server.url}/batch/{job['id']}/results")).text
+        ids = [json.loads(line)["custom_id"] for line in results.splitlines()]
+        return {
+            "wall_s": round(wall, 3),
+            "requests_per_second": round(len(lines) / wall, 2),
+            "model_swaps": await swaps(http) - before,
+            "done_before_restart": restarted,
+            "output_lines": len(ids),
+            "unique_results": len(set(ids)),
+            "status": {k: status[k] for k in ("status", "done", "failed", "requests_per_second",
+                                              "tokens_per_second", "models")}
+        }
+
+    async def run():
+        async with httpx.AsyncClient(timeout=None) as http:
+            return {"sequential_chat": await sequential(http), "batch": await batch(http)}
+
+    with fake, api_server:
+        print(json.dumps(asyncio.run(run()), indent=2))
+
+
+def bench_startup(args):
+    # 1. 导入api.py的耗时，以及启动时是否还导入了较重的模块
+    code = ("import sys, time; start = time.perf_counter(); import api; "
+            "print(time.perf_counter() - start, *(m in sys.modules for m in "
+            "('ollama', 'requests', 'bs4')))")
+    state_dir = tempfile.mkdtemp()
+    env = {**os.environ, "OLLAMA_HOST": "http://127.0.0.1:9",
+           "CHAT_STORE_PATH": os.path.join(state_dir, "chats.sqlite3"),
+           "DOWNLOAD_STATE_PATH": os.path.join(state_dir, "downloads.sqlite3"),
+           "BATCH_STATE_PATH": os.path.join(state_dir, "batches.sqlite3"),
+           "BATCH_OUTPUT_DIR": os.path.join(state_dir, "batches")}
+    samples = []
+    for _ in range(args.rounds):
+        output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=True).stdout.split()
+        samples.append(float(output[0]))
+    imports = {"import_ms": round(min(samples) * 1000, 1),
+               "heavy_modules_loaded": dict(zip(("ollama", "requests", "bs4"), output[1:]))}
+
+    # 2. Ollama比API晚启动ollama_delay秒，观察/readyz何时变为就绪，以及预加载对首个请求的影响
+    port = free_port()
+    fake = ServerThread(create_fake_ollama(tokens=args.tokens, token_delay=0.001,
+                                           load_delay=args.load_delay), port)
+    os.environ.update({"OLLAMA_HOST": fake.url, "PRELOAD_MODELS": "fake:latest"})
+    import api
+    api_server = ServerThread(api.app, free_port())
+
+    async def run():
+        async with httpx.AsyncClient(timeout=None) as http:
+            start = time.perf_counter()
+            threading.Timer(args.ollama_delay, fake.__enter__).start()
+            first_200 = None
+            while True:
+                response = await http.get(f"{api_server.url}/readyz")
+                if first_200 is None and (await http.get(f"{api_server.url}/healthz")).is_success:
+                    first_200 = time.perf_counter() - start
+                if response.status_code == 200:
+                    break
+                await asyncio.sleep(0.02)
+            ready = time.perf_counter() - start
+            preloaded, _ = await stream_chat(http, api_server.url, model="fake:latest")
+            cold, _ = await stream_chat(http, api_server.url, model="model-0")
+            return {
+                "healthz_s": round(first_200, 3),
+                "readyz_s": round(ready, 3),
+                # 原来的start.sh：固定sleep 5之后才启动API，第一个请求还要等模型加载
+                "legacy_fixed_wait_s": 5.0,
+                "startup": response.json(),
+                "first_request_ttft_ms": {"preloaded": round(preloaded * 1000, 1),
+                                          "not_preloaded": round(cold * 1000, 1)}
+            }
+
+    with api_server:
+        try:
+            report = asyncio.run(run())
+        finally:
+            fake.__exit__()
+    print(json.dumps({**imports, **report}, indent=2, ensure_ascii=False))
+
+
+def bench_state(args):
+    from state import MemoryState, SQLiteState
+
+    # 1. 各后端的单次操作耗时和通知延迟
+    async def micro(state):
+        start = time.perf_counter()
+        for i in range(args.ops):
+            await state.set(f"k{i % 100}", {"value": i})
+        set_us = (time.perf_counter() - start) / args.ops * 1e6
+        start = time.perf_counter()
+        for i in range(args.ops):
+            await state.update("counter", lambda v: (v or 0) + 1)
+        update_us = (time.perf_counter() - start) / args.ops * 1e6
+        latencies = []
+        async with state.subscribe("bench") as sub:
+            for _ in range(20):
+                start = time.perf_counter()
+                await state.publish("bench", {"t": start})
+                await sub.get(5)
+                latencies.append(time.perf_counter() - start)
+        await state.close()
+        return {"set_us": round(set_us, 1), "update_us": round(update_us, 1),
+                "counter": args.ops, "notify_ms": round(sorted(latencies)[10] * 1000, 2)}
+
+    state_dir = tempfile.mkdtemp()
+    report = {
+        "memory": asyncio.run(micro(MemoryState())),
+        "sqlite": asyncio.run(micro(SQLiteState(os.path.join(state_dir, "micro.sqlite3"))))
+    }
+
+    # 2. 两个uvicorn worker：不复用连接，请求随机落到不同的worker上
+    fake = ServerThread(create_fake_ollama(tokens=5, token_delay=0.001, pull_delay=0.05),
+                        free_port())
+
+    async def multi_worker(url):
+        async with httpx.AsyncClient(
+                timeout=None, limits=httpx.Limits(max_keepalive_connections=0)) as http:
+            errors = 0
+            session = (await http.post(f"{url}/sessions", json={"model": "fake:latest"})).json()
+            for i in range(args.turns):
+                response = await http.post(f"{url}/sessions/{session['id']}/messages",
+                                           json={"content": f"turn {i}"})
+                errors += response.status_code != 200
+            final = await http.get(f"{url}/sessions/{session['id']}")
+            await http.post(f"{url}/models/download/fake:latest")
+            seen = missing = 0
+            while True:
+                response = await http.get(f"{url}/models/download/fake:latest/status")
+                if response.status_code != 200:
+                    missing += 1
+                    if missing > 50:
+                        break
+                else:
+                    seen += 1
+                    if response.json()["status"] in ("completed", "failed", "cancelled"):
+                        break
+                await asyncio.sleep(0.05)
+        return {
+            "turn_errors": errors,
+            "messages": final.json().get("message_count") if final.status_code == 200 else None,
+            "expected_messages": args.turns * 2,
+            "download_status_ok": seen,
+            "download_status_404": missing
+        }
+
+    with fake:
+        for name, url in (("memory", "memory://"),
+                          ("sqlite", f"sqlite:///{os.path.join(state_dir, 'state.sqlite3')}")):
+            port = free_port()
+            env = {**os.environ, "OLLAMA_HOST": fake.url, "STATE_URL": url,
+                   "CHAT_STORE_PATH": os.path.join(state_dir, f"{name}-chats.sqlite3"),
+                   "DOWNLOAD_STATE_PATH": os.path.join(state_dir, f"{name}-downloads.sqlite3"),
+                   "BATCH_STATE_PATH": os.path.join(state_dir, f"{name}-batches.sqlite3"),
+                   "BATCH_OUTPUT_DIR": os.path.join(state_dir, f"{name}-batches"),
+                   "LOG_LEVEL": "WARNING"}
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "api:app", "--port", str(port),
+                 "--workers", "2", "--log-level", "warning"],
+                cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+            try:
+                while True:
+                    try:
+                        httpx.get(f"http://127.0.0.1:{port}/healthz")
+                        break
+                    except httpx.HTTPError:
+                        time.sleep(0.1)
+                # 等两个worker都启动
+                time.sleep(1)
+                report[f"two_workers_{name}"] = asyncio.run(multi_worker(f"http://127.0.0.1:{port}"))
+            finally:
+                server.terminate()
+                server.wait()
+    print(json.dumps(report, indent=2))
+
+
+def paraphrases(count, seed=0):
+    # 每个主题一个基础问题和几种换个说法的问法；主题之间可能只差一个词，用来检查不会误命中
+    rng = random.Random(seed)
+    actions = ["install", "configure", "upgrade", "debug", "secure", "monitor", "backup"]
+    subjects = ["python", "docker", "nginx", "postgres", "redis", "kafka", "rust", "node"]
+    targets = ["ubuntu", "windows", "macos", "kubernetes", "debian", "fedora"]
+    combos = [(a, s, t) for a in actions for s in subjects for t in targets]
+    topics = rng.sample(combos, count)
+    forms = ["How do I {} {} on {}?", "how do i {} {} on {}", "Please, how do I {} {} on {}?",
+             "How do I {} {} on {} please?", "Hi! How do I {} {} on {}?"]
+    return [[form.format(*topic) for form in forms] for topic in topics]
+
+
+def bench_semantic(args):
+    import numpy as np
+    from semantic_cache import SemanticCache, SemanticIndex
+
+    # 1. 索引查找：一次矩阵乘向量 vs 逐条计算相似度的Python循环
+    rng = np.random.default_rng(args.seed)
+
+    def unit(n):
+        vectors = rng.standard_normal((n, args.dim), dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def ms_percentiles(samples):
+        return {f"p{q}": round(float(np.percentile(samples, q)) * 1000, 3) for q in (50, 99)}
+
+    index_report = {}
+    queries = unit(args.queries)
+    for size in args.sizes:
+        vectors = unit(size)
+        index = SemanticIndex(args.dim)
+        start = time.perf_counter()
+        for i, vector in enumerate(vectors):
+            index.add(i, vector)
+        add_us = (time.perf_counter() - start) / size * 1e6
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query)
+            samples.append(time.perf_counter() - start)
+        rows = list(vectors)
+        loop = []
+        for query in queries[:3]:
+            start = time.perf_counter()
+            max(range(size), key=lambda i: float(rows[i] @ query))
+            loop.append(time.perf_counter() - start)
+
+        # 完整的缓存查找（不含计算向量）和满容量时每次写入淘汰一条的开销
+        cache = SemanticCache(None, max_entries=size)
+        cache.embed = lambda text: asyncio.sleep(0, queries[0])
+        entry = asyncio.run(cache.lookup("m", [{"role": "user", "content": "q"}]))
+        for vector in vectors:
+            entry.vector = vector
+            cache.put(entry, ["answer"])
+
+        async def lookups():
+            result = []
+            for query in queries:
+                cache.embed = lambda text, query=query: asyncio.sleep(0, query)
+                start = time.perf_counter()
+                await cache.lookup("m", [{"role": "user", "content": "q"}])
+                result.append(time.perf_counter() - start)
+            return result
+
+        lookup_samples = asyncio.run(lookups())
+        start = time.perf_counter()
+        for query in queries:
+            entry.vector = query
+            cache.put(entry, ["answer"])
+        put_us = (time.perf_counter() - start) / len(queries) * 1e6
+        index_report[size] = {
+            "add_us": round(add_us, 2),
+            "search_ms": ms_percentiles(samples),
+            "python_loop_ms": round(sum(loop) / len(loop) * 1000, 1),
+            "cache_lookup_ms": ms_percentiles(lookup_samples),
+            "put_with_eviction_us": round(put_us, 2),
+            "matrix_mb": round(size * args.dim * 4 / 1e6, 1)
+        }
+        del vectors, rows, index, cache
+
+    # 2. 端到端：换个说法的重复提问，统计命中率、命中和未命中的延迟以及误命中
+    fake, api_server = start_stack(
+        env={"SEMANTIC_CACHE": "1", "SEMANTIC_CACHE_THRESHOLD": str(args.threshold),
+             "RESPONSE_CACHE": "0"},
+        tokens=args.tokens, token_delay=args.token_delay, echo=True)
+    topics = paraphrases(args.topics, args.seed)
+    requests = [(t, q) for t, forms in enumerate(topics) for q in forms[:args.variants]]
+    random.Random(args.seed).shuffle(requests)
+
+    async def run():
+        hits, misses, wrong = [], [], 0
+        async with httpx.AsyncClient(timeout=None) as http:
+            for topic, question in requests:
+                start = time.perf_counter()
+                response = await http.post(f"{api_server.url}/chat", json={
+                    "model": "fake:latest", "messages": [{"role": "user", "content": question}]})
+                elapsed = time.perf_counter() - start
+                answered = response.json()["response"].split("\n", 1)[0][len("re: "):]
+                if answered == question:
+                    misses.append(elapsed)
+                else:
+                    hits.append(elapsed)
+                    wrong += answered not in topics[topic]
+            report = (await http.get(f"{api_server.url}/cache/semantic")).json()
+        report["recent_hits"] = report["recent_hits"][-3:]
+        return {
+            "requests": len(requests),
+            "topics": len(topics),
+            "hits": len(hits),
+            "false_hits": wrong,
+            "hit_ms": ms_percentiles(hits) if hits else None,
+            "miss_ms": ms_percentiles(misses) if misses else None,
+            "report": report
+        }
+
+    with fake, api_server:
+        end_to_end = asyncio.run(run())
+    print(json.dumps({"dim": args.dim, "index": index_report, "end_to_end": end_to_end}, indent=2))
+
+
+def bench_compare(args):
+    gb = 1024 ** 3
+    sizes = {f"model-{i}": int(size * gb) for i, size in enumerate(args.sizes)}
+    delays = {f"model-{i}": delay for i, delay in enumerate(args.token_delays)}
+    models = list(sizes)
+    fake, api_server = start_stack(
+        env={"OLLAMA_MAX_LOADED_MODELS": str(args.max_loaded),
+             "COMPARE_MEMORY_BYTES": str(int(args.memory * gb))},
+        tokens=args.tokens, load_delay=args.load_delay, max_loaded=args.max_loaded,
+        model_sizes=sizes, token_delays=delays)
+    fake_app = fake.server.config.app
+
+    async def serial(http):
+        # 旧方式：依次向每个模型提问
+        start = time.perf_counter()
+        result = {}
+        for model in models:
+            ttft, total = await stream_chat(http, api_server.url, model=model)
+            result[model] = {"ttft": round(ttft, 3), "total": round(total, 3)}
+        return round(time.perf_counter() - start, 3), result
+
+    async def compare(http):
+        start = time.perf_counter()
+        first, summary = {}, None
+        async with http.stream("POST", f"{api_server.url}/chat/compare", json={
+            "models": models, "messages": [{"role": "user", "content": "hello"}]
+        }) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if "content" in event:
+                    first.setdefault(event["model"], round(time.perf_counter() - start, 3))
+                if event.get("done") and "model" not in event:
+                    summary = event
+        return round(time.perf_counter() - start, 3), first, summary
+
+    async def run():
+        async with httpx.AsyncClient(timeout=None) as http:
+            serial_wall, serial_result = await serial(http)
+            # 清空假服务中驻留的模型，两种方式都从冷启动开始
+            fake_app.state.loaded.clear()
+            fake_app.state.peak_bytes = 0
+            compare_wall, first, summary = await compare(http)
+            stats = (await http.get(f"{fake.url}/_stats")).json()
+        return {
+            "models": {m: {"size_gb": args.sizes[i], "token_delay": delays.get(m)}
+                       for i, m in enumerate(models)},
+            "memory_budget_gb": args.memory,
+            "max_loaded": args.max_loaded,
+            "serial_wall_s": serial_wall,
+            "serial": serial_result,
+            "compare_wall_s": compare_wall,
+            "compare_first_token_s": first,
+            "compare_results": summary["results"],
+            "fastest_ttft": summary["fastest_ttft"],
+            "fastest_tokens_per_second": summary["fastest_tokens_per_second"],
+            # 同时生成的模型总大小，应不超过内存预算
+            "peak_active_gb": round(stats["peak_active_bytes"] / gb, 2)
+        }
+
+    with fake, api_server:
+        print(json.dumps(asyncio.run(run()), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local_deepseek_webui 基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("chat-concurrency", help="单worker下N个并行/chat流式请求")
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--tokens", type=int, default=50)
+    p.add_argument("--token-delay", type=float, default=0.02)
+    p.set_defaults(func=bench_chat_concurrency)
+
+    p = sub.add_parser("scheduler", help="多模型交错请求下的排队、切换次数和等待时间")
+    p.add_argument("--requests", type=int, default=24)
+    p.add_argument("--models", type=int, default=2)
+    p.add_argument("--tokens", type=int, default=20)
+    p.add_argument("--token-delay", type=float, default=0.01)
+    p.add_argument("--load-delay", type=float, default=0.5)
+    p.set_defaults(func=bench_scheduler)
+
+    p = sub.add_parser("cache", help="响应缓存冷/热请求延迟对比")
+    p.add_argument("--prompts", type=int, default=10)
+    p.add_argument("--tokens", type=int, default=50)
+    p.add_argument("--token-delay", type=float, default=0.01)
+    p.set_defaults(func=bench_cache)
+
+    p = sub.add_parser("sessions", help="多轮对话首token延迟：服务端会话 vs 每轮重发完整历史")
+    p.add_argument("--turns", type=int, default=20)
+    p.add_argument("--tokens", type=int, default=30)
+    p.add_argument("--think-tokens", type=int, default=200)
+    p.add_argument("--token-delay", type=float, default=0.001)
+    p.add_argument("--prompt-delay", type=float, default=0.0002)
+    p.set_defaults(func=bench_sessions)
+
+    p = sub.add_parser("search", help="搜索吞吐：冷/缓存查询和批量并发查询")
+    p.add_argument("--queries", type=int, default=50)
+    p.add_argument("--batch", type=int, default=5)
+    p.add_argument("--delay", type=float, default=0.1)
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser("parse", help="各解析后端处理结果页的耗时和内存")
+    p.add_argument("--pages", type=int, default=10, help="没有录制时生成的合成页面数")
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--num-results", type=int, default=5)
+    p.add_argument("--filler", type=int, default=20)
+    p.add_argument("--fixtures", default=FIXTURES_DIR)
+    p.add_argument("--record", action="store_true", help="先从SEARCH_URL录制真实结果页")
+    p.set_defaults(func=bench_parse)
+
+    p = sub.add_parser("rag", help="联网增强对首token延迟的影响")
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--results", type=int, default=3)
+    p.add_argument("--tokens", type=int, default=20)
+    p.add_argument("--search-delay", type=float, default=0.1)
+    p.add_argument("--page-delay", type=float, default=0.2)
+    p.set_defaults(func=bench_rag)
+
+    p = sub.add_parser("think-parser", help="推理过程拆分：增量解析 vs 每个token重新扫描")
+    p.add_argument("--tokens", type=int, default=20000)
+    p.add_argument("--answer-tokens", type=int, default=2000)
+    p.add_argument("--rounds", type=int, default=5)
+    p.set_defaults(func=bench_think_parser)
+
+    p = sub.add_parser("render", help="流式渲染：每个chunk重绘全文 vs 节流+分块渲染")
+    p.add_argument("--paragraphs", type=int, default=40)
+    p.add_argument("--words", type=int, default=60)
+    p.add_argument("--token-delay", type=float, default=0.02)
+    p.add_argument("--interval", type=float, default=1 / 15)
+    p.set_defaults(func=bench_render)
+
+    p = sub.add_parser("history", help="长对话每次运行脚本的耗时：渲染全部消息 vs 分页加载")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000])
+    p.add_argument("--rounds", type=int, default=5)
+    p.set_defaults(func=bench_history)
+
+    p = sub.add_parser("context", help="长会话的提示词大小和首token延迟：不限制 vs 上下文预算")
+    p.add_argument("--turns", type=int, default=60)
+    p.add_argument("--num-ctx", type=int, default=2048)
+    p.add_argument("--tokens", type=int, default=40)
+    p.add_argument("--question-words", type=int, default=20)
+    p.add_argument("--token-delay", type=float, default=0.0005)
+    p.add_argument("--prompt-delay", type=float, default=0.00005)
+    p.set_defaults(func=bench_context)
+
+    p = sub.add_parser("backends", help="多个Ollama后端：负载均衡、模型亲和和故障切换")
+    p.add_argument("--backends", type=int, default=3)
+    p.add_argument("--models", type=int, default=3)
+    p.add_argument("--requests", type=int, default=36)
+    p.add_argument("--tokens", type=int, default=20)
+    p.add_argument("--token-delay", type=float, default=0.01)
+    p.add_argument("--load-delay", type=float, default=0.5)
+    p.set_defaults(func=bench_backends)
+
+    p = sub.add_parser("metrics", help="指标和追踪的开销，以及/metrics输出")
+    p.add_argument("--rounds", type=int, default=10000)
+    p.add_argument("--tokens", type=int, default=200)
+    p.add_argument("--requests", type=int, default=8)
+    p.set_defaults(func=bench_metrics)
+
+    p = sub.add_parser("batch", help="批量任务：逐条/chat vs 按模型分组的批量执行，中途重启后继续")
+    p.add_argument("--prompts", type=int, default=60)
+    p.add_argument("--models", type=int, default=3)
+    p.add_argument("--concurrency", type=int, default=2)
+    p.add_argument("--tokens", type=int, default=20)
+    p.add_argument("--token-delay", type=float, default=0.005)
+    p.add_argument("--load-delay", type=float, default=0.5)
+    p.set_defaults(func=bench_batch)
+
+    p = sub.add_parser("startup", help="启动耗时：导入时间、Ollama就绪轮询和模型预加载")
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--ollama-delay", type=float, default=1.5)
+    p.add_argument("--load-delay", type=float, default=2.0)
+    p.add_argument("--tokens", type=int, default=20)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("state", help="共享状态：各后端的操作耗时，以及两个worker下的会话和下载状态")
+    p.add_argument("--ops", type=int, default=2000)
+    p.add_argument("--turns", type=int, default=10)
+    p.set_defaults(func=bench_state)
+
+    p = sub.add_parser("semantic", help="语义缓存：不同规模索引的查找延迟，以及换个说法的重复提问的命中率")
+    p.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")],
+                   default=[1000, 10000, 100000])
+    p.add_argument("--dim", type=int, default=768, help="向量维度，nomic-embed-text为768")
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--topics", type=int, default=40)
+    p.add_argument("--variants", type=int, default=5)
+    p.add_argument("--threshold", type=float, default=0.92)
+    p.add_argument("--tokens", type=int, default=50)
+    p.add_argument("--token-delay", type=float, default=0.01)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_semantic)
+
+    p = sub.add_parser("compare", help="多模型对比：依次提问 vs /chat/compare 按内存预算并行")
+    p.add_argument("--sizes", type=lambda v: [float(x) for x in v.split(",")], default=[4, 4, 7, 2],
+                   help="各模型大小（GB），模型名为model-0、model-1……")
+    p.add_argument("--token-delays", type=lambda v: [float(x) for x in v.split(",")],
+                   default=[0.01, 0.02, 0.015, 0.005])
+    p.add_argument("--memory", type=float, default=10, help="COMPARE_MEMORY_BYTES（GB）")
+    p.add_argument("--max-loaded", type=int, default=3)
+    p.add_argument("--tokens", type=int, default=50)
+    p.add_argument("--load-delay", type=float, default=1.0)
+    p.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cachetools import TTLCache
+
+
+def request_key(model: str, messages: list, options: dict) -> str:
+    # 规范化后的请求哈希：键顺序固定、去掉多余空白，同样的请求总得到同样的键
+    canonical = json.dumps(
+        {"model": model, "messages": messages, "options": options},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def chunks_size(chunks) -> int:
+    return sum(len(c.encode("utf-8")) for c in chunks) + 64
+
+
+class DiskCache:
+    """SQLite持久层，按TTL过期，超过容量时淘汰最久未访问的条目"""
+
+    def __init__(self, path: str, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, chunks TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chunks, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, chunks):
+        now = time.time()
+        size = chunks_size(chunks)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(chunks, ensure_ascii=False), size, now, now))
+            self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                # 按访问时间从旧到新淘汰，直到总大小回到上限以内
+                excess = total - self.max_bytes
+                rows = self._conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+                evict = []
+                for row_key, row_size in rows:
+                    if excess <= 0:
+                        break
+                    evict.append((row_key,))
+                    excess -= row_size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", evict)
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+class ResponseCache:
+    """两级响应缓存：内存LRU（按字节数限制容量）+ 可选的SQLite磁盘层，两级共用TTL"""
+
+    def __init__(self, ttl: float = 3600, memory_bytes: int = 32 * 1024 * 1024,
+                 disk_path: str = None, disk_bytes: int = 512 * 1024 * 1024):
+        self._memory = TTLCache(maxsize=memory_bytes, ttl=ttl, getsizeof=chunks_size)
+        self._disk = DiskCache(disk_path, disk_bytes, ttl) if disk_path else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    async def get(self, key: str):
+        chunks = self._memory.get(key)
+        if chunks is not None:
+            self.memory_hits += 1
+            return chunks
+        if self._disk is not None:
+            chunks = await asyncio.to_thread(self._disk.get, key)
+            if chunks is not None:
+                self.disk_hits += 1
+                self._remember(key, chunks)
+                return chunks
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, chunks):
+        self.stores += 1
+        self._remember(key, chunks)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.put, key, chunks)
+
+    def _remember(self, key, chunks):
+        try:
+            self._memory[key] = chunks
+        except ValueError:
+            # 单条响应比整个内存层还大，只保存在磁盘层
+            pass
+
+    async def clear(self):
+        self._memory.clear()
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.clear)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory.currsize
+        }
@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+from backends import BackendPool
+
+logger = logging.getLogger(__name__)
+
+
+class ModelCatalog:
+    """缓存所有Ollama后端的模型列表（/api/tags + /api/ps），后台定时刷新，下载或删除模型后失效"""
+
+    def __init__(self, pool: BackendPool, ttl: float = 30.0, refresh_interval: float = 15.0):
+        self.pool = pool
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.payload = None
+        self.etag = None
+        self.fetched_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def _fetch(self):
+        # 健康检查同时更新了各后端的模型列表，这里合并成一份
+        await self.pool.check_all()
+        backends = [b for b in self.pool.backends if b.healthy]
+        if not backends:
+            raise ConnectionError("没有可用的Ollama后端: " + "; ".join(
+                f"{b.host} {b.last_error}" for b in self.pool.backends))
+
+        models = {}
+        for backend in backends:
+            loaded = {m["name"]: m for m in backend.running}
+            for model in backend.models:
+                details = model.get("details") or {}
+                running = loaded.get(model["name"])
+                entry = models.setdefault(model["name"], {
+                    **model,
+                    "parameter_size": details.get("parameter_size"),
+                    "quantization": details.get("quantization_level"),
+                    "loaded": False,
+                    "size_vram": None,
+                    "expires_at": None,
+                    "hosts": []
+                })
+                entry["hosts"].append(backend.host)
+                if running is not None and not entry["loaded"]:
+                    entry.update(loaded=True, size_vram=running.get("size_vram"),
+                                 expires_at=running.get("expires_at"))
+        return {"models": list(models.values())}
+
+    def _stale(self):
+        return self.payload is None or time.monotonic() - self.fetched_at > self.ttl
+
+    async def _update(self):
+        payload = await self._fetch()
+        body = json.dumps(payload, sort_keys=True).encode("utf-8")
+        self.payload = payload
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.fetched_at = time.monotonic()
+
+    async def refresh(self):
+        async with self._lock:
+            await self._update()
+        return self.payload
+
+    async def get(self):
+        # 同一时间只有一个请求去访问Ollama，其余的等待它的结果
+        if self._stale():
+            async with self._lock:
+                if self._stale():
+                    await self._update()
+        return self.payload, self.etag
+
+    def invalidate(self, *_):
+        # 标记过期并在后台立即刷新，下一次请求拿到的就是新列表
+        self.fetched_at = 0.0
+        asyncio.get_running_loop().create_task(self._safe_refresh())
+
+    async def _safe_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning("刷新模型列表失败: %s", e)
+
+    async def _refresh_loop(self):
+        while True:
+            await self._safe_refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
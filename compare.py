@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+
+class CompareScheduler:
+    """多模型对比的启动顺序：同时运行的模型数不超过max_models，总大小不超过memory_budget
+    （0表示只按数量限制），放不下的模型等前面的模型结束后再启动。
+    已加载的模型排在前面，不需要先加载；大小未知的模型在有内存预算时单独运行"""
+
+    def __init__(self, models: list, sizes: dict, loaded=(), memory_budget: int = 0,
+                 max_models: int = 1):
+        self.sizes = sizes
+        self.memory_budget = memory_budget
+        self.max_models = max(max_models, 1)
+        # 其次按大小从大到小，小模型可以填补大模型之间剩下的空间
+        self.pending = sorted(models, key=lambda m: (m not in loaded, -(sizes.get(m) or 0)))
+        self.running = {}
+        self.started_at = {}
+
+    def _size(self, model):
+        size = self.sizes.get(model)
+        if size is None and self.memory_budget:
+            return self.memory_budget
+        return size or 0
+
+    def fits(self, model: str) -> bool:
+        if not self.running:
+            # 单独一个模型超过预算时也只能运行，交给Ollama处理
+            return True
+        if len(self.running) >= self.max_models:
+            return False
+        if not self.memory_budget:
+            return True
+        return sum(self.running.values()) + self._size(model) <= self.memory_budget
+
+    async def run(self, run_one):
+        # run_one(model, emit)是单个模型的协程，通过emit发送事件；产生所有模型的事件，
+        # 生成器关闭（客户端断开）时取消还在运行的模型
+        queue = asyncio.Queue()
+        start = time.monotonic()
+
+        async def drive():
+            tasks = {}
+            try:
+                while self.pending or tasks:
+                    for model in list(self.pending):
+                        if self.fits(model):
+                            self.pending.remove(model)
+                            self.running[model] = self._size(model)
+                            self.started_at[model] = time.monotonic() - start
+                            tasks[asyncio.create_task(run_one(model, queue.put_nowait))] = model
+                    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        del self.running[tasks.pop(task)]
+                        task.result()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                # 用wait而不是gather：自身再次被取消时不会把取消再传给各模型，
+                # 否则各模型关闭上游连接的清理过程会被打断
+                if tasks:
+                    await asyncio.wait(tasks)
+                queue.put_nowait(None)
+
+        driver = asyncio.create_task(drive())
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+            await driver
+        finally:
+            driver.cancel()
+            await asyncio.wait([driver])
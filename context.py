@@ -0,0 +1,153 @@
+import asyncio
+import logging
+
+from cachetools import LRUCache
+
+from rag import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 每条消息的角色、分隔符等格式开销
+MESSAGE_OVERHEAD = 4
+SUMMARY_PREFIX = "以下是之前对话的摘要：\n"
+SUMMARY_INSTRUCTION = (
+    "请用简洁的要点总结以上全部对话（包括之前的摘要），保留事实、结论、用户的偏好和未解决的问题，"
+    "不要添加新内容。")
+
+
+def parse_budgets(spec: str) -> dict:
+    # "deepseek-r1:7b=8192,qwen2.5=32768" -> {模型: 上下文长度}
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, tokens = item.rpartition("=")
+        budgets[model.strip()] = int(tokens)
+    return budgets
+
+
+class ContextManager:
+    """按模型的上下文预算裁剪历史：逐条消息计数并缓存，超出预算时从最早的轮次开始移出窗口。
+    会话的窗口超过低水位时在后台提前总结，下一次窗口移动时换上摘要，被总结的部分移出窗口"""
+
+    def __init__(self, default_tokens: int = 4096, model_tokens: dict = None,
+                 reserve_tokens: int = 1024, low_watermark: float = 0.6,
+                 stable_turns: int = 4, summarizer=None, cache_size: int = 65536):
+        self.default_tokens = default_tokens
+        self.model_tokens = model_tokens or {}
+        self.reserve_tokens = reserve_tokens
+        self.low_watermark = low_watermark
+        # 窗口移动后至少还能容纳的轮数，按窗口中每轮的平均长度计算
+        self.stable_turns = stable_turns
+        # summarizer(model, messages) -> 摘要文本；为None时只裁剪不总结
+        self.summarizer = summarizer
+        # on_summary(session)：摘要更新后调用的协程，例如写回共享状态
+        self.on_summary = None
+        self._counts = LRUCache(maxsize=cache_size)
+        self.summaries = 0
+        self.summary_failures = 0
+
+    def count(self, message: dict) -> int:
+        content = message["content"]
+        tokens = self._counts.get(content)
+        if tokens is None:
+            tokens = estimate_tokens(content)
+            self._counts[content] = tokens
+        return tokens + MESSAGE_OVERHEAD
+
+    def count_all(self, messages) -> int:
+        return sum(self.count(m) for m in messages)
+
+    def budget(self, model: str, options: dict, extra_tokens: int = 0) -> int:
+        # 请求指定的num_ctx优先，其次是按模型（或不带标签的模型名）配置的长度
+        window = options.get("num_ctx") or self.model_tokens.get(model) \
+            or self.model_tokens.get(model.split(":")[0]) or self.default_tokens
+        return max(window - self.reserve_tokens - extra_tokens, 0)
+
+    def fit(self, messages: list, budget: int):
+        # 无状态请求：保留开头的系统消息和最后一条消息，从最早的轮次开始丢弃直到不超过预算
+        system = []
+        while len(system) < len(messages) - 1 and messages[len(system)]["role"] == "system":
+            system.append(messages[len(system)])
+        history = messages[len(system):]
+        total = self.count_all(messages)
+        start = 0
+        while total > budget and start < len(history) - 1:
+            total -= self.count(history[start])
+            start += 1
+            # 按轮次丢弃，不留下没有问题的回答
+            while start < len(history) - 1 and history[start]["role"] != "user":
+                total -= self.count(history[start])
+                start += 1
+        return system + history[start:], self._info(total, budget, start, 0)
+
+    def session_prompt(self, session, content: str, budget: int):
+        # 会话：窗口起点只在超出预算时向前移动，之后若干轮前缀保持不变，Ollama仍然可以复用KV缓存。
+        # 每次移动前缀只变化一次：已完成的摘要在这时才换上，已总结的消息同时移出窗口
+        user = {"role": "user", "content": content}
+        fixed = self.count(user) + self.count_all(session.prefix())
+        kept = self.count_all(session.messages[session.context_start:])
+        if fixed + kept > budget:
+            turns = max(sum(1 for m in session.messages[session.context_start:]
+                            if m["role"] == "user"), 1)
+            room = kept / turns * self.stable_turns
+            if session.pending_summary:
+                session.summary, session.summary_upto = session.pending_summary, session.pending_upto
+                session.pending_summary, session.pending_upto = "", 0
+                fixed = self.count(user) + self.count_all(session.prefix())
+            # 移到低水位，并给之后的stable_turns轮留出空间
+            target = min(budget * self.low_watermark, budget - room) - fixed
+            start = max(session.context_start, session.summary_upto)
+            kept = self.count_all(session.messages[start:])
+            while start < len(session.messages) and kept > target:
+                kept -= self.count(session.messages[start])
+                start += 1
+            while start < len(session.messages) and session.messages[start]["role"] != "user":
+                kept -= self.count(session.messages[start])
+                start += 1
+            session.context_start = start
+        messages = session.prompt(content)
+        return messages, self._info(
+            self.count_all(messages), budget, session.context_start, session.summary_upto)
+
+    def finish_turn(self, session, budget: int):
+        # 一轮结束后窗口超过低水位时开始总结，赶在窗口移动之前完成
+        if self.summarizer is None or session.summary_task is not None or session.pending_summary:
+            return
+        if len(session.messages) <= session.summary_upto:
+            return
+        tokens = self.count_all(session.prefix()) + \
+            self.count_all(session.messages[session.context_start:])
+        if tokens >= budget * self.low_watermark:
+            session.summary_task = asyncio.create_task(self._summarize(session))
+
+    async def _summarize(self, session):
+        # 在会话当前的提示词后面追加总结指令，总结上一次的摘要和窗口中的全部消息：
+        # 前缀与刚结束的一轮相同，Ollama复用KV缓存，总结请求也不会冲掉会话的缓存
+        upto = len(session.messages)
+        try:
+            summary = await self.summarizer(session.model, session.prompt(SUMMARY_INSTRUCTION))
+            session.pending_summary = summary.strip()
+            session.pending_upto = upto
+            self.summaries += 1
+            if self.on_summary is not None:
+                await self.on_summary(session)
+        except Exception as e:
+            self.summary_failures += 1
+            logger.warning("总结对话历史失败: %s", e)
+        finally:
+            session.summary_task = None
+
+    @staticmethod
+    def _info(tokens, budget, dropped, summarized):
+        return {
+            "prompt_tokens": tokens,
+            "budget": budget,
+            "dropped_messages": dropped,
+            "summarized_messages": summarized
+        }
+
+    def stats(self):
+        return {
+            "cached_counts": len(self._counts),
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures
+        }
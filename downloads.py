@@ -0,0 +1,303 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from state import StateStore
+
+ACTIVE_STATUSES = ("queued", "downloading", "verifying", "writing")
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+# Ollama拉取过程中的状态文字 -> 对外的下载状态
+OLLAMA_STATUS_MAP = {
+    "verifying sha256 digest": "verifying",
+    "writing manifest": "writing",
+    "removing any unused layers": "writing",
+    "success": "completed"
+}
+
+
+class JobStore:
+    """下载任务状态保存在共享状态中，多个uvicorn worker看到的是同一份状态；每次更新都发布通知。
+    负责下载的进程定时刷新updated_at，超过stale_after没有刷新的进行中任务按中断失败报告"""
+
+    PREFIX = "download:"
+    # 所有worker共享的下载名额：{模型: 最近一次心跳时间}
+    SLOTS_KEY = "download-slots"
+
+    def __init__(self, state: StateStore, stale_after: float = 30.0):
+        self.state = state
+        self.stale_after = stale_after
+
+    def _key(self, model):
+        return self.PREFIX + model
+
+    async def get(self, model: str):
+        return self._public(await self.state.get(self._key(model)))
+
+    async def list(self):
+        jobs = [self._public(job) for _, job in await self.state.items(self.PREFIX)]
+        return sorted(jobs, key=lambda job: job["updated_at"], reverse=True)
+
+    async def active(self):
+        # 状态仍是进行中的任务，包括已经中断的
+        return [job for _, job in await self.state.items(self.PREFIX)
+                if job["status"] in ACTIVE_STATUSES]
+
+    def is_stale(self, job, now: float = None) -> bool:
+        return (job["status"] in ACTIVE_STATUSES and
+                job["updated_at"] < (now or time.time()) - self.stale_after)
+
+    async def claim(self, model: str) -> bool:
+        # 原子地创建任务：已有进行中且仍在更新的任务时返回False
+        now = time.time()
+        claimed = []
+
+        def claim(job):
+            if job and job["status"] in ACTIVE_STATUSES and not self.is_stale(job, now):
+                return job
+            claimed.append(True)
+            return {"model": model, "status": "queued", "progress": 0,
+                    "cancel_requested": False, "updated_at": now}
+
+        job = await self.state.update(self._key(model), claim)
+        if claimed:
+            await self.state.publish(self._key(model), self._public(job))
+        return bool(claimed)
+
+    async def update(self, model: str, status: str, **data) -> bool:
+        # 写入新状态并保留取消标记，返回是否已请求取消
+        def update(job):
+            cancel = bool(job and job.get("cancel_requested"))
+            return {**data, "model": model, "status": status,
+                    "cancel_requested": cancel, "updated_at": time.time()}
+
+        job = await self.state.update(self._key(model), update)
+        await self.state.publish(self._key(model), self._public(job))
+        return job["cancel_requested"]
+
+    async def touch(self, model: str):
+        # 心跳：进度长时间不变（排队、校验大文件）时也表明任务仍有进程负责
+        def touch(job):
+            if job and job["status"] in ACTIVE_STATUSES:
+                return {**job, "updated_at": time.time()}
+            return job
+
+        def refresh(slots):
+            if slots and model in slots:
+                return {**slots, model: time.time()}
+            return slots
+
+        await self.state.update(self._key(model), touch)
+        await self.state.update(self.SLOTS_KEY, refresh)
+
+    async def acquire_slot(self, model: str, limit: int) -> bool:
+        # 持有者超过stale_after没有心跳（进程已退出）时名额自动释放
+        now = time.time()
+        acquired = []
+
+        def acquire(slots):
+            slots = {m: t for m, t in (slots or {}).items() if t >= now - self.stale_after}
+            if model in slots or len(slots) < limit:
+                slots[model] = now
+                acquired.append(True)
+            return slots
+
+        await self.state.update(self.SLOTS_KEY, acquire)
+        return bool(acquired)
+
+    async def release_slot(self, model: str):
+        def release(slots):
+            return {m: t for m, t in (slots or {}).items() if m != model} or None
+
+        await self.state.update(self.SLOTS_KEY, release)
+        await self.state.publish(self.SLOTS_KEY, model)
+
+    def slot_released(self):
+        return self.state.subscribe(self.SLOTS_KEY)
+
+    async def request_cancel(self, model: str) -> bool:
+        requested = []
+
+        def cancel(job):
+            if job and job["status"] in ACTIVE_STATUSES:
+                requested.append(True)
+                return {**job, "cancel_requested": True}
+            return job
+
+        await self.state.update(self._key(model), cancel)
+        return bool(requested)
+
+    async def cancel_requested(self, model: str) -> bool:
+        job = await self.state.get(self._key(model))
+        return bool(job and job.get("cancel_requested"))
+
+    def subscribe(self, model: str):
+        return self.state.subscribe(self._key(model))
+
+    def _public(self, job):
+        if job is None:
+            return None
+        job = {k: v for k, v in job.items() if k != "cancel_requested"}
+        if self.is_stale(job):
+            # 负责下载的进程重启或崩溃了，任务不会再有进展
+            job.update(status="failed", error="下载中断：负责下载的进程已退出")
+        return job
+
+
+class LayerProgress:
+    def __init__(self):
+        self.layers = {}
+        self.started_at = time.monotonic()
+        self.rate = 0.0
+        self._last_bytes = 0
+        self._last_time = self.started_at
+
+    def update(self, digest, completed, total):
+        if digest and total:
+            self.layers[digest] = (completed or 0, total)
+
+    @property
+    def completed(self):
+        return sum(c for c, _ in self.layers.values())
+
+    @property
+    def total(self):
+        return sum(t for _, t in self.layers.values())
+
+    def sample(self):
+        # 指数平滑的下载速度
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        if elapsed > 0:
+            instant = (self.completed - self._last_bytes) / elapsed
+            self.rate = instant if self.rate == 0 else 0.7 * self.rate + 0.3 * instant
+        self._last_bytes = self.completed
+        self._last_time = now
+
+    def snapshot(self, digest=None):
+        total = self.total
+        completed = self.completed
+        remaining = total - completed
+        return {
+            "progress": int(completed * 100 / total) if total else 0,
+            "completed": completed,
+            "total": total,
+            "rate": round(self.rate),
+            "eta": round(remaining / self.rate, 1) if self.rate > 0 else None,
+            "layer": digest
+        }
+
+
+class DownloadManager:
+    """通过Ollama的流式pull接口下载模型，限制所有worker合计的并发数，支持取消"""
+
+    def __init__(self, client, store: JobStore, max_concurrent: int = 2,
+                 update_interval: float = 0.5):
+        self.client = client
+        self.store = store
+        self.update_interval = update_interval
+        self.max_concurrent = max_concurrent
+        self._tasks = {}
+        # 下载完成时的回调，例如刷新模型列表
+        self.on_complete = []
+
+    async def start(self, model: str) -> bool:
+        if not await self.store.claim(model):
+            return False
+        self._tasks[model] = asyncio.create_task(self._run(model))
+        self._tasks[model].add_done_callback(lambda _: self._tasks.pop(model, None))
+        return True
+
+    async def cancel(self, model: str) -> bool:
+        # 先标记到共享状态，负责下载的worker在下一次更新进度时会看到
+        cancelled = await self.store.request_cancel(model)
+        task = self._tasks.get(model)
+        if task is not None:
+            task.cancel()
+        return cancelled
+
+    async def resume_interrupted(self):
+        # 启动时接手中断的任务：等它超过stale_after没有心跳后重新下载，Ollama会从已下载的部分继续；
+        # 多个worker同时接手时由claim保证只有一个成功，仍有心跳的任务claim会失败
+        for job in sorted(await self.store.active(), key=lambda job: job["updated_at"]):
+            delay = job["updated_at"] + self.store.stale_after - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.start(job["model"])
+
+    async def _save(self, model, status, **data) -> bool:
+        return await self.store.update(model, status, **data)
+
+    @asynccontextmanager
+    async def _slot(self, model: str):
+        # 名额保存在共享状态中，多个worker合计不超过max_concurrent；有名额释放时收到通知，
+        # 超时后也重新尝试（持有名额的worker可能已经退出）
+        async with self.store.slot_released() as released:
+            while not await self.store.acquire_slot(model, self.max_concurrent):
+                # 排队时也要响应其他worker上的取消请求
+                if await self.store.cancel_requested(model):
+                    raise asyncio.CancelledError()
+                await released.get(self.store.stale_after / 3)
+        try:
+            yield
+        finally:
+            await self.store.release_slot(model)
+
+    async def _heartbeat(self, model: str):
+        while True:
+            await asyncio.sleep(self.store.stale_after / 3)
+            await self.store.touch(model)
+
+    async def _run(self, model: str):
+        progress = LayerProgress()
+        heartbeat = asyncio.create_task(self._heartbeat(model))
+        try:
+            async with self._slot(model):
+                await self._save(model, "downloading", **progress.snapshot())
+                last_update = 0.0
+                status = "downloading"
+                async for part in await self.client.pull(model, stream=True):
+                    progress.update(part.digest, part.completed, part.total)
+                    status = OLLAMA_STATUS_MAP.get(part.status, status)
+                    now = time.monotonic()
+                    if now - last_update < self.update_interval and status == "downloading":
+                        continue
+                    last_update = now
+                    progress.sample()
+                    if status == "completed":
+                        cancel = await self.store.cancel_requested(model)
+                    else:
+                        cancel = await self._save(model, status, **progress.snapshot(part.digest))
+                    if cancel:
+                        raise asyncio.CancelledError()
+
+            await self._save(model, "completed", **{**progress.snapshot(), "progress": 100})
+            for callback in self.on_complete:
+                callback(model)
+        except asyncio.CancelledError:
+            await self._save(model, "cancelled", **progress.snapshot())
+        except Exception as e:
+            await self._save(model, "failed", error=str(e), **progress.snapshot())
+        finally:
+            heartbeat.cancel()
+
+    async def status(self, model: str):
+        return await self.store.get(model)
+
+    async def events(self, model: str, timeout: float = 5.0):
+        # 订阅状态变化的通知，由哪个worker负责下载都能及时看到进度；
+        # 超时后重新读取一次，负责下载的worker退出后任务按中断失败报告，连接随之结束
+        async with self.store.subscribe(model) as updates:
+            last = None
+            while True:
+                job = await self.store.get(model)
+                if job is None:
+                    yield {"status": "not_found"}
+                    return
+                state = {k: v for k, v in job.items() if k != "updated_at"}
+                if state != last:
+                    yield job
+                    last = state
+                if job["status"] in FINAL_STATUSES:
+                    return
+                await updates.get(timeout)
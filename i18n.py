@@ -20,6 +20,7 @@ LANGUAGES = {
         "no_models": "No models available",
         "server_error": "Server connection failed",
         "get_models_error": "Failed to get model list: {}",
+        "model_not_ready": "Model {} is not available yet: Ollama may still be starting or downloading it. Check /readyz for progress.",
         "thinking": "Thinking...",
         "view_thoughts": "View Thoughts",
         "request_failed": "Request failed: {}",
@@ -31,7 +32,16 @@ LANGUAGES = {
         "delete_chat": "Delete Chat",
         "chat_name": "Chat {}",
         "rename_chat": "Rename Chat",
-        "confirm_delete": "Are you sure to delete this chat?"
+        "confirm_delete": "Are you sure to delete this chat?",
+        "queue_position": "Waiting in queue, position: {}",
+        "web_search": "Web search",
+        "sources": "Sources:",
+        "download_rate": "{:.1f} MB/s, about {}s left",
+        "verifying_model": "Verifying model...",
+        "writing_model": "Writing model...",
+        "cancel_download": "Cancel Download",
+        "download_cancelled": "Download cancelled",
+        "load_earlier": "Load earlier messages"
     },
     "zh": {
         "title": "💬 LLM Chat Interface",
@@ -52,6 +62,7 @@ LANGUAGES = {
         "no_models": "无可用模型",
         "server_error": "服务器连接失败",
         "get_models_error": "获取模型列表失败: {}",
+        "model_not_ready": "模型 {} 暂不可用：Ollama可能还在启动或正在下载该模型，进度见 /readyz。",
         "thinking": "思考中...",
         "view_thoughts": "查看思考过程",
         "request_failed": "请求失败: {}",
@@ -63,6 +74,15 @@ LANGUAGES = {
         "delete_chat": "删除会话",
         "chat_name": "会话 {}",
         "rename_chat": "重命名会话",
-        "confirm_delete": "确定要删除这个会话吗？"
+        "confirm_delete": "确定要删除这个会话吗？",
+        "queue_position": "排队中，当前位置: {}",
+        "web_search": "联网搜索",
+        "sources": "参考来源:",
+        "download_rate": "{:.1f} MB/s，预计剩余 {} 秒",
+        "verifying_model": "正在校验模型...",
+        "writing_model": "正在写入模型...",
+        "cancel_download": "取消下载",
+        "download_cancelled": "下载已取消",
+        "load_earlier": "加载更早的消息"
     }
 }
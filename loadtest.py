@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from contextlib import AsyncExitStack
+
+import httpx
+
+from benchmark import ServerThread, create_fake_ollama, create_stub_search, free_port
+
+# 负载测试：假Ollama + 假搜索服务，按请求轨迹回放到api.py，统计延迟分位数、首token延迟、
+# 吞吐量和API事件循环的延迟，不需要GPU就能发现性能退化
+#
+# 轨迹为JSONL，每行一个请求：
+#   {"t": 0.12, "endpoint": "/chat", "body": {"model": "...", "messages": [...], "stream": true}}
+#   {"t": 0.30, "endpoint": "/search", "body": {"query": "..."}}
+#   {"t": 0.41, "endpoint": "/models", "method": "GET"}
+# t是相对开始的秒数，--speed 0 时忽略t，按--concurrency尽快发送
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def summary_ms(values):
+    return {f"p{q}": round(percentile(values, q) * 1000, 2) if values else None
+            for q in (50, 95, 99)}
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        mix["/" + name.strip().lstrip("/")] = float(weight)
+    return mix
+
+
+def generate_trace(count, rate, mix, models, queries, seed=0):
+    # 泊松到达；搜索从有限的查询集合中抽取，一部分会命中缓存
+    rng = random.Random(seed)
+    endpoints = list(mix)
+    weights = [mix[e] for e in endpoints]
+    t = 0.0
+    trace = []
+    for i in range(count):
+        t += rng.expovariate(rate)
+        endpoint = rng.choices(endpoints, weights)[0]
+        entry = {"t": round(t, 4), "endpoint": endpoint}
+        if endpoint == "/chat":
+            entry["body"] = {
+                "model": rng.choice(models),
+                "messages": [{"role": "user", "content": f"question {i}"}],
+                "stream": rng.random() < 0.9,
+                "cache": False
+            }
+        elif endpoint == "/search":
+            entry["body"] = {"query": f"query {rng.randrange(queries)}", "num_results": 5}
+        else:
+            entry["method"] = "GET"
+        trace.append(entry)
+    return trace
+
+
+def load_trace(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_jsonl(path, entries):
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class LoopLagProbe:
+    """在被测服务的事件循环中定时sleep，实际唤醒时间比预期晚多少就是事件循环被阻塞的时间"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self.running = True
+
+    async def run(self):
+        while self.running:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def report(self):
+        return {**summary_ms(self.samples),
+                "max": round(max(self.samples, default=0) * 1000, 2),
+                "samples": len(self.samples)}
+
+
+async def send(http, base, entry):
+    # 返回 (是否成功, 总耗时, 首token耗时, 输出的内容帧数)
+    endpoint = entry["endpoint"]
+    body = entry.get("body")
+    method = entry.get("method", "POST" if body is not None else "GET")
+    start = time.perf_counter()
+    try:
+        if endpoint == "/chat" and body.get("stream"):
+            ttft, frames, ok = None, 0, True
+            async with http.stream(method, base + endpoint, json=body) as response:
+                ok = response.status_code == 200
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    if '"error"' in line:
+                        ok = False
+                    elif '"content"' in line:
+                        frames += 1
+                        if ttft is None:
+                            ttft = time.perf_counter() - start
+            return ok, time.perf_counter() - start, ttft, frames
+        response = await http.request(method, base + endpoint, json=body)
+        elapsed = time.perf_counter() - start
+        # 非流式请求的首token延迟就是总耗时
+        ttft = elapsed if endpoint == "/chat" else None
+        return response.status_code < 400, elapsed, ttft, 1 if endpoint == "/chat" else 0
+    except httpx.HTTPError:
+        return False, time.perf_counter() - start, None, 0
+
+
+async def replay(base, trace, concurrency, speed):
+    # speed>0时按轨迹时间开环发送（speed=2表示两倍速）；speed=0时闭环尽快发送。
+    # 每个接口有自己的并发名额（concurrency）和连接池，慢的聊天流不会让/models、/search
+    # 在客户端排队；等待名额的时间单独记录为queue，延迟只统计请求发出之后的部分
+    results = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    endpoints = sorted({entry["endpoint"] for entry in trace})
+    semaphores = {endpoint: asyncio.Semaphore(concurrency) for endpoint in endpoints}
+
+    async with AsyncExitStack() as stack:
+        clients = {endpoint: await stack.enter_async_context(
+            httpx.AsyncClient(timeout=None, limits=limits)) for endpoint in endpoints}
+
+        async def run(entry):
+            endpoint = entry["endpoint"]
+            scheduled = time.perf_counter()
+            async with semaphores[endpoint]:
+                queued = time.perf_counter() - scheduled
+                ok, elapsed, ttft, frames = await send(clients[endpoint], base, entry)
+            results.append((endpoint, ok, elapsed, ttft, frames, queued))
+
+        start = time.perf_counter()
+        tasks = []
+        for entry in trace:
+            if speed > 0:
+                delay = entry.get("t", 0) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(run(entry)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - start
+    return results, wall
+
+
+def build_report(results, wall, lag):
+    report = {"wall_s": round(wall, 3), "requests": len(results),
+              "throughput_rps": round(len(results) / wall, 2),
+              "tokens_per_s": round(sum(r[4] for r in results) / wall, 1),
+              "event_loop_lag_ms": lag.report(), "endpoints": {}}
+    for endpoint in sorted({r[0] for r in results}):
+        rows = [r for r in results if r[0] == endpoint]
+        ok = [r for r in rows if r[1]]
+        entry = {
+            "count": len(rows),
+            "errors": len(rows) - len(ok),
+            "throughput_rps": round(len(rows) / wall, 2),
+            "latency_ms": summary_ms([r[2] for r in ok]),
+            # 客户端等待并发名额的时间，不计入latency_ms和ttft_ms；持续升高说明--concurrency不够
+            "queue_ms": summary_ms([r[5] for r in rows])
+        }
+        ttfts = [r[3] for r in ok if r[3] is not None]
+        if ttfts:
+            entry["ttft_ms"] = summary_ms(ttfts)
+        report["endpoints"][endpoint] = entry
+    return report
+
+
+def compare(report, baseline, tolerance):
+    # 与基线报告比较p95延迟和首token延迟，超过容差的视为退化
+    regressions = []
+    for endpoint, entry in report["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(endpoint)
+        if base is None:
+            continue
+        for key in ("latency_ms", "ttft_ms"):
+            now, before = entry.get(key, {}).get("p95"), base.get(key, {}).get("p95")
+            if now is not None and before and now > before * (1 + tolerance):
+                regressions.append(f"{endpoint} {key} p95 {before} -> {now}")
+        if entry["errors"] > base.get("errors", 0):
+            regressions.append(f"{endpoint} errors {base.get('errors', 0)} -> {entry['errors']}")
+    return regressions
+
+
+def start_servers(args):
+    stub = ServerThread(create_stub_search(delay=args.search_delay, page_delay=args.search_delay),
+                        free_port())
+    fake = ServerThread(create_fake_ollama(
+        tokens=args.tokens, token_delay=args.token_delay, load_delay=args.load_delay,
+        prompt_delay=args.prompt_delay, latency=args.latency, parallel=args.parallel), free_port())
+    # api.py在导入时读取配置
+    os.environ["OLLAMA_HOST"] = fake.url
+    os.environ["SEARCH_URL"] = f"{stub.url}/html/"
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+    import api
+    return stub, fake, ServerThread(api.app, free_port())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local_deepseek_webui 负载测试")
+    parser.add_argument("--trace", help="回放的请求轨迹（JSONL），不指定时按下面的参数生成")
+    parser.add_argument("--save-trace", help="把生成的轨迹保存下来，之后可以重复回放")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50, help="生成轨迹的平均请求速率（每秒）")
+    parser.add_argument("--mix", default="chat=0.6,search=0.3,models=0.1")
+    parser.add_argument("--models", default="fake:latest", help="逗号分隔的模型名")
+    parser.add_argument("--queries", type=int, default=20, help="生成搜索请求时使用的不同查询数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=32, help="每个接口同时进行的请求数")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度，0表示忽略时间尽快发送")
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--load-delay", type=float, default=0.5)
+    parser.add_argument("--prompt-delay", type=float, default=0.0)
+    parser.add_argument("--parallel", type=int, default=0, help="假Ollama同时处理的请求数，0为不限制")
+    parser.add_argument("--search-delay", type=float, default=0.05)
+    parser.add_argument("--env", action="append", default=[], help="传给api.py的环境变量 KEY=VALUE")
+    parser.add_argument("--output", help="把报告写入文件，可作为之后的--baseline")
+    parser.add_argument("--baseline", help="与之前的报告比较，p95退化超过容差时返回非0")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = generate_trace(args.requests, args.rate, parse_mix(args.mix),
+                               args.models.split(","), args.queries, args.seed)
+        if args.save_trace:
+            write_jsonl(args.save_trace, trace)
+
+    stub, fake, api_server = start_servers(args)
+    lag = LoopLagProbe()
+    with stub, fake, api_server:
+        probe = asyncio.run_coroutine_threadsafe(lag.run(), api_server.loop)
+        results, wall = asyncio.run(replay(api_server.url, trace, args.concurrency, args.speed))
+        lag.running = False
+        probe.result()
+
+    report = build_report(results, wall, lag)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print("退化:", line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import json
+import logging
+import time
+import uuid
+from bisect import bisect_left
+from collections import deque
+
+logger = logging.getLogger("trace")
+
+# 秒为单位的默认分桶，覆盖从几毫秒的缓存命中到几分钟的长回答
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, format_labels(self.labelnames, labels), value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        # 只累加落入的那个桶，输出时再求累计值，观测本身是O(log n)
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                yield (self.name + "_bucket",
+                       format_labels(self.labelnames + ("le",), labels + (format_value(bound),)),
+                       cumulative)
+            base = format_labels(self.labelnames, labels)
+            yield self.name + "_sum", base, total
+            yield self.name + "_count", base, count
+
+
+class CallbackMetric(Metric):
+    """抓取时才调用函数取值，用于已经在别处计数的统计（缓存命中数、队列长度等）"""
+
+    def __init__(self, name: str, help: str, kind: str, labelnames, func):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.func = func
+
+    def samples(self):
+        for labels, value in self.func().items():
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield self.name, format_labels(self.labelnames, labels), value
+
+
+class Registry:
+    """Prometheus文本格式的指标注册表"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, kind, labelnames, func) -> CallbackMetric:
+        return self._add(CallbackMetric(name, help, kind, labelnames, func))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class ChatMetrics:
+    """聊天请求的指标：按接口和模型统计首token延迟、总耗时、排队时间、生成速度和Ollama各阶段耗时"""
+
+    def __init__(self, registry: Registry, trace_buffer: int = 200, log_traces: bool = False):
+        self.requests = registry.counter(
+            "llm_requests_total", "聊天请求数", ("endpoint", "model", "status"))
+        self.ttft = registry.histogram(
+            "llm_time_to_first_token_seconds", "从收到请求到第一个token的时间", ("endpoint", "model"))
+        self.duration = registry.histogram(
+            "llm_request_duration_seconds", "聊天请求总耗时", ("endpoint", "model"))
+        self.queue_wait = registry.histogram(
+            "llm_queue_wait_seconds", "调度器排队时间", ("model",))
+        self.tokens_per_second = registry.histogram(
+            "llm_tokens_per_second", "生成速度（eval_count / eval_duration）", ("model",), RATE_BUCKETS)
+        self.prompt_eval = registry.histogram(
+            "llm_prompt_eval_seconds", "Ollama处理提示词的时间", ("model",))
+        self.eval = registry.histogram(
+            "llm_eval_seconds", "Ollama生成回答的时间", ("model",))
+        self.load = registry.histogram(
+            "llm_load_seconds", "Ollama加载模型的时间", ("model",))
+        self.prompt_tokens = registry.counter(
+            "llm_prompt_tokens_total", "Ollama计算的提示词token数", ("model",))
+        self.completion_tokens = registry.counter(
+            "llm_completion_tokens_total", "生成的token数", ("model",))
+        self.recent = deque(maxlen=trace_buffer)
+        self.log_traces = log_traces
+
+    def trace(self, endpoint: str, model: str) -> "RequestTrace":
+        return RequestTrace(self, endpoint, model)
+
+
+class RequestTrace:
+    """单个请求各阶段的时间点，结束时一次性写入指标；流式路径上每个chunk只有一次判断"""
+
+    def __init__(self, metrics: ChatMetrics, endpoint: str, model: str):
+        self.metrics = metrics
+        self.id = uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.model = model
+        self.started = time.monotonic()
+        self.wait = None
+        self.first_token = None
+        self.usage = {}
+        self.status = None
+
+    def granted(self, wait: float):
+        self.wait = wait
+
+    def token(self):
+        if self.first_token is None:
+            self.first_token = time.monotonic() - self.started
+
+    def finish(self, status: str, usage: dict = None):
+        if self.status is not None:
+            return
+        self.status = status
+        self.usage = usage or {}
+        duration = time.monotonic() - self.started
+        m = self.metrics
+        m.requests.inc(self.endpoint, self.model, status)
+        m.duration.observe(duration, self.endpoint, self.model)
+        if self.first_token is not None:
+            m.ttft.observe(self.first_token, self.endpoint, self.model)
+        if self.wait is not None:
+            m.queue_wait.observe(self.wait, self.model)
+        self._observe_usage()
+        trace = {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "model": self.model,
+            "status": status,
+            "duration": round(duration, 4),
+            "queue_wait": round(self.wait, 4) if self.wait is not None else None,
+            "ttft": round(self.first_token, 4) if self.first_token is not None else None,
+            **self.usage
+        }
+        m.recent.append(trace)
+        if m.log_traces:
+            logger.info(json.dumps(trace))
+
+    def _observe_usage(self):
+        # Ollama的耗时单位是纳秒
+        usage, m, model = self.usage, self.metrics, self.model
+        if usage.get("prompt_eval_duration"):
+            m.prompt_eval.observe(usage["prompt_eval_duration"] / 1e9, model)
+        if usage.get("load_duration"):
+            m.load.observe(usage["load_duration"] / 1e9, model)
+        if usage.get("prompt_eval_count"):
+            m.prompt_tokens.inc(model, amount=usage["prompt_eval_count"])
+        if usage.get("eval_count"):
+            m.completion_tokens.inc(model, amount=usage["eval_count"])
+            if usage.get("eval_duration"):
+                m.eval.observe(usage["eval_duration"] / 1e9, model)
+                m.tokens_per_second.observe(
+                    usage["eval_count"] / (usage["eval_duration"] / 1e9), model)
+
+
+class MetricsMiddleware:
+    """ASGI中间件：按路由统计HTTP请求数和耗时（流式响应算到最后一个字节）"""
+
+    def __init__(self, app, registry: Registry):
+        self.app = app
+        self.requests = registry.counter(
+            "http_requests_total", "HTTP请求数", ("endpoint", "method", "status"))
+        self.duration = registry.histogram(
+            "http_request_duration_seconds", "HTTP请求耗时", ("endpoint", "method"))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.monotonic()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 路由匹配后scope中有endpoint，按函数名统计，避免路径参数导致标签过多
+            endpoint = scope.get("endpoint")
+            name = getattr(endpoint, "__name__", "unmatched")
+            self.requests.inc(name, scope["method"], status[0])
+            self.duration.observe(time.monotonic() - start, name, scope["method"])
@@ -0,0 +1,161 @@
+import os
+from functools import lru_cache
+from typing import List, Tuple
+
+# 搜索结果页解析后端：每个后端返回 (title, snippet, link) 列表，找到num_results条后立即停止
+
+ParsedResult = Tuple[str, str, str]
+
+
+def has_class(class_attr, name: str) -> bool:
+    return name in (class_attr or "").split()
+
+
+def parse_bs4(html: str, num_results: int) -> List[ParsedResult]:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    results = []
+    for result in soup.select('.result'):
+        title = result.select_one('.result__title')
+        snippet = result.select_one('.result__snippet')
+        link = result.select_one('.result__url')
+        if title is None or link is None:
+            continue
+        results.append((
+            title.get_text(strip=True),
+            snippet.get_text(strip=True) if snippet is not None else "",
+            link.get('href')
+        ))
+        if len(results) >= num_results:
+            break
+    return results
+
+
+def parse_selectolax(html: str, num_results: int) -> List[ParsedResult]:
+    from selectolax.lexbor import LexborHTMLParser
+
+    def text(node):
+        return node.text(deep=True, separator="", strip=True) if node is not None else ""
+
+    results = []
+    for result in LexborHTMLParser(html).css('.result'):
+        title = result.css_first('.result__title')
+        link = result.css_first('.result__url')
+        if title is None or link is None:
+            continue
+        results.append((text(title), text(result.css_first('.result__snippet')),
+                        link.attributes.get('href')))
+        if len(results) >= num_results:
+            break
+    return results
+
+
+LXML_FEED_SIZE = 16 * 1024
+
+
+def parse_lxml(html: str, num_results: int) -> List[ParsedResult]:
+    from lxml import etree
+
+    def text(element):
+        return "".join(t.strip() for t in element.itertext()) if element is not None else ""
+
+    def find(element, name):
+        for child in element.iter():
+            if has_class(child.get('class'), name):
+                return child
+        return None
+
+    # 增量解析：结果元素闭合时就提取，够数后不再喂入剩余的HTML
+    parser = etree.HTMLPullParser(events=("end",))
+    results = []
+    for start in range(0, len(html), LXML_FEED_SIZE):
+        parser.feed(html[start:start + LXML_FEED_SIZE])
+        for _, element in parser.read_events():
+            if not has_class(element.get('class'), 'result'):
+                continue
+            title = find(element, 'result__title')
+            link = find(element, 'result__url')
+            if title is None or link is None:
+                continue
+            results.append((text(title), text(find(element, 'result__snippet')), link.get('href')))
+            if len(results) >= num_results:
+                return results
+    parser.close()
+    return results
+
+
+# 网页正文提取：去掉脚本、样式和导航等非正文内容，按块级元素换行
+NOISE_TAGS = ["script", "style", "noscript", "header", "footer", "nav", "aside", "form", "svg"]
+
+
+def extract_text_bs4(html: str) -> str:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(NOISE_TAGS):
+        tag.decompose()
+    return soup.get_text("\n", strip=True)
+
+
+def extract_text_selectolax(html: str) -> str:
+    from selectolax.lexbor import LexborHTMLParser
+
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(NOISE_TAGS)
+    root = tree.body or tree.root
+    return root.text(separator="\n", strip=True) if root is not None else ""
+
+
+def extract_text_lxml(html: str) -> str:
+    import lxml.html
+
+    document = lxml.html.fromstring(html)
+    for element in document.xpath("|".join(f"//{tag}" for tag in NOISE_TAGS)):
+        element.drop_tree()
+    return "\n".join(t.strip() for t in document.itertext() if t.strip())
+
+
+BACKENDS = {
+    "selectolax": parse_selectolax,
+    "lxml": parse_lxml,
+    "bs4": parse_bs4
+}
+
+
+TEXT_BACKENDS = {
+    "selectolax": extract_text_selectolax,
+    "lxml": extract_text_lxml,
+    "bs4": extract_text_bs4
+}
+
+
+@lru_cache(maxsize=None)
+def available_backends() -> Tuple[str, ...]:
+    available = []
+    for name, module in (("selectolax", "selectolax.lexbor"), ("lxml", "lxml.etree"), ("bs4", "bs4")):
+        try:
+            __import__(module)
+            available.append(name)
+        except ImportError:
+            pass
+    return tuple(available)
+
+
+def backend_name(name: str = None) -> str:
+    # auto：按速度优先使用已安装的后端，都没有时退回BeautifulSoup
+    name = name or os.getenv("SEARCH_PARSER", "auto")
+    if name == "auto":
+        available = available_backends()
+        name = available[0] if available else "bs4"
+    if name not in BACKENDS:
+        raise ValueError(f"未知的解析后端: {name}")
+    return name
+
+
+def get_parser(name: str = None):
+    return BACKENDS[backend_name(name)]
+
+
+def get_text_extractor(name: str = None):
+    return TEXT_BACKENDS[backend_name(name)]
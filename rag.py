@@ -0,0 +1,126 @@
+import asyncio
+import re
+from typing import List
+
+from parsers import get_text_extractor
+from search import AsyncWebSearch, SearchResult, resolve_link
+
+CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def estimate_tokens(text: str) -> int:
+    # 粗略估计：中日韩字符约1个token，其余约4个字符1个token
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def query_terms(text: str) -> set:
+    # 英文按单词，中文按相邻两字切分
+    text = text.lower()
+    terms = set(WORD_PATTERN.findall(text))
+    cjk = CJK_PATTERN.findall(text)
+    terms.update(a + b for a, b in zip(cjk, cjk[1:]))
+    terms.update(cjk if len(cjk) == 1 else ())
+    return terms
+
+
+class Chunk:
+    def __init__(self, text: str, source: int, order: int):
+        self.text = text
+        self.source = source
+        self.order = order
+        self.score = 0.0
+
+
+def split_chunks(text: str, source: int, chunk_chars: int = 600) -> List[Chunk]:
+    chunks, current = [], []
+    size = 0
+    for line in text.split("\n"):
+        current.append(line)
+        size += len(line) + 1
+        if size >= chunk_chars:
+            chunks.append(Chunk("\n".join(current), source, len(chunks)))
+            current, size = [], 0
+    if current:
+        chunks.append(Chunk("\n".join(current), source, len(chunks)))
+    return chunks
+
+
+def rank_chunks(chunks: List[Chunk], query: str) -> List[Chunk]:
+    terms = query_terms(query)
+    for chunk in chunks:
+        chunk_terms = query_terms(chunk.text)
+        overlap = len(terms & chunk_terms)
+        # 命中的查询词越多越好，略微偏向页面靠前的内容
+        chunk.score = overlap / (len(terms) or 1) - chunk.order * 0.01
+    return sorted(chunks, key=lambda c: c.score, reverse=True)
+
+
+def select_chunks(chunks: List[Chunk], token_budget: int) -> List[Chunk]:
+    selected, used = [], 0
+    for chunk in chunks:
+        tokens = estimate_tokens(chunk.text)
+        if used + tokens > token_budget:
+            continue
+        selected.append(chunk)
+        used += tokens
+    return selected
+
+
+def format_context(results: List[SearchResult], chunks: List[Chunk]) -> str:
+    # 同一来源的片段放在一起，并保持它们在原文中的顺序
+    by_source = {}
+    for chunk in sorted(chunks, key=lambda c: (c.source, c.order)):
+        by_source.setdefault(chunk.source, []).append(chunk.text)
+    parts = ["以下是联网搜索得到的参考资料，回答时请优先依据这些资料，并用[编号]注明来源："]
+    for source, texts in by_source.items():
+        result = results[source]
+        parts.append(f"[{source + 1}] {result.title} ({resolve_link(result.link)})\n" + "\n...\n".join(texts))
+    return "\n\n".join(parts)
+
+
+class WebContextBuilder:
+    """搜索 -> 并行抓取网页 -> 分块排序 -> 按token预算组装上下文"""
+
+    def __init__(self, web_search: AsyncWebSearch, fetch_timeout: float = 5.0):
+        self.web_search = web_search
+        self.fetch_timeout = fetch_timeout
+
+    async def _page_text(self, result: SearchResult) -> str:
+        html = await self.web_search.fetch_page(result.link, timeout=self.fetch_timeout)
+        if not html:
+            return ""
+        return await asyncio.to_thread(get_text_extractor(), html)
+
+    async def build(self, query: str, num_results: int = 3, token_budget: int = 2000):
+        results = await self.web_search.search(query, num_results)
+        if not results:
+            return "", []
+        texts = await asyncio.gather(*[self._page_text(r) for r in results])
+
+        chunks = []
+        for source, (result, text) in enumerate(zip(results, texts)):
+            # 抓取失败的页面退回到搜索摘要
+            chunks.extend(split_chunks(text or result.snippet, source))
+        selected = select_chunks(rank_chunks(chunks, query), token_budget)
+        sources = [{"index": i + 1, "title": r.title, "link": resolve_link(r.link)}
+                   for i, r in enumerate(results)]
+        return format_context(results, selected), sources
+
+
+def inject_context(messages: list, context: str) -> list:
+    # 把参考资料作为系统消息插在最后一条用户消息前，前面的历史保持不变以复用KV缓存
+    if not context:
+        return messages
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i]["role"] == "user":
+            return messages[:i] + [{"role": "system", "content": context}] + messages[i:]
+    return messages + [{"role": "system", "content": context}]
+
+
+def last_user_message(messages: list) -> str:
+    for message in reversed(messages):
+        if message["role"] == "user":
+            return message["content"]
+    return ""
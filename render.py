@@ -0,0 +1,72 @@
+import time
+
+FENCE = "```"
+
+
+class StreamRenderer:
+    """流式文本的节流渲染：按时间/字数预算合并chunk，已完成的markdown块只渲染一次，之后只重绘末尾未完成的部分
+
+    container需要提供empty()方法（例如st.container()），每个块占用其中的一个占位元素。
+    """
+
+    def __init__(self, container, interval: float = 1 / 15, max_chars: int = 400,
+                 clock=time.monotonic):
+        self.container = container
+        self.interval = interval
+        self.max_chars = max_chars
+        self.clock = clock
+        self.text = ""
+        self._pending = ""
+        self._tail = None
+        self._last_render = 0.0
+        self._unrendered = 0
+        self.renders = 0
+        self.bytes_sent = 0
+
+    def feed(self, delta: str):
+        if not delta:
+            return
+        self.text += delta
+        self._pending += delta
+        self._unrendered += len(delta)
+        now = self.clock()
+        if now - self._last_render >= self.interval or self._unrendered >= self.max_chars:
+            self._commit_blocks()
+            self._render_tail()
+            self._last_render = now
+
+    def finish(self):
+        self._commit_blocks()
+        self._render_tail()
+        return self.text
+
+    def _markdown(self, placeholder, text):
+        placeholder.markdown(text)
+        self.renders += 1
+        self.bytes_sent += len(text.encode("utf-8"))
+
+    def _commit_blocks(self):
+        # 找到最后一个不在代码块内的空行，之前的内容已经完整，固定渲染后不再更新
+        end = len(self._pending)
+        while True:
+            boundary = self._pending.rfind("\n\n", 0, end)
+            if boundary < 0:
+                return
+            if self._pending[:boundary].count(FENCE) % 2 == 0:
+                break
+            end = boundary
+        block = self._pending[:boundary]
+        self._pending = self._pending[boundary + 2:]
+        if block.strip():
+            self._markdown(self._tail_placeholder(), block)
+            self._tail = None
+
+    def _tail_placeholder(self):
+        if self._tail is None:
+            self._tail = self.container.empty()
+        return self._tail
+
+    def _render_tail(self):
+        self._unrendered = 0
+        if self._pending or self._tail is not None:
+            self._markdown(self._tail_placeholder(), self._pending)
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+
+class QueueFullError(Exception):
+    def __init__(self, model: str, depth: int):
+        super().__init__(f"模型 {model} 的请求队列已满 ({depth})")
+        self.model = model
+        self.depth = depth
+
+
+class Ticket:
+    def __init__(self, model: str):
+        self.model = model
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.granted = asyncio.Event()
+
+    @property
+    def wait_time(self):
+        end = self.granted_at if self.granted_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+
+class ModelStats:
+    def __init__(self):
+        self.inflight = 0
+        self.served = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+class ModelScheduler:
+    """按模型排队的准入控制：限制每个模型的并发数，优先调度已加载模型的请求以减少模型切换"""
+
+    def __init__(self, max_queue: int = 32, max_inflight_per_model: int = 2,
+                 max_loaded_models: int = 1, max_swap_delay: float = 10.0):
+        self.max_queue = max_queue
+        self.max_inflight_per_model = max_inflight_per_model
+        self.max_loaded_models = max_loaded_models
+        # 等待切换的请求超过这个时间后，不再给已加载模型放行新请求，避免饿死
+        self.max_swap_delay = max_swap_delay
+        self._queues = {}
+        self._stats = {}
+        # 最近使用的模型，按LRU顺序，近似Ollama当前驻留内存的模型
+        self._resident = OrderedDict()
+
+    def _model_stats(self, model):
+        if model not in self._stats:
+            self._stats[model] = ModelStats()
+        return self._stats[model]
+
+    def submit(self, model: str) -> Ticket:
+        queue = self._queues.setdefault(model, deque())
+        if len(queue) >= self.max_queue:
+            self._model_stats(model).rejected += 1
+            raise QueueFullError(model, len(queue))
+        ticket = Ticket(model)
+        queue.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        queue = self._queues.get(ticket.model, ())
+        try:
+            return queue.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def release(self, ticket: Ticket):
+        if ticket.granted.is_set():
+            self._stats[ticket.model].inflight -= 1
+        else:
+            # 排队中的请求被取消（例如客户端断开）
+            queue = self._queues.get(ticket.model)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+        self._dispatch()
+
+    def _grant(self, model):
+        ticket = self._queues[model].popleft()
+        ticket.granted_at = time.monotonic()
+        stats = self._model_stats(model)
+        stats.inflight += 1
+        stats.served += 1
+        stats.total_wait += ticket.wait_time
+        stats.max_wait = max(stats.max_wait, ticket.wait_time)
+        self._resident[model] = True
+        self._resident.move_to_end(model)
+        ticket.granted.set()
+
+    def _active_models(self):
+        return [m for m, s in self._stats.items() if s.inflight > 0]
+
+    def _dispatch(self):
+        while True:
+            waiting = [m for m, q in self._queues.items() if q]
+            if not waiting:
+                return
+            now = time.monotonic()
+            swapping = [m for m in waiting if m not in self._resident]
+            starving = min(swapping, key=lambda m: self._queues[m][0].enqueued_at, default=None)
+            if starving is not None and now - self._queues[starving][0].enqueued_at > self.max_swap_delay:
+                # 等待切换的请求已经饿了太久：不再放行其他模型的新请求，等正在处理的请求结束、
+                # 有空余的模型位后立即切换到这个模型
+                if len(self._active_models()) >= self.max_loaded_models:
+                    return
+                self._make_room()
+                self._grant(starving)
+                continue
+
+            # 1. 已加载模型的请求优先，不需要切换模型
+            loaded = [m for m in waiting if m in self._resident
+                      and self._model_stats(m).inflight < self.max_inflight_per_model]
+            if loaded:
+                self._grant(min(loaded, key=lambda m: self._queues[m][0].enqueued_at))
+                continue
+
+            # 2. 还有空余的模型位时，按等待时间先后加载新模型
+            active = self._active_models()
+            candidates = [m for m in waiting
+                          if self._model_stats(m).inflight < self.max_inflight_per_model
+                          and (m in active or len(active) < self.max_loaded_models)]
+            if not candidates:
+                return
+            model = min(candidates, key=lambda m: self._queues[m][0].enqueued_at)
+            if model not in active:
+                self._make_room()
+            self._grant(model)
+
+    def _make_room(self):
+        # 换出最久未使用且空闲的模型
+        for resident in list(self._resident):
+            if len(self._resident) < self.max_loaded_models:
+                break
+            if self._model_stats(resident).inflight == 0:
+                del self._resident[resident]
+
+    def mark_resident(self, model: str):
+        # 启动时预加载的模型：视为已加载，之后的请求不会被当作需要切换模型
+        if model in self._resident:
+            return
+        self._make_room()
+        if len(self._resident) < self.max_loaded_models:
+            self._resident[model] = True
+
+    def stats(self):
+        models = set(self._queues) | set(self._stats)
+        result = {}
+        for model in sorted(models):
+            stats = self._model_stats(model)
+            queue = self._queues.get(model, ())
+            result[model] = {
+                "queued": len(queue),
+                "inflight": stats.inflight,
+                "served": stats.served,
+                "rejected": stats.rejected,
+                "avg_wait": stats.total_wait / stats.served if stats.served else 0.0,
+                "max_wait": stats.max_wait,
+                "oldest_wait": queue[0].wait_time if queue else 0.0,
+                "resident": model in self._resident
+            }
+        return result
@@ -1,7 +1,22 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import ipaddress
+import logging
+import os
+import socket
+import time
+from collections import Counter
+import httpx
+from cachetools import TTLCache
 from typing import List, Dict
-from urllib.parse import quote_plus
+from urllib.parse import quote_plus, urlparse, parse_qs
+from parsers import get_parser
+
+logger = logging.getLogger(__name__)
+
+SEARCH_URL = os.getenv("SEARCH_URL", "https://html.duckduckgo.com/html/")
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
 
 class SearchResult:
     def __init__(self, title: str, snippet: str, link: str):
@@ -9,32 +24,92 @@ class SearchResult:
         self.snippet = snippet
         self.link = link
 
+    def to_dict(self) -> Dict[str, str]:
+        return {"title": self.title, "snippet": self.snippet, "link": self.link}
+
+def resolve_link(link: str) -> str:
+    # DuckDuckGo的结果链接是跳转地址（//duckduckgo.com/l/?uddg=...），取出真实地址
+    if link.startswith("//"):
+        link = "https:" + link
+    parsed = urlparse(link)
+    if parsed.netloc.endswith("duckduckgo.com") and parsed.path.startswith("/l/"):
+        target = parse_qs(parsed.query).get("uddg")
+        if target:
+            return target[0]
+    return link
+
+class UnsafeURLError(ValueError):
+    pass
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    # IPv4映射的IPv6地址（::ffff:127.0.0.1）按IPv4判断
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    # is_global排除了回环、私有、链路本地、保留等地址
+    return ip.is_global and not ip.is_multicast
+
+async def check_public_url(url: str) -> str:
+    # 搜索结果和跳转目标来自外部，抓取前确认不会访问本机或内网服务（例如Ollama的11434端口）；
+    # 返回检查过的地址，抓取时直接连接这个地址
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise UnsafeURLError(f"不支持的链接: {url}")
+    try:
+        addresses = [str(ipaddress.ip_address(parsed.hostname))]
+    except ValueError:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80),
+            type=socket.SOCK_STREAM)
+        addresses = [info[4][0] for info in infos]
+    if not addresses or not all(is_public_address(a) for a in addresses):
+        raise UnsafeURLError(f"拒绝抓取本机或内网地址: {url}")
+    return addresses[0]
+
+def pin_address(url: str, address: str):
+    # 把链接的域名换成检查过的IP，httpx不再自己解析域名（防止DNS重绑定：检查时解析到公网地址，
+    # 连接时却解析到127.0.0.1）；Host头和TLS的SNI/证书校验仍使用原来的域名。
+    # 返回 (请求地址, 请求头, 扩展参数)
+    original = httpx.URL(url)
+    headers = {"Host": original.netloc.decode("ascii")}
+    extensions = {}
+    if original.scheme == "https":
+        extensions["sni_hostname"] = original.raw_host.decode("ascii")
+    return original.copy_with(host=address), headers, extensions
+
 class WebSearch:
     @staticmethod
     def search_duckduckgo(query: str, num_results: int = 5) -> List[SearchResult]:
-        search_url = f"https://html.duckduckgo.com/html/?q={quote_plus(query)}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
+        search_url = f"{SEARCH_URL}?q={quote_plus(query)}"
+
+        # 同步版本只在脚本中使用，服务启动时不导入requests
+        import requests
+
         try:
-            response = requests.get(search_url, headers=headers)
+            response = requests.get(search_url, headers=HEADERS, timeout=10)
             response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            results = []
-            
-            for result in soup.select('.result')[:num_results]:
-                title = result.select_one('.result__title').get_text(strip=True)
-                snippet = result.select_one('.result__snippet').get_text(strip=True)
-                link = result.select_one('.result__url').get('href')
-                
-                results.append(SearchResult(title, snippet, link))
-            
-            return results
+            return WebSearch.parse_results(response.text, num_results)
         except Exception as e:
-            print(f"搜索出错: {str(e)}")
+            logger.warning("搜索出错: %s", e)
             return []
-    
+
+    @staticmethod
+    def parse_results(html: str, num_results: int, backend: str = None) -> List[SearchResult]:
+        return [SearchResult(title, snippet, link)
+                for title, snippet, link in get_parser(backend)(html, num_results)]
+
+    @staticmethod
+    def merge_results(result_lists: List[List[SearchResult]]) -> List[SearchResult]:
+        # 按排名轮流合并多个查询的结果，同一链接只保留第一次出现
+        merged = []
+        seen = set()
+        for rank in range(max((len(r) for r in result_lists), default=0)):
+            for results in result_lists:
+                if rank < len(results) and results[rank].link not in seen:
+                    seen.add(results[rank].link)
+                    merged.append(results[rank])
+        return merged
+
     @staticmethod
     def format_results(results: List[SearchResult]) -> str:
         formatted = "搜索结果:\n\n"
@@ -42,4 +117,131 @@ class WebSearch:
             formatted += f"{i}. {result.title}\n"
             formatted += f"   {result.snippet}\n"
             formatted += f"   链接: {result.link}\n\n"
-        return formatted
\ No newline at end of file
+        return formatted
+
+
+class AsyncWebSearch:
+    """共享连接池的异步搜索，带TTL缓存，并合并同时进行的相同查询"""
+
+    def __init__(self, timeout: float = 10.0, cache_ttl: float = 600,
+                 cache_size: int = 1024, max_connections: int = 16, latency=None,
+                 allow_private_pages: bool = False, max_redirects: int = 5):
+        self._client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+            follow_redirects=True
+        )
+        # 抓取网页单独用一个不保持连接的客户端：连接按IP复用时，可能把一个域名的TLS连接
+        # 用到同一IP上的另一个域名
+        self._page_client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=0)
+        )
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = Counter()
+        # 可选的耗时直方图，标签为 (search|page, ok|error)
+        self.latency = latency
+        # 只在测试时允许抓取本机页面
+        self.allow_private_pages = allow_private_pages
+        self.max_redirects = max_redirects
+
+    def _observe(self, kind: str, start: float, ok: bool):
+        if not ok:
+            self.errors[kind] += 1
+        if self.latency is not None:
+            self.latency.observe(time.monotonic() - start, kind, "ok" if ok else "error")
+
+    async def search(self, query: str, num_results: int = 5) -> List[SearchResult]:
+        key = (query.strip().lower(), num_results)
+        results = self._cache.get(key)
+        if results is not None:
+            self.hits += 1
+            return results
+        self.misses += 1
+
+        # 相同查询正在进行时等待同一个结果，不重复请求
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(query, num_results))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            self._inflight[key] = task
+        results = await asyncio.shield(task)
+        if results:
+            self._cache[key] = results
+        return results
+
+    async def _fetch(self, query: str, num_results: int) -> List[SearchResult]:
+        start = time.monotonic()
+        try:
+            response = await self._client.get(SEARCH_URL, params={"q": query})
+            response.raise_for_status()
+            # 解析HTML是CPU密集的，放到线程里避免阻塞事件循环
+            results = await asyncio.to_thread(WebSearch.parse_results, response.text, num_results)
+        except Exception as e:
+            logger.warning("搜索出错 %r: %s", query, e)
+            self._observe("search", start, False)
+            return []
+        self._observe("search", start, True)
+        return results
+
+    async def fetch_page(self, url: str, timeout: float = 5.0,
+                         max_bytes: int = 512 * 1024) -> str:
+        # 抓取网页原文，只读取前max_bytes字节，非HTML/文本内容直接忽略；
+        # 手动跟随重定向，每一跳都检查目标地址
+        start = time.monotonic()
+        try:
+            target = resolve_link(url)
+            for _ in range(self.max_redirects + 1):
+                request_url, headers, extensions = target, None, None
+                if not self.allow_private_pages:
+                    address = await asyncio.wait_for(check_public_url(target), timeout)
+                    request_url, headers, extensions = pin_address(target, address)
+                async with self._page_client.stream("GET", request_url, headers=headers,
+                                                    timeout=timeout,
+                                                    extensions=extensions) as response:
+                    if response.is_redirect:
+                        # 相对跳转按原来的域名解析，不是按连接用的IP
+                        target = str(httpx.URL(target).join(response.headers["location"]))
+                        continue
+                    response.raise_for_status()
+                    content_type = response.headers.get("content-type", "")
+                    if "html" not in content_type and "text" not in content_type:
+                        self._observe("page", start, True)
+                        return ""
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        body.extend(chunk)
+                        if len(body) >= max_bytes:
+                            break
+                    self._observe("page", start, True)
+                    return body[:max_bytes].decode(response.encoding or "utf-8", errors="replace")
+            raise httpx.TooManyRedirects("重定向次数过多")
+        except Exception as e:
+            logger.warning("抓取网页出错 %s: %s", url, e)
+            self._observe("page", start, False)
+            return ""
+
+    async def search_many(self, queries: List[str], num_results: int = 5):
+        result_lists = await asyncio.gather(
+            *[self.search(query, num_results) for query in queries])
+        return result_lists, WebSearch.merge_results(result_lists)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._cache),
+            "errors": dict(self.errors)
+        }
+
+    async def aclose(self):
+        await self._client.aclose()
+        await self._page_client.aclose()
@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 相似度分布的分桶下界，用于调整阈值
+SIMILARITY_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.925, 0.95, 0.975, 0.99)
+
+
+class SemanticIndex:
+    """一个分区内的向量索引：归一化后的向量按行存放在连续的矩阵中，查询是一次矩阵乘向量；
+    删除时用最后一行填补空位，矩阵始终是紧凑的"""
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.dim = dim
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, entry_id: int, vector: np.ndarray) -> int:
+        row = len(self.ids)
+        if row == len(self.vectors):
+            # 容量翻倍，摊还后每次添加是O(1)
+            grown = np.empty((row * 2, self.dim), dtype=np.float32)
+            grown[:row] = self.vectors[:row]
+            self.vectors = grown
+        self.vectors[row] = vector
+        self.ids.append(entry_id)
+        return row
+
+    def remove(self, row: int):
+        # 返回被移动到row的条目id，没有移动时返回None
+        last = len(self.ids) - 1
+        moved = None
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.ids[row] = self.ids[last]
+            moved = self.ids[row]
+        self.ids.pop()
+        return moved
+
+    def search(self, vector: np.ndarray):
+        # 返回 (行号, 余弦相似度)，索引为空时行号为None
+        count = len(self.ids)
+        if not count:
+            return None, 0.0
+        scores = self.vectors[:count] @ vector
+        row = int(np.argmax(scores))
+        return row, float(scores[row])
+
+
+class SemanticEntry:
+    def __init__(self, partition: str, row: int, prompt: str, chunks: list):
+        self.partition = partition
+        self.row = row
+        self.prompt = prompt
+        self.chunks = chunks
+        self.created_at = time.time()
+        self.hits = 0
+
+
+class SemanticLookup:
+    # 一次查询的结果，未命中时保留向量，回答生成后用put保存，不需要重新计算向量
+    def __init__(self, partition: str, prompt: str, vector: np.ndarray, chunks=None,
+                 score: float = 0.0):
+        self.partition = partition
+        self.prompt = prompt
+        self.vector = vector
+        self.chunks = chunks
+        self.score = score
+
+
+class SemanticCache:
+    """近似重复提问的语义缓存：用Ollama的嵌入模型计算最后一条用户消息的向量，
+    按 (模型, 系统提示词) 分区查找最相似的已缓存问题，相似度超过阈值时返回缓存的回答。
+    只缓存单轮提问，多轮对话的回答依赖历史，不适合按最后一条消息匹配"""
+
+    def __init__(self, embed, threshold: float = 0.92, max_entries: int = 10000,
+                 ttl: float = 24 * 3600, thread_threshold: int = 4096):
+        # embed: async (text) -> 向量
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # 索引超过这个大小时在线程中做矩阵乘法，不阻塞事件循环
+        self.thread_threshold = thread_threshold
+        self._partitions = {}
+        # 条目id -> SemanticEntry，按最近使用排序，超过容量时淘汰最久未命中的
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.errors = 0
+        self.stores = 0
+        self.evictions = 0
+        self.searches = 0
+        self.embed_seconds = 0.0
+        self.search_seconds = 0.0
+        self.similarity = [0] * len(SIMILARITY_BUCKETS)
+        self.recent = deque(maxlen=50)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def prompt_of(messages: list):
+        # 只有系统消息和一条用户消息的请求可以缓存，返回 (系统提示词, 用户消息)
+        system = [m["content"] for m in messages if m["role"] == "system"]
+        others = [m for m in messages if m["role"] != "system"]
+        if len(others) != 1 or others[0]["role"] != "user" or not others[0]["content"].strip():
+            return None
+        return "\n".join(system), others[0]["content"]
+
+    @staticmethod
+    def partition_key(model: str, system: str, dim: int) -> str:
+        # 向量维度也作为分区的一部分，更换嵌入模型后旧的索引不会被误用
+        raw = json.dumps([model, system, dim], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def lookup(self, model: str, messages: list):
+        # 不能缓存或计算向量失败时返回None；否则返回SemanticLookup，命中时chunks不为None
+        prompt = self.prompt_of(messages)
+        if prompt is None:
+            self.skipped += 1
+            return None
+        system, content = prompt
+        start = time.perf_counter()
+        try:
+            vector = np.asarray(await self.embed(content), dtype=np.float32)
+        except Exception as e:
+            # 嵌入模型不可用时按未命中处理，不影响正常回答
+            self.errors += 1
+            logger.warning("计算嵌入向量失败: %s", e)
+            return None
+        self.embed_seconds += time.perf_counter() - start
+        norm = float(np.linalg.norm(vector))
+        if not norm:
+            self.skipped += 1
+            return None
+        vector /= norm
+
+        key = self.partition_key(model, system, len(vector))
+        lookup = SemanticLookup(key, content, vector)
+        index = self._partitions.get(key)
+        if index is None:
+            self.misses += 1
+            return lookup
+
+        start = time.perf_counter()
+        if len(index) >= self.thread_threshold:
+            row, _ = await asyncio.to_thread(index.search, vector)
+        else:
+            row, _ = index.search(vector)
+        self.search_seconds += time.perf_counter() - start
+        self.searches += 1
+        entry_id = index.ids[row] if row is not None and row < len(index) else None
+        # 线程中搜索时索引可能被修改，按当前的行重新计算相似度
+        score = float(index.vectors[row] @ vector) if entry_id is not None else 0.0
+        self._record(score)
+        entry = self._entries.get(entry_id)
+        if entry is not None and time.time() - entry.created_at > self.ttl:
+            self._remove(entry_id)
+            entry = None
+        if entry is None or score < self.threshold:
+            self.misses += 1
+            return lookup
+
+        self.hits += 1
+        entry.hits += 1
+        self._entries.move_to_end(entry_id)
+        self.recent.append({"prompt": content, "matched": entry.prompt,
+                            "similarity": round(score, 4), "at": time.time()})
+        lookup.chunks = entry.chunks
+        lookup.score = score
+        return lookup
+
+    def put(self, lookup: SemanticLookup, chunks: list):
+        index = self._partitions.get(lookup.partition)
+        if index is None:
+            index = self._partitions[lookup.partition] = SemanticIndex(len(lookup.vector))
+        entry_id = self._next_id
+        self._next_id += 1
+        row = index.add(entry_id, lookup.vector)
+        self._entries[entry_id] = SemanticEntry(lookup.partition, row, lookup.prompt, list(chunks))
+        self.stores += 1
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        index = self._partitions[entry.partition]
+        moved = index.remove(entry.row)
+        if moved is not None:
+            self._entries[moved].row = entry.row
+        if not len(index):
+            del self._partitions[entry.partition]
+
+    def _record(self, score: float):
+        for i in reversed(range(len(SIMILARITY_BUCKETS))):
+            if score >= SIMILARITY_BUCKETS[i]:
+                self.similarity[i] += 1
+                return
+
+    def clear(self):
+        self._partitions.clear()
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "partitions": len(self._partitions),
+            "avg_embed_ms": self.embed_seconds / (lookups or 1) * 1000,
+            "avg_search_ms": self.search_seconds / (self.searches or 1) * 1000,
+            # 每次查询的最高相似度分布：大量落在阈值附近说明阈值可能需要调整
+            "similarity": {f">={b}": n for b, n in zip(SIMILARITY_BUCKETS, self.similarity)},
+            "recent_hits": list(self.recent)
+        }
@@ -0,0 +1,178 @@
+import time
+import uuid
+
+from cachetools import LRUCache
+
+from context import SUMMARY_PREFIX
+from state import StateStore
+
+# 保存到共享状态的字段，summary_task只属于当前进程
+STATE_FIELDS = ("id", "model", "system_prompt", "options", "keep_alive", "messages", "chat_id",
+                "context_start", "summary", "summary_upto", "pending_summary", "pending_upto",
+                "created_at", "updated_at")
+
+
+class SessionBusyError(Exception):
+    pass
+
+
+class Session:
+    def __init__(self, model: str, system_prompt: str = "", options: dict = None,
+                 keep_alive=None, messages: list = None, chat_id: str = None):
+        self.id = uuid.uuid4().hex
+        self.model = model
+        self.system_prompt = system_prompt
+        self.options = options or {}
+        self.keep_alive = keep_alive
+        self.messages = list(messages or [])
+        self.chat_id = chat_id
+        # 上下文窗口：messages[:context_start]已移出窗口，其中[:summary_upto]已总结为summary
+        self.context_start = 0
+        self.summary = ""
+        self.summary_upto = 0
+        # 已完成但还没换上的摘要，覆盖messages[:pending_upto]，窗口下次移动时替换summary
+        self.pending_summary = ""
+        self.pending_upto = 0
+        self.summary_task = None
+        # 共享状态中的版本号，与本地对象一致时不需要重新反序列化
+        self.version = 0
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    @classmethod
+    def from_state(cls, data: dict) -> "Session":
+        session = cls.__new__(cls)
+        for field in STATE_FIELDS:
+            setattr(session, field, data[field])
+        session.summary_task = None
+        session.version = data["version"]
+        return session
+
+    def to_state(self) -> dict:
+        return {field: getattr(self, field) for field in STATE_FIELDS}
+
+    def prefix(self) -> list:
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        if self.summary:
+            messages.append({"role": "system", "content": SUMMARY_PREFIX + self.summary})
+        return messages
+
+    def prompt(self, content: str) -> list:
+        # 历史按保存时的内容原样发送，保证每轮发给Ollama的前缀逐字节一致，
+        # 这样Ollama可以复用KV缓存，只计算新增的token
+        messages = self.prefix()
+        messages.extend(self.messages[self.context_start:])
+        messages.append({"role": "user", "content": content})
+        return messages
+
+    def append_turn(self, content: str, answer: str):
+        # answer不含推理过程：推理过程很长，保留在历史中会让窗口很快超出预算
+        self.messages.append({"role": "user", "content": content})
+        self.messages.append({"role": "assistant", "content": answer})
+        self.updated_at = time.time()
+
+    def to_dict(self, include_messages: bool = True):
+        data = {
+            "id": self.id,
+            "model": self.model,
+            "system_prompt": self.system_prompt,
+            "options": self.options,
+            "keep_alive": self.keep_alive,
+            "chat_id": self.chat_id,
+            "message_count": len(self.messages),
+            "context_start": self.context_start,
+            "summary": self.summary,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+        if include_messages:
+            data["messages"] = self.messages
+        return data
+
+
+class SessionStore:
+    """服务端会话保存在共享状态中，任何worker都能继续同一个会话；本进程缓存最近用过的会话对象，
+    版本号没变时直接复用。同一会话同时只允许一个请求生成回答（带过期时间的租约）"""
+
+    PREFIX = "session:"
+
+    def __init__(self, state: StateStore, max_sessions: int = 1024, ttl: float = 24 * 3600,
+                 lease: float = 600.0):
+        self.state = state
+        self.ttl = ttl
+        self.lease = lease
+        self._local = LRUCache(maxsize=max_sessions)
+
+    def _key(self, session_id):
+        return self.PREFIX + session_id
+
+    def _cached(self, data: dict) -> Session:
+        session = self._local.get(data["id"])
+        if session is None or session.version != data["version"]:
+            session = Session.from_state(data)
+            self._local[session.id] = session
+        return session
+
+    async def create(self, **kwargs) -> Session:
+        session = Session(**kwargs)
+        session.version = 1
+        await self.state.set(self._key(session.id),
+                             {**session.to_state(), "version": 1, "busy_until": 0}, self.ttl)
+        self._local[session.id] = session
+        return session
+
+    async def get(self, session_id: str):
+        data = await self.state.get(self._key(session_id))
+        if data is None:
+            self._local.pop(session_id, None)
+            return None
+        return self._cached(data)
+
+    async def acquire(self, session_id: str):
+        # 原子地占用会话；会话不存在时返回None，正在生成回答时抛出SessionBusyError
+        now = time.time()
+
+        def acquire(data):
+            if data is None:
+                return None
+            if data["busy_until"] > now:
+                raise SessionBusyError(session_id)
+            return {**data, "busy_until": now + self.lease}
+
+        data = await self.state.update(self._key(session_id), acquire, self.ttl)
+        return self._cached(data) if data is not None else None
+
+    async def release(self, session: Session):
+        # 写回本轮的修改（新消息、参数、窗口位置）并释放会话
+        def release(data):
+            if data is None:
+                return None
+            return {**session.to_state(), "version": data["version"] + 1, "busy_until": 0}
+
+        data = await self.state.update(self._key(session.id), release, self.ttl)
+        if data is not None:
+            session.version = data["version"]
+
+    async def save_summary(self, session: Session):
+        # 后台总结完成后只更新待换上的摘要，不覆盖其他worker写入的新消息
+        in_sync = []
+
+        def save(data):
+            if data is None:
+                return data
+            if max(data["summary_upto"], data["pending_upto"]) >= session.pending_upto:
+                return data
+            in_sync[:] = [data["version"] == session.version]
+            return {**data, "pending_summary": session.pending_summary,
+                    "pending_upto": session.pending_upto, "version": data["version"] + 1}
+
+        data = await self.state.update(self._key(session.id), save, self.ttl)
+        # 本地对象原来就是最新的，写入摘要后仍然是最新的
+        if in_sync == [True]:
+            session.version = data["version"]
+
+    async def delete(self, session_id: str) -> bool:
+        self._local.pop(session_id, None)
+        return await self.state.delete(self._key(session_id))
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+
+from backends import Backend, BackendPool
+
+logger = logging.getLogger(__name__)
+
+
+class StartupOrchestrator:
+    """服务启动后在后台轮询Ollama直到可用，再把配置的模型预加载到内存（可选先下载缺少的模型），
+    就绪检查接口根据这里的状态判断服务是否可以接收流量"""
+
+    def __init__(self, pool: BackendPool, models: list, keep_alive: str = "30m",
+                 pull_missing: bool = False, poll_interval: float = 0.1,
+                 max_poll_interval: float = 0.5, load_timeout: float = 300.0):
+        self.pool = pool
+        self.models = models
+        self.keep_alive = keep_alive
+        self.pull_missing = pull_missing
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.load_timeout = load_timeout
+        self.started_at = time.monotonic()
+        self.ollama_ready_at = None
+        self.finished_at = None
+        # 模型 -> {"status": pending/pulling/loading/ready/failed, ...}
+        self.warm = {model: {"status": "pending"} for model in models}
+        # 模型在某个后端加载完成时的回调，例如通知调度器该模型已驻留
+        self.on_loaded = []
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return self.finished_at is not None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        await self._wait_for_ollama()
+        await asyncio.gather(*[self._warm_model(model) for model in self.models])
+        self.finished_at = time.monotonic()
+        logger.info("启动完成，用时%.2f秒: %s", self.finished_at - self.started_at,
+                    {m: w["status"] for m, w in self.warm.items()})
+
+    async def _wait_for_ollama(self):
+        # 代替固定的sleep：按指数退避轮询，Ollama一启动就能继续
+        interval = self.poll_interval
+        while True:
+            await self.pool.check_all()
+            if any(b.healthy for b in self.pool.backends):
+                self.ollama_ready_at = time.monotonic()
+                logger.info("Ollama已就绪，等待%.2f秒", self.ollama_ready_at - self.started_at)
+                return
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+
+    async def _warm_model(self, model: str):
+        state = self.warm[model]
+        backends = [b for b in self.pool.backends if b.healthy]
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *[self._warm_backend(b, model, state) for b in backends], return_exceptions=True)
+        hosts = [b.host for b, r in zip(backends, results) if r is True]
+        errors = [f"{b.host}: {r}" for b, r in zip(backends, results) if r is not True]
+        state.update(hosts=hosts, seconds=round(time.monotonic() - start, 3))
+        if hosts:
+            state["status"] = "ready"
+            for callback in self.on_loaded:
+                callback(model)
+        else:
+            state.update(status="failed", error="; ".join(errors))
+            logger.warning("预加载模型 %s 失败: %s", model, state["error"])
+
+    async def _warm_backend(self, backend: Backend, model: str, state: dict):
+        if not backend.has_model(model):
+            if not self.pull_missing:
+                return "模型未安装"
+            state["status"] = "pulling"
+            response = await backend.http.post(
+                "/api/pull", json={"model": model, "stream": False}, timeout=None)
+            response.raise_for_status()
+        state["status"] = "loading"
+        # 不带prompt的generate请求只加载模型，keep_alive让它一直驻留内存
+        response = await backend.http.post(
+            "/api/generate", json={"model": model, "keep_alive": self.keep_alive, "stream": False},
+            timeout=self.load_timeout)
+        response.raise_for_status()
+        return True
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "ready": self.ready,
+            "ollama_ready": self.ollama_ready_at is not None,
+            "uptime": round(now - self.started_at, 3),
+            "ollama_wait": round(self.ollama_ready_at - self.started_at, 3)
+            if self.ollama_ready_at is not None else None,
+            "startup_seconds": round(self.finished_at - self.started_at, 3)
+            if self.finished_at is not None else None,
+            "models": self.warm
+        }
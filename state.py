@@ -0,0 +1,346 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+
+
+class Subscription:
+    def __init__(self, queue: asyncio.Queue):
+        self._queue = queue
+
+    async def get(self, timeout: float = None):
+        # 超时返回None，调用方可以借机重新读取状态
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class StateStore:
+    """多个worker共享的可变状态：JSON值的读写、原子更新和按频道的变化通知。
+    update(key, fn)中fn收到当前值（不存在时为None），返回新值，返回None表示删除；
+    fn可能被重试，不能有副作用"""
+
+    def __init__(self):
+        self._subscribers = {}
+
+    async def get(self, key: str):
+        raise NotImplementedError
+
+    async def set(self, key: str, value, ttl: float = None):
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def update(self, key: str, fn, ttl: float = None):
+        raise NotImplementedError
+
+    async def items(self, prefix: str) -> list:
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message):
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(channel, set()).add(queue)
+        try:
+            await self._listen(channel)
+            yield Subscription(queue)
+        finally:
+            queues = self._subscribers.get(channel)
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[channel]
+                await self._unlisten(channel)
+
+    async def _listen(self, channel: str):
+        pass
+
+    async def _unlisten(self, channel: str):
+        pass
+
+    def _dispatch(self, channel: str, message):
+        for queue in self._subscribers.get(channel, ()):
+            queue.put_nowait(message)
+
+    async def close(self):
+        pass
+
+
+class MemoryState(StateStore):
+    """单进程：值以JSON保存，读出的是副本，和其他后端的行为一致"""
+
+    def __init__(self):
+        super().__init__()
+        self._data = {}
+
+    def _read(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        raw, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            del self._data[key]
+            return None
+        return json.loads(raw)
+
+    def _write(self, key, value, ttl):
+        if value is None:
+            self._data.pop(key, None)
+        else:
+            self._data[key] = (json.dumps(value), time.time() + ttl if ttl else None)
+
+    async def get(self, key: str):
+        return self._read(key)
+
+    async def set(self, key: str, value, ttl: float = None):
+        self._write(key, value, ttl)
+
+    async def delete(self, key: str) -> bool:
+        return self._data.pop(key, None) is not None
+
+    async def update(self, key: str, fn, ttl: float = None):
+        # 读和写之间没有await，在事件循环中天然是原子的
+        value = fn(self._read(key))
+        self._write(key, value, ttl)
+        return value
+
+    async def items(self, prefix: str) -> list:
+        keys = [key for key in self._data if key.startswith(prefix)]
+        items = [(key, self._read(key)) for key in keys]
+        return [(key, value) for key, value in items if value is not None]
+
+    async def publish(self, channel: str, message):
+        self._dispatch(channel, json.loads(json.dumps(message)))
+
+
+class SQLiteState(StateStore):
+    """同一台机器上的多个worker共享一个SQLite文件：原子更新用BEGIN IMMEDIATE事务，
+    通知写入events表，有订阅者时后台轮询新事件并分发给本进程的订阅者"""
+
+    def __init__(self, path: str, poll_interval: float = 0.05, event_ttl: float = 60.0):
+        super().__init__()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.poll_interval = poll_interval
+        self.event_ttl = event_ttl
+        self._lock = threading.Lock()
+        # 自动提交模式，需要原子性的地方显式开启事务
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, "
+            "message TEXT NOT NULL, created_at REAL NOT NULL)")
+        self._published = 0
+        self._poller = None
+
+    def _read(self, key):
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM state WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def _write(self, key, value, ttl):
+        if value is None:
+            return self._conn.execute("DELETE FROM state WHERE key = ?", (key,)).rowcount > 0
+        self._conn.execute(
+            "INSERT OR REPLACE INTO state VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl if ttl else None))
+        return True
+
+    def _get(self, key):
+        with self._lock:
+            return self._read(key)
+
+    def _set(self, key, value, ttl):
+        with self._lock:
+            return self._write(key, value, ttl)
+
+    def _update(self, key, fn, ttl):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = fn(self._read(key))
+                self._write(key, value, ttl)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def _items(self, prefix):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM state WHERE key >= ? AND key < ? "
+                "AND (expires_at IS NULL OR expires_at >= ?)",
+                (prefix, prefix + "\uffff", time.time())).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def _publish(self, channel, message):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO events (channel, message, created_at) VALUES (?, ?, ?)",
+                (channel, json.dumps(message), now))
+            self._published += 1
+            # 定期清理旧事件和过期的键
+            if self._published % 500 == 0:
+                self._conn.execute("DELETE FROM events WHERE created_at < ?",
+                                   (now - self.event_ttl,))
+                self._conn.execute("DELETE FROM state WHERE expires_at < ?", (now,))
+
+    def _poll(self, after):
+        with self._lock:
+            if after is None:
+                return self._conn.execute("SELECT MAX(id) FROM events").fetchone()[0] or 0, []
+            rows = self._conn.execute(
+                "SELECT id, channel, message FROM events WHERE id > ? ORDER BY id",
+                (after,)).fetchall()
+        return (rows[-1][0] if rows else after), rows
+
+    async def get(self, key: str):
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value, ttl: float = None):
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def delete(self, key: str) -> bool:
+        return await asyncio.to_thread(self._set, key, None, None)
+
+    async def update(self, key: str, fn, ttl: float = None):
+        return await asyncio.to_thread(self._update, key, fn, ttl)
+
+    async def items(self, prefix: str) -> list:
+        return await asyncio.to_thread(self._items, prefix)
+
+    async def publish(self, channel: str, message):
+        await asyncio.to_thread(self._publish, channel, message)
+
+    async def _listen(self, channel: str):
+        if self._poller is None:
+            last_id, _ = await asyncio.to_thread(self._poll, None)
+            self._poller = asyncio.create_task(self._poll_loop(last_id))
+
+    async def _unlisten(self, channel: str):
+        if not self._subscribers and self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    async def _poll_loop(self, last_id):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            last_id, rows = await asyncio.to_thread(self._poll, last_id)
+            for _, channel, message in rows:
+                self._dispatch(channel, json.loads(message))
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        self._conn.close()
+
+
+class RedisState(StateStore):
+    """多台机器共享Redis（或兼容Redis协议的服务）：原子更新用WATCH/MULTI，通知用Redis的pub/sub"""
+
+    def __init__(self, url: str):
+        super().__init__()
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("使用Redis共享状态需要安装redis: pip install redis")
+        self._errors = redis
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._pubsub = None
+        self._reader = None
+
+    @staticmethod
+    def _ttl(ttl):
+        return int(ttl * 1000) if ttl else None
+
+    async def get(self, key: str):
+        raw = await self._redis.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value, ttl: float = None):
+        await self._redis.set(key, json.dumps(value), px=self._ttl(ttl))
+
+    async def delete(self, key: str) -> bool:
+        return await self._redis.delete(key) > 0
+
+    async def update(self, key: str, fn, ttl: float = None):
+        async with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    raw = await pipe.get(key)
+                    value = fn(json.loads(raw) if raw is not None else None)
+                    pipe.multi()
+                    if value is None:
+                        pipe.delete(key)
+                    else:
+                        pipe.set(key, json.dumps(value), px=self._ttl(ttl))
+                    await pipe.execute()
+                    return value
+                except self._errors.WatchError:
+                    # 其他客户端在此期间修改了这个键，重新读取后再试
+                    continue
+
+    async def items(self, prefix: str) -> list:
+        keys = [key async for key in self._redis.scan_iter(match=prefix + "*")]
+        if not keys:
+            return []
+        values = await self._redis.mget(keys)
+        return [(key, json.loads(value)) for key, value in zip(keys, values) if value is not None]
+
+    async def publish(self, channel: str, message):
+        await self._redis.publish(channel, json.dumps(message))
+
+    async def _listen(self, channel: str):
+        if self._pubsub is None:
+            self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(channel)
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read_loop())
+
+    async def _unlisten(self, channel: str):
+        await self._pubsub.unsubscribe(channel)
+
+    async def _read_loop(self):
+        while True:
+            message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is not None and message["type"] == "message":
+                self._dispatch(message["channel"], json.loads(message["data"]))
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        await self._redis.aclose()
+
+
+def open_state(url: str) -> StateStore:
+    # memory:// | sqlite:///data/state.sqlite3 | redis://localhost:6379/0
+    if url.startswith("memory://"):
+        return MemoryState()
+    if url.startswith("sqlite://"):
+        return SQLiteState(url[len("sqlite:///"):] if url.startswith("sqlite:///") else
+                           url[len("sqlite://"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisState(url)
+    raise ValueError(f"不支持的共享状态地址: {url}")
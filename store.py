@@ -0,0 +1,128 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+CHAT_FIELDS = ("name", "model", "temperature", "system_prompt", "web_search", "session_id")
+
+
+class ConversationStore:
+    """对话和消息持久化到SQLite，刷新页面或重启后仍然保留；消息按id分页读取"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chats ("
+            "id TEXT PRIMARY KEY, name TEXT NOT NULL, model TEXT NOT NULL, "
+            "temperature REAL NOT NULL, system_prompt TEXT NOT NULL, "
+            "web_search INTEGER NOT NULL DEFAULT 0, session_id TEXT, "
+            "message_count INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "chat_id TEXT NOT NULL REFERENCES chats(id) ON DELETE CASCADE, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, thought TEXT, sources TEXT, "
+            "created_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS messages_chat ON messages(chat_id, id)")
+        self._conn.commit()
+
+    def create_chat(self, name: str, model: str, temperature: float = 0.7,
+                    system_prompt: str = "", web_search: bool = False) -> dict:
+        now = time.time()
+        chat_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO chats VALUES (?, ?, ?, ?, ?, ?, NULL, 0, ?, ?)",
+                (chat_id, name, model, temperature, system_prompt, int(web_search), now, now))
+            self._conn.commit()
+        return self.get_chat(chat_id)
+
+    def list_chats(self):
+        # 只返回索引信息，不读取消息内容
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM chats ORDER BY created_at").fetchall()
+        return [self._chat(row) for row in rows]
+
+    def get_chat(self, chat_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        return self._chat(row) if row is not None else None
+
+    def update_chat(self, chat_id: str, **fields):
+        fields = {k: v for k, v in fields.items() if k in CHAT_FIELDS}
+        if "web_search" in fields:
+            fields["web_search"] = int(fields["web_search"])
+        if fields:
+            assignments = ", ".join(f"{k} = ?" for k in fields)
+            with self._lock:
+                self._conn.execute(
+                    f"UPDATE chats SET {assignments}, updated_at = ? WHERE id = ?",
+                    (*fields.values(), time.time(), chat_id))
+                self._conn.commit()
+        return self.get_chat(chat_id)
+
+    def delete_chat(self, chat_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def add_messages(self, chat_id: str, messages: list):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO messages (chat_id, role, content, thought, sources, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(chat_id, m["role"], m["content"], m.get("thought") or None,
+                  json.dumps(m["sources"], ensure_ascii=False) if m.get("sources") else None, now)
+                 for m in messages])
+            self._conn.execute(
+                "UPDATE chats SET message_count = message_count + ?, updated_at = ? WHERE id = ?",
+                (len(messages), now, chat_id))
+            self._conn.commit()
+
+    def messages(self, chat_id: str, before: int = None, limit: int = 50):
+        # 从新到旧取一页（多取一条判断是否还有更早的消息），返回时按时间顺序排列
+        query = "SELECT * FROM messages WHERE chat_id = ?"
+        params = [chat_id]
+        if before is not None:
+            query += " AND id < ?"
+            params.append(before)
+        if limit is not None:
+            query += " ORDER BY id DESC LIMIT ?"
+            params.append(limit + 1)
+        else:
+            query += " ORDER BY id DESC"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        return [self._message(row) for row in reversed(rows)], has_more
+
+    @staticmethod
+    def _chat(row):
+        chat = dict(row)
+        chat["web_search"] = bool(chat["web_search"])
+        return chat
+
+    @staticmethod
+    def _message(row):
+        message = {"id": row["id"], "role": row["role"], "content": row["content"]}
+        if row["thought"]:
+            message["thought"] = row["thought"]
+        if row["sources"]:
+            message["sources"] = json.loads(row["sources"])
+        return message
@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import httpx
+import ollama
+import pytest
+
+from backends import BackendPool
+
+
+class FakeHost:
+    # 用MockTransport模拟一个Ollama：down=True时所有请求连接失败
+    def __init__(self, models=(), running=()):
+        self.models = set(models)
+        self.running = list(running)
+        self.down = False
+        self.chats = 0
+        self.deletes = []
+
+    def handle(self, request):
+        if self.down:
+            raise httpx.ConnectError("connection refused", request=request)
+        path = request.url.path
+        if path == "/api/tags":
+            return httpx.Response(200, json={"models": [{"name": m} for m in sorted(self.models)]})
+        if path == "/api/ps":
+            return httpx.Response(200, json={"models": [{"name": m} for m in self.running]})
+        if path == "/api/delete":
+            model = json.loads(request.content)["model"]
+            self.deletes.append(model)
+            if model not in self.models:
+                return httpx.Response(404, json={"error": f"model '{model}' not found"})
+            self.models.discard(model)
+            return httpx.Response(200)
+        if path == "/api/chat":
+            self.chats += 1
+            body = json.loads(request.content)
+            chunks = [{"model": body["model"], "message": {"role": "assistant", "content": "hi"},
+                       "done": False},
+                      {"model": body["model"], "message": {"role": "assistant", "content": ""},
+                       "done": True, "eval_count": 1}]
+            if not body.get("stream"):
+                return httpx.Response(200, json={**chunks[0], "done": True})
+            return httpx.Response(200, content="".join(json.dumps(c) + "\n" for c in chunks))
+        return httpx.Response(404)
+
+
+def make_pool(*hosts):
+    pool = BackendPool([f"http://host{i}" for i in range(len(hosts))], httpx.Timeout(5))
+    for backend, host in zip(pool.backends, hosts):
+        backend._transport = httpx.MockTransport(host.handle)
+        backend.http = httpx.AsyncClient(base_url=backend.host, transport=backend._transport)
+    return pool
+
+
+def test_pick_prefers_loaded_then_installed_backend():
+    pool = make_pool(FakeHost(), FakeHost(models=["m"]), FakeHost(models=["m"], running=["m"]))
+
+    async def main():
+        await pool.check_all()
+        assert pool.pick("m") is pool.backends[2]
+        assert pool.pick("m", exclude=[pool.backends[2]]) is pool.backends[1]
+
+    asyncio.run(main())
+
+
+def test_health_check_marks_backend_down_and_recovered():
+    host = FakeHost(models=["m"])
+    pool = make_pool(host)
+
+    async def main():
+        host.down = True
+        await pool.check_all()
+        assert not pool.backends[0].healthy
+        host.down = False
+        await pool.check_all()
+        assert pool.backends[0].healthy
+        assert pool.backends[0].has_model("m")
+
+    asyncio.run(main())
+
+
+def test_chat_fails_over_to_next_backend_before_first_token():
+    dead, alive = FakeHost(models=["m"], running=["m"]), FakeHost(models=["m"])
+    pool = make_pool(dead, alive)
+
+    async def main():
+        await pool.check_all()
+        dead.down = True
+        stream = await pool.chat("m", stream=True, messages=[])
+        chunks = [chunk async for chunk in stream]
+        assert chunks[0].message.content == "hi"
+        assert stream.backend is pool.backends[1]
+        assert not pool.backends[0].healthy
+        assert pool.backends[0].failovers == 1
+        assert pool.backends[1].inflight == 0
+
+    asyncio.run(main())
+
+
+def test_delete_prefers_ollama_error_over_connection_error():
+    dead, alive = FakeHost(), FakeHost()
+    dead.down = True
+    pool = make_pool(dead, alive)
+    with pytest.raises(ollama.ResponseError) as error:
+        asyncio.run(pool.delete("nope"))
+    assert error.value.status_code == 404
+
+    alive.down = True
+    with pytest.raises(ConnectionError):
+        asyncio.run(pool.delete("nope"))
+
+
+def test_delete_retried_when_unreachable_backend_recovers():
+    dead, alive = FakeHost(models=["m"]), FakeHost(models=["m"])
+    pool = make_pool(dead, alive)
+
+    async def main():
+        dead.down = True
+        assert await pool.delete("m") == ["http://host0"]
+        assert "m" not in alive.models
+        dead.down = False
+        await pool.check_all()
+        assert dead.deletes == ["m"] and "m" not in dead.models
+        assert not pool.backends[0].pending_deletes
+        assert not pool.backends[0].has_model("m")
+
+    asyncio.run(main())
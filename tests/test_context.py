@@ -0,0 +1,62 @@
+import asyncio
+
+from context import SUMMARY_INSTRUCTION, SUMMARY_PREFIX, ContextManager
+from sessions import Session
+
+
+def run_turns(manager, session, budget, turns):
+    prompts = []
+    for turn in range(turns):
+        content = f"question {turn}"
+        messages, _ = manager.session_prompt(session, content, budget)
+        prompts.append(messages)
+        session.append_turn(content, "answer " * 20)
+        manager.finish_turn(session, budget)
+    return prompts
+
+
+def test_window_moves_rarely_and_keeps_room_for_next_turns():
+    manager = ContextManager()
+    session = Session("m")
+    prompts = run_turns(manager, session, 400, 40)
+    moves = [i for i in range(1, len(prompts))
+             if prompts[i][:len(prompts[i - 1]) - 1] != prompts[i - 1][:-1]]
+    assert moves
+    # 每次移动之后前缀至少保持stable_turns轮不变
+    assert all(b - a > manager.stable_turns for a, b in zip(moves, moves[1:]))
+    assert all(manager.count_all(p) <= 400 for p in prompts)
+
+
+def test_summary_is_applied_at_the_next_window_move():
+    requests = []
+
+    async def summarizer(model, messages):
+        requests.append(messages)
+        return "summary"
+
+    async def main():
+        manager = ContextManager(summarizer=summarizer)
+        session = Session("m", system_prompt="system")
+        prompts = []
+        for turn in range(40):
+            messages, _ = manager.session_prompt(session, f"question {turn}", 400)
+            prompts.append(messages)
+            session.append_turn(f"question {turn}", "answer " * 20)
+            manager.finish_turn(session, 400)
+            await asyncio.sleep(0)
+            if session.summary:
+                break
+        return manager, session, prompts
+
+    manager, session, prompts = asyncio.run(main())
+    # 总结请求是会话提示词加一条总结指令，和刚结束的一轮共享前缀
+    first = requests[0]
+    assert first[-1] == {"role": "user", "content": SUMMARY_INSTRUCTION}
+    answer = {"role": "assistant", "content": "answer " * 20}
+    assert any(p + [answer] == first[:-1] for p in prompts)
+    # 摘要完成后前缀不变，直到窗口移动时才换上，被总结的消息同时移出窗口
+    summarized = [i for i, p in enumerate(prompts) if p[1]["content"].startswith(SUMMARY_PREFIX)]
+    assert summarized == [len(prompts) - 1]
+    assert prompts[-2][1]["role"] == "user"
+    assert session.context_start >= session.summary_upto > 0
+    assert not session.pending_summary
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from downloads import DownloadManager, JobStore
+from state import MemoryState
+
+
+class FakeClient:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.pulls = []
+
+    async def pull(self, model, stream=True):
+        self.pulls.append(model)
+
+        async def parts():
+            await asyncio.sleep(self.delay)
+            yield SimpleNamespace(status="downloading", digest="sha256:a", completed=1, total=1)
+            yield SimpleNamespace(status="success", digest=None, completed=None, total=None)
+
+        return parts()
+
+
+async def interrupted_job(store, model, age):
+    await store.state.set(store.PREFIX + model, {
+        "model": model, "status": "downloading", "progress": 40,
+        "cancel_requested": False, "updated_at": time.time() - age})
+
+
+def test_job_without_heartbeat_reported_as_failed():
+    async def main():
+        store = JobStore(MemoryState(), stale_after=0.2)
+        manager = DownloadManager(FakeClient(), store)
+        await interrupted_job(store, "m", age=1)
+        assert (await manager.status("m"))["status"] == "failed"
+        assert [job["status"] for job in await store.list()] == ["failed"]
+        # 事件流报告失败后结束，不会一直等下去
+        events = [job async for job in manager.events("m", timeout=0.05)]
+        assert [job["status"] for job in events] == ["failed"]
+
+    asyncio.run(main())
+
+
+def test_events_end_when_owner_stops_updating():
+    async def main():
+        store = JobStore(MemoryState(), stale_after=0.2)
+        manager = DownloadManager(FakeClient(), store)
+        await interrupted_job(store, "m", age=0)
+        events = await asyncio.wait_for(_collect(manager.events("m", timeout=0.05)), 2)
+        assert [job["status"] for job in events] == ["downloading", "failed"]
+
+    asyncio.run(main())
+
+
+async def _collect(events):
+    return [job async for job in events]
+
+
+def test_heartbeat_keeps_slow_download_alive():
+    async def main():
+        store = JobStore(MemoryState(), stale_after=0.2)
+        manager = DownloadManager(FakeClient(delay=0.5), store)
+        assert await manager.start("m")
+        await asyncio.sleep(0.4)
+        assert (await manager.status("m"))["status"] == "downloading"
+        await asyncio.sleep(0.3)
+        assert (await manager.status("m"))["status"] == "completed"
+
+    asyncio.run(main())
+
+
+def test_resume_interrupted_restarts_stale_jobs():
+    async def main():
+        store = JobStore(MemoryState(), stale_after=0.2)
+        client = FakeClient()
+        manager = DownloadManager(client, store)
+        await interrupted_job(store, "old", age=1)
+        await interrupted_job(store, "recent", age=0)
+        await asyncio.wait_for(manager.resume_interrupted(), 1)
+        await asyncio.sleep(0.05)
+        assert client.pulls == ["old", "recent"]
+        assert (await manager.status("old"))["status"] == "completed"
+        assert (await manager.status("recent"))["status"] == "completed"
+
+    asyncio.run(main())
+
+
+class CountingClient(FakeClient):
+    """多个worker共用，记录同时进行的下载数"""
+
+    def __init__(self, delay):
+        super().__init__(delay)
+        self.running = 0
+        self.peak = 0
+
+    async def pull(self, model, stream=True):
+        parts = await super().pull(model, stream)
+
+        async def counted():
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            try:
+                async for part in parts:
+                    yield part
+            finally:
+                self.running -= 1
+
+        return counted()
+
+
+def test_concurrency_limit_shared_between_workers():
+    async def main():
+        state = MemoryState()
+        client = CountingClient(delay=0.1)
+        workers = [DownloadManager(client, JobStore(state, stale_after=0.3), max_concurrent=1)
+                   for _ in range(2)]
+        assert await workers[0].start("a")
+        assert await workers[1].start("b")
+        assert await workers[1].start("c")
+        await asyncio.sleep(0.05)
+        assert (await workers[0].status("b"))["status"] == "queued"
+        await asyncio.wait_for(_until_done(workers[0], ["a", "b", "c"]), 2)
+        assert client.peak == 1
+        assert await state.get(JobStore.SLOTS_KEY) is None
+
+    asyncio.run(main())
+
+
+def test_slot_of_exited_worker_expires():
+    async def main():
+        store = JobStore(MemoryState(), stale_after=0.2)
+        # 另一个worker拿到名额后退出，没有释放
+        assert await store.acquire_slot("dead", 1)
+        manager = DownloadManager(FakeClient(), store, max_concurrent=1)
+        assert await manager.start("m")
+        await asyncio.wait_for(_until_done(manager, ["m"]), 2)
+        assert (await manager.status("m"))["status"] == "completed"
+
+    asyncio.run(main())
+
+
+def test_cancel_queued_job_from_other_worker():
+    async def main():
+        state = MemoryState()
+        owner = DownloadManager(FakeClient(delay=0.3), JobStore(state, stale_after=0.3),
+                                max_concurrent=1)
+        other = DownloadManager(FakeClient(), JobStore(state, stale_after=0.3), max_concurrent=1)
+        assert await owner.start("a")
+        assert await owner.start("b")
+        await asyncio.sleep(0.05)
+        assert await other.cancel("b")
+        await asyncio.wait_for(_until_done(owner, ["a", "b"]), 2)
+        assert (await owner.status("b"))["status"] == "cancelled"
+        assert owner.client.pulls == ["a"]
+
+    asyncio.run(main())
+
+
+async def _until_done(manager, models):
+    while True:
+        jobs = [await manager.status(model) for model in models]
+        if all(job["status"] in ("completed", "cancelled", "failed") for job in jobs):
+            return
+        await asyncio.sleep(0.02)
@@ -0,0 +1,20 @@
+import glob
+import os
+
+import pytest
+
+import parsers
+
+# 用 python benchmark.py parse --record 录制的真实DuckDuckGo结果页
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "fixtures", "duckduckgo", "*.html")))
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=os.path.basename)
+def test_backends_agree_on_recorded_pages(path):
+    with open(path, encoding="utf-8") as f:
+        html = f.read()
+    results = {name: parsers.BACKENDS[name](html, 10) for name in parsers.available_backends()}
+    expected = results.pop("bs4", None) or next(iter(results.values()))
+    assert expected
+    for name, parsed in results.items():
+        assert parsed == expected, name
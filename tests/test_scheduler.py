@@ -0,0 +1,71 @@
+import scheduler
+from scheduler import ModelScheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_scheduler(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(scheduler.time, "monotonic", clock)
+    return ModelScheduler(max_queue=100, **kwargs), clock
+
+
+def test_resident_model_preferred_before_swap_delay(monkeypatch):
+    s, clock = make_scheduler(monkeypatch, max_inflight_per_model=1, max_loaded_models=1,
+                              max_swap_delay=10)
+    a1 = s.submit("A")
+    b = s.submit("B")
+    a2 = s.submit("A")
+    clock.now += 1
+    s.release(a1)
+    # B来得更早，但A已加载，先放行A
+    assert a2.granted.is_set()
+    assert not b.granted.is_set()
+
+
+def test_starving_swap_stops_new_admissions_for_resident_model(monkeypatch):
+    s, clock = make_scheduler(monkeypatch, max_inflight_per_model=2, max_loaded_models=1,
+                              max_swap_delay=0.05)
+    running = [s.submit("A"), s.submit("A")]
+    waiting = [s.submit("A") for _ in range(20)]
+    b = s.submit("B")
+    assert all(t.granted.is_set() for t in running)
+
+    # A的请求源源不断：每结束一个就有下一个排队的A可以放行
+    admitted_after_starving = 0
+    for _ in range(20):
+        clock.now += 0.01
+        s.release(running.pop(0))
+        for ticket in list(waiting):
+            if ticket.granted.is_set():
+                waiting.remove(ticket)
+                running.append(ticket)
+                if clock.now - b.enqueued_at > 0.05:
+                    admitted_after_starving += 1
+        if b.granted.is_set():
+            break
+
+    # B等待超过max_swap_delay后不再放行A的新请求，A的在途请求结束后立即切换到B
+    assert b.granted.is_set()
+    assert admitted_after_starving == 0
+    assert s.stats()["A"]["inflight"] == 0
+    assert s.stats()["B"]["resident"]
+
+
+def test_starving_swap_waits_for_free_model_slot(monkeypatch):
+    s, clock = make_scheduler(monkeypatch, max_inflight_per_model=1, max_loaded_models=1,
+                              max_swap_delay=0.05)
+    a = s.submit("A")
+    b = s.submit("B")
+    clock.now += 1
+    s.submit("A")
+    # A还在生成，B不能打断它，但也不会被新的A请求插队
+    assert not b.granted.is_set()
+    s.release(a)
+    assert b.granted.is_set()
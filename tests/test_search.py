@@ -0,0 +1,89 @@
+import asyncio
+import socket
+
+import httpx
+
+from search import AsyncWebSearch, is_public_address
+
+PUBLIC = "http://93.184.216.34"
+
+
+def make_search(handler, **kwargs):
+    search = AsyncWebSearch(**kwargs)
+    requested = []
+
+    def record(request):
+        requested.append(str(request.url))
+        return handler(request)
+
+    search._page_client = httpx.AsyncClient(transport=httpx.MockTransport(record))
+    return search, requested
+
+
+def page(request):
+    return httpx.Response(200, html="<p>ok</p>")
+
+
+def test_private_addresses_are_not_public():
+    for address in ("127.0.0.1", "10.0.0.1", "192.168.1.1", "172.16.0.1", "169.254.169.254",
+                    "100.64.0.1", "0.0.0.0", "::1", "fe80::1", "fd00::1", "::ffff:127.0.0.1"):
+        assert not is_public_address(address), address
+    assert is_public_address("93.184.216.34")
+
+
+def test_fetch_page_refuses_loopback_and_link_local():
+    search, requested = make_search(page)
+    for url in ("http://127.0.0.1:11434/api/tags", "http://169.254.169.254/latest/meta-data",
+                "http://[::1]:11434/", "file:///etc/passwd"):
+        assert asyncio.run(search.fetch_page(url)) == ""
+    assert requested == []
+    assert asyncio.run(search.fetch_page(PUBLIC + "/")) == "<p>ok</p>"
+
+
+def test_fetch_page_checks_redirect_targets():
+    def redirect(request):
+        if request.url.path == "/moved":
+            return httpx.Response(302, headers={"location": "http://127.0.0.1:11434/api/tags"})
+        return page(request)
+
+    search, requested = make_search(redirect)
+    assert asyncio.run(search.fetch_page(PUBLIC + "/moved")) == ""
+    assert requested == [PUBLIC + "/moved"]
+
+
+def test_fetch_page_follows_public_redirects():
+    def redirect(request):
+        if request.url.path == "/moved":
+            return httpx.Response(301, headers={"location": "/final"})
+        return page(request)
+
+    search, requested = make_search(redirect)
+    assert asyncio.run(search.fetch_page(PUBLIC + "/moved")) == "<p>ok</p>"
+    assert requested == [PUBLIC + "/moved", PUBLIC + "/final"]
+
+
+def test_private_pages_allowed_when_enabled():
+    search, _ = make_search(page, allow_private_pages=True)
+    assert asyncio.run(search.fetch_page("http://127.0.0.1:8000/")) == "<p>ok</p>"
+
+
+def test_fetch_page_connects_to_the_checked_address(monkeypatch):
+    # DNS重绑定：第一次解析是公网地址，之后解析到127.0.0.1
+    answers = ["93.184.216.34", "127.0.0.1"]
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        address = answers.pop(0) if len(answers) > 1 else answers[0]
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))]
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+    seen = []
+
+    def handler(request):
+        seen.append((request.url.host, request.headers["host"],
+                     request.extensions.get("sni_hostname")))
+        return page(request)
+
+    search, _ = make_search(handler)
+    assert asyncio.run(search.fetch_page("https://rebind.example/a")) == "<p>ok</p>"
+    # 连接的是检查过的IP，Host头和SNI仍是原来的域名
+    assert seen == [("93.184.216.34", "rebind.example", "rebind.example")]
@@ -0,0 +1,267 @@
+import asyncio
+import fnmatch
+import json
+import sys
+import time
+import types
+
+import pytest
+
+from state import MemoryState, RedisState, SQLiteState
+
+
+class WatchError(Exception):
+    pass
+
+
+class FakeRedisServer:
+    # 进程内的Redis替身：只实现RedisState用到的命令，多个客户端共享同一个服务端
+    def __init__(self):
+        self.data = {}
+        self.versions = {}
+        self.pubsubs = []
+        self.conflicts = 0
+
+    def read(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def write(self, key, value, px=None):
+        self.versions[key] = self.versions.get(key, 0) + 1
+        if value is None:
+            return self.data.pop(key, None) is not None
+        self.data[key] = (value, time.time() + px / 1000 if px else None)
+        return True
+
+
+class FakePipeline:
+    def __init__(self, server):
+        self.server = server
+        self.watched = {}
+        self.commands = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.watched = {}
+
+    async def watch(self, key):
+        self.watched[key] = self.server.versions.get(key, 0)
+
+    async def get(self, key):
+        # 让出事件循环，并发的更新可以在读和写之间插进来
+        await asyncio.sleep(0)
+        return self.server.read(key)
+
+    def multi(self):
+        self.commands = []
+
+    def set(self, key, value, px=None):
+        self.commands.append((key, value, px))
+
+    def delete(self, key):
+        self.commands.append((key, None, None))
+
+    async def execute(self):
+        commands, self.commands = self.commands, None
+        watched, self.watched = self.watched, {}
+        if any(self.server.versions.get(k, 0) != v for k, v in watched.items()):
+            self.server.conflicts += 1
+            raise WatchError()
+        for key, value, px in commands:
+            self.server.write(key, value, px)
+
+
+class FakePubSub:
+    def __init__(self, server):
+        self.server = server
+        self.channels = set()
+        self.queue = asyncio.Queue()
+        server.pubsubs.append(self)
+
+    async def subscribe(self, channel):
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel):
+        self.channels.discard(channel)
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        self.server.pubsubs.remove(self)
+
+
+class FakeRedis:
+    def __init__(self, server):
+        self.server = server
+
+    async def get(self, key):
+        return self.server.read(key)
+
+    async def set(self, key, value, px=None):
+        self.server.write(key, value, px)
+
+    async def delete(self, key):
+        return int(self.server.write(key, None))
+
+    async def mget(self, keys):
+        return [self.server.read(key) for key in keys]
+
+    async def scan_iter(self, match):
+        for key in list(self.server.data):
+            if fnmatch.fnmatchcase(key, match):
+                yield key
+
+    async def publish(self, channel, message):
+        for pubsub in self.server.pubsubs:
+            if channel in pubsub.channels:
+                pubsub.queue.put_nowait({"type": "message", "channel": channel, "data": message})
+
+    def pipeline(self):
+        return FakePipeline(self.server)
+
+    def pubsub(self):
+        return FakePubSub(self.server)
+
+    async def aclose(self):
+        pass
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    server = FakeRedisServer()
+    module = types.ModuleType("redis.asyncio")
+    module.WatchError = WatchError
+    module.from_url = lambda url, decode_responses=False: FakeRedis(server)
+    package = types.ModuleType("redis")
+    package.asyncio = module
+    monkeypatch.setitem(sys.modules, "redis", package)
+    monkeypatch.setitem(sys.modules, "redis.asyncio", module)
+    return server
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def stores(request, tmp_path, monkeypatch):
+    # 返回两个共享同一份状态的store，相当于两个worker
+    if request.param == "memory":
+        store = MemoryState()
+        return store, store
+    if request.param == "sqlite":
+        path = str(tmp_path / "state.sqlite3")
+        return SQLiteState(path, poll_interval=0.01), SQLiteState(path, poll_interval=0.01)
+    request.getfixturevalue("fake_redis")
+    return RedisState("redis://fake"), RedisState("redis://fake")
+
+
+def test_get_set_delete_and_items(stores):
+    a, b = stores
+
+    async def main():
+        await a.set("job:1", {"n": 1})
+        await a.set("job:2", {"n": 2})
+        await a.set("other", {"n": 3})
+        assert await b.get("job:1") == {"n": 1}
+        assert sorted(await b.items("job:")) == [("job:1", {"n": 1}), ("job:2", {"n": 2})]
+        assert await b.delete("job:1")
+        assert not await a.delete("job:1")
+        assert await a.get("job:1") is None
+
+    asyncio.run(main())
+
+
+def test_ttl_expires_values(stores):
+    a, b = stores
+
+    async def main():
+        await a.set("lease", {"owner": "a"}, ttl=0.05)
+        assert await b.get("lease") == {"owner": "a"}
+        await asyncio.sleep(0.1)
+        assert await b.get("lease") is None
+        assert await b.items("lease") == []
+
+    asyncio.run(main())
+
+
+def test_concurrent_updates_from_two_workers_are_atomic(stores):
+    a, b = stores
+
+    def increment(value):
+        return {"n": (value or {"n": 0})["n"] + 1}
+
+    async def main():
+        await asyncio.gather(*[store.update("counter", increment)
+                               for _ in range(50) for store in (a, b)])
+        assert await a.get("counter") == {"n": 100}
+        # 返回None表示删除
+        assert await b.update("counter", lambda value: None) is None
+        assert await a.get("counter") is None
+
+    asyncio.run(main())
+
+
+def test_update_retries_after_watch_conflict(fake_redis):
+    a, b = RedisState("redis://fake"), RedisState("redis://fake")
+
+    async def main():
+        await asyncio.gather(*[store.update("counter", lambda v: (v or 0) + 1)
+                               for _ in range(20) for store in (a, b)])
+        assert await a.get("counter") == 40
+
+    asyncio.run(main())
+    assert fake_redis.conflicts > 0
+
+
+def test_sqlite_update_is_atomic_across_connections_in_threads(tmp_path):
+    # 两个连接在不同线程中同时更新，BEGIN IMMEDIATE保证不丢失更新
+    path = str(tmp_path / "state.sqlite3")
+    a, b = SQLiteState(path), SQLiteState(path)
+
+    def increment(value):
+        return (value or 0) + 1
+
+    async def main():
+        await asyncio.gather(*[asyncio.to_thread(store._update, "counter", increment, None)
+                               for _ in range(100) for store in (a, b)])
+        assert await a.get("counter") == 200
+
+    asyncio.run(main())
+
+
+def test_publish_reaches_subscribers_of_other_worker(stores):
+    a, b = stores
+
+    async def main():
+        async with a.subscribe("download:m") as updates:
+            await b.publish("download:m", {"status": "downloading"})
+            await b.publish("download:other", {"status": "ignored"})
+            assert await updates.get(2) == {"status": "downloading"}
+            assert await updates.get(0.1) is None
+        await a.close()
+        if b is not a:
+            await b.close()
+
+    asyncio.run(main())
+
+
+def test_messages_are_copies(stores):
+    a, b = stores
+
+    async def main():
+        value = {"items": [1]}
+        await a.set("k", value)
+        value["items"].append(2)
+        assert await b.get("k") == {"items": [1]}
+        assert json.dumps(await b.get("k")) == '{"items": [1]}'
+
+    asyncio.run(main())
@@ -0,0 +1,38 @@
+from think_parser import ThinkStreamParser
+
+
+def parse(chunks):
+    parser = ThinkStreamParser()
+    events = []
+    for chunk in chunks:
+        events += parser.feed(chunk)
+    events += parser.flush()
+    merged = {"thought": "", "answer": ""}
+    for kind, text in events:
+        merged[kind] += text
+    return merged
+
+
+def test_leading_think_block_split_across_chunks():
+    text = "\n<think>reasoning</think>\n\nanswer"
+    for chunks in ([text], list(text)):
+        assert parse(chunks) == {"thought": "reasoning", "answer": "answer"}
+
+
+def test_whitespace_before_think_is_not_an_answer_delta():
+    parser = ThinkStreamParser()
+    events = []
+    for chunk in ["\n", "<think>", "abc", "</think>", "Hello"]:
+        events += parser.feed(chunk)
+    assert events + parser.flush() == [("thought", "abc"), ("answer", "Hello")]
+
+
+def test_think_tag_inside_answer_is_plain_text():
+    text = "Use the <think> tag like this: <think>x</think> done"
+    for chunks in ([text], list(text)):
+        assert parse(chunks) == {"thought": "", "answer": text}
+
+
+def test_unclosed_think_tag_after_answer_stays_in_answer():
+    assert parse(["Hello ", "<think> never closed"]) == {
+        "thought": "", "answer": "Hello <think> never closed"}
@@ -0,0 +1,92 @@
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def partial_tag_length(text: str, tag: str) -> int:
+    # text末尾可能是tag开头的一部分（标签被切分在两个chunk之间），返回这部分的长度
+    if "<" not in text[-(len(tag) - 1):]:
+        return 0
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+class ThinkStreamParser:
+    """增量拆分推理过程和回答：每次只处理新到的文本，标签可以被切分在多个chunk中
+
+    只识别开头的一个<think>...</think>块（deepseek-r1的输出格式），<think>前面只能有空白；
+    之后的文本都作为回答。
+    """
+
+    def __init__(self):
+        self.in_thought = False
+        self.finished_thought = False
+        self.thought_chars = 0
+        self.answer_chars = 0
+        self._pending = ""
+        self._strip_answer = False
+
+    def feed(self, text: str):
+        events = []
+        buffer = self._pending + text
+        self._pending = ""
+
+        while buffer:
+            if self.finished_thought:
+                self._emit(events, "answer", buffer)
+                break
+            if not self.in_thought:
+                # 只有回答还没有任何非空白文本时才可能进入推理过程，
+                # 回答中提到的<think>按普通文本处理
+                stripped = buffer.lstrip()
+                if not stripped.startswith(THINK_OPEN):
+                    if THINK_OPEN.startswith(stripped):
+                        # 只有空白或半个标签，等下一个chunk再判断
+                        self._pending = buffer
+                    else:
+                        self.finished_thought = True
+                        self._emit(events, "answer", buffer)
+                    break
+            tag = THINK_CLOSE if self.in_thought else THINK_OPEN
+            index = buffer.find(tag)
+            if index >= 0:
+                # <think>前面只有空白，丢弃，不作为回答发出
+                if self.in_thought:
+                    self._emit(events, "thought", buffer[:index])
+                buffer = buffer[index + len(tag):]
+                if self.in_thought:
+                    self.in_thought = False
+                    self.finished_thought = True
+                    self._strip_answer = True
+                else:
+                    self.in_thought = True
+                continue
+            # 保留末尾可能是半个标签的部分，等下一个chunk再判断
+            keep = partial_tag_length(buffer, tag)
+            if keep:
+                self._pending = buffer[-keep:]
+                buffer = buffer[:-keep]
+            self._emit(events, "thought" if self.in_thought else "answer", buffer)
+            break
+        return events
+
+    def flush(self):
+        events = []
+        pending, self._pending = self._pending, ""
+        self._emit(events, "thought" if self.in_thought else "answer", pending)
+        return events
+
+    def _emit(self, events, kind, text):
+        if kind == "answer" and self._strip_answer:
+            # 和原来的处理一致：去掉</think>后面的空白
+            text = text.lstrip()
+            if text:
+                self._strip_answer = False
+        if not text:
+            return
+        if kind == "thought":
+            self.thought_chars += len(text)
+        else:
+            self.answer_chars += len(text)
+        events.append((kind, text))
@@ -1,8 +1,8 @@
 import streamlit as st
 import requests
 import json
-import time
 from i18n import LANGUAGES
+from render import StreamRenderer
 
 # 获取当前语言的文本
 
@@ -10,23 +10,147 @@ from i18n import LANGUAGES
 def get_text(key):
     return LANGUAGES[st.session_state.language][key]
 
+def fetch_models():
+    # 带上ETag，模型列表没有变化时服务端返回304，直接复用上次的结果
+    headers = {}
+    if "models_etag" in st.session_state:
+        headers["If-None-Match"] = st.session_state.models_etag
+    response = requests.get("http://localhost:8000/models", headers=headers)
+    if response.status_code == 304:
+        return st.session_state.models_data
+    if response.status_code != 200:
+        return None
+    st.session_state.models_etag = response.headers.get("ETag")
+    st.session_state.models_data = response.json()
+    return st.session_state.models_data
+
+
+def format_model(name, info):
+    if not info:
+        return name
+    details = " · ".join(filter(None, [info.get("parameter_size"), info.get("quantization")]))
+    label = f"{name} ({details})" if details else name
+    # 已加载到内存的模型响应更快
+    return f"🟢 {label}" if info.get("loaded") else label
+
+
+def format_sources(sources):
+    return get_text("sources") + "  \n" + "  \n".join(
+        f"[{s['index']}] [{s['title']}]({s['link']})" for s in sources)
+
+
+MESSAGE_PAGE_SIZE = 50
+
+
+def create_chat(name, model="deepseek-r1:7b", temperature=0.7, system_prompt=""):
+    response = requests.post("http://localhost:8000/chats", json={
+        "name": name,
+        "model": model,
+        "temperature": temperature,
+        "system_prompt": system_prompt
+    })
+    response.raise_for_status()
+    return response.json()
+
+
+def load_chats():
+    # 对话列表只包含元数据，消息在打开对话时再分页加载
+    response = requests.get("http://localhost:8000/chats")
+    response.raise_for_status()
+    chats = response.json()["chats"]
+    if not chats:
+        chats = [create_chat(get_text("chat_name").format(1))]
+    return chats
+
+
+def update_chat(chat, **fields):
+    # 只提交有变化的字段
+    changed = {k: v for k, v in fields.items() if chat.get(k) != v}
+    if changed:
+        requests.patch(f"http://localhost:8000/chats/{chat['id']}", json=changed)
+        chat.update(changed)
+
+
+def load_messages(chat_id, before=None):
+    params = {"limit": MESSAGE_PAGE_SIZE}
+    if before is not None:
+        params["before"] = before
+    response = requests.get(f"http://localhost:8000/chats/{chat_id}/messages", params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def chat_history(chat_id):
+    # 每个对话只在内存中保留已加载的窗口，重新运行脚本时只渲染这部分消息
+    if chat_id not in st.session_state.history:
+        page = load_messages(chat_id)
+        st.session_state.history[chat_id] = {
+            "messages": page["messages"], "has_more": page["has_more"]}
+    return st.session_state.history[chat_id]
+
+
+def load_earlier_messages(chat_id):
+    history = st.session_state.history[chat_id]
+    page = load_messages(chat_id, before=history["messages"][0]["id"])
+    history["messages"] = page["messages"] + history["messages"]
+    history["has_more"] = page["has_more"]
+
+
+def find_chat(chat_id):
+    return next(chat for chat in st.session_state.chats if chat["id"] == chat_id)
+
+
+def ensure_session(chat):
+    # 会话不存在时（首次发送或API重启后）新建服务端会话，历史由服务端从对话记录恢复
+    if chat.get("session_id") is None:
+        response = requests.post("http://localhost:8000/sessions", json={
+            "model": chat["model"],
+            "system_prompt": chat["system_prompt"],
+            "temperature": chat["temperature"],
+            "chat_id": chat["id"]
+        })
+        response.raise_for_status()
+        chat["session_id"] = response.json()["id"]
+    return chat["session_id"]
+
+
+def open_session_stream(chat, content):
+    for _ in range(2):
+        session_id = ensure_session(chat)
+        response = requests.post(
+            f"http://localhost:8000/sessions/{session_id}/messages",
+            json={
+                "content": content,
+                "model": chat["model"],
+                "system_prompt": chat["system_prompt"],
+                "temperature": chat["temperature"],
+                "web_search": chat.get("web_search", False),
+                "typed_events": True,
+                "stream": True
+            },
+            stream=True
+        )
+        if response.status_code != 404:
+            return response
+        response.close()
+        chat["session_id"] = None
+    return response
+
 # 初始化语言设置
 if "language" not in st.session_state:
     st.session_state.language = "zh"
 
-# 初始化会话状态
+# 初始化会话状态：对话保存在API服务端，刷新页面后重新加载
 if "chats" not in st.session_state:
-    st.session_state.chats = [{
-        "id": 0,
-        "name": get_text("chat_name").format(1),
-        "messages": [],
-        "model": "deepseek-r1:7b",
-        "temperature": 0.7,
-        "system_prompt": ""
-    }]
+    try:
+        st.session_state.chats = load_chats()
+    except Exception as e:
+        st.error(get_text("error_occurred").format(str(e)))
+        st.stop()
+    st.session_state.history = {}
 
 if "current_chat_id" not in st.session_state:
-    st.session_state.current_chat_id = 0
+    st.session_state.current_chat_id = st.session_state.chats[0]["id"]
 
 # 设置页面标题和布局
 st.set_page_config(page_title="LLM Chat Interface", layout="wide")
@@ -48,16 +172,16 @@ with st.sidebar:
 
     # 新建会话按钮
     if st.button(get_text("new_chat")):
-        new_chat_id = len(st.session_state.chats)
-        st.session_state.chats.append({
-            "id": new_chat_id,
-            "name": get_text("chat_name").format(new_chat_id + 1),
-            "messages": [],
-            "model": st.session_state.chats[st.session_state.current_chat_id]["model"],
-            "temperature": st.session_state.chats[st.session_state.current_chat_id]["temperature"],
-            "system_prompt": st.session_state.chats[st.session_state.current_chat_id]["system_prompt"]
-        })
-        st.session_state.current_chat_id = new_chat_id
+        previous_chat = find_chat(st.session_state.current_chat_id)
+        new_chat = create_chat(
+            get_text("chat_name").format(len(st.session_state.chats) + 1),
+            previous_chat["model"],
+            previous_chat["temperature"],
+            previous_chat["system_prompt"]
+        )
+        st.session_state.chats.append(new_chat)
+        st.session_state.history[new_chat["id"]] = {"messages": [], "has_more": False}
+        st.session_state.current_chat_id = new_chat["id"]
 
     # 会话列表
     st.header(get_text("chat_list"))
@@ -74,8 +198,8 @@ with st.sidebar:
                     value=chat["name"],
                     key=f"chat_name_{chat['id']}",
                     label_visibility="collapsed",
-                    on_change=lambda chat_id=chat['id']: setattr(
-                        st.session_state.chats[chat_id], 'name', st.session_state[f"chat_name_{chat_id}"])
+                    on_change=lambda chat=chat: update_chat(
+                        chat, name=st.session_state[f"chat_name_{chat['id']}"])
                 )
                 # 按回车或失去焦点时退出编辑模式
                 st.session_state[f"editing_chat_{chat['id']}"] = False
@@ -105,9 +229,11 @@ with st.sidebar:
         with col2:
             if len(st.session_state.chats) > 1 and st.button("🗑️", key=f"delete_{chat['id']}"):
                 if st.button(get_text("confirm_delete"), key=f"confirm_delete_{chat['id']}"):
+                    requests.delete(f"http://localhost:8000/chats/{chat['id']}")
                     st.session_state.chats.remove(chat)
+                    st.session_state.history.pop(chat["id"], None)
                     if st.session_state.current_chat_id == chat["id"]:
-                        st.session_state.current_chat_id = 0
+                        st.session_state.current_chat_id = st.session_state.chats[0]["id"]
 
 # 主界面
 st.title(get_text("title"))
@@ -115,35 +241,53 @@ st.title(get_text("title"))
 # 设置菜单
 with st.expander("⚙️ " + get_text("settings")):
     # 获取可用模型列表
+    model_info = {}
     try:
-        response = requests.get("http://localhost:8000/models")
-        if response.status_code == 200:
-            models_data = response.json()
-            if "models" in models_data:
-                models = [model["name"] for model in models_data["models"]]
-            else:
-                models = ["deepseek-coder:7b-instruct-q4_0"]
-        else:
+        models_data = fetch_models()
+        if models_data is None:
             models = [get_text("no_models")]
+        elif "models" in models_data:
+            model_info = {model["name"]: model for model in models_data["models"]}
+            models = list(model_info)
+        else:
+            models = ["deepseek-coder:7b-instruct-q4_0"]
     except Exception as e:
         st.error(get_text("get_models_error").format(str(e)))
         models = [get_text("server_error")]
     
-    current_chat = st.session_state.chats[st.session_state.current_chat_id]
-
-    # 模型选择和参数配置
-    current_chat["model"] = st.selectbox(
-        get_text("select_model"), models, index=models.index(current_chat["model"]))
-    current_chat["temperature"] = st.slider(
-        "Temperature", min_value=0.0, max_value=1.0, value=current_chat["temperature"], step=0.1)
-    current_chat["system_prompt"] = st.text_area(
-        get_text("system_prompt"), current_chat["system_prompt"], height=100)
+    current_chat = find_chat(st.session_state.current_chat_id)
+    if current_chat["model"] not in models:
+        # 首次启动时Ollama可能还没就绪或默认模型还在后台下载，保留对话的模型并提示，
+        # 列表中的占位文字不作为可选模型
+        st.info(get_text("model_not_ready").format(current_chat["model"]))
+        models = [current_chat["model"]] + [m for m in models if m in model_info]
+
+    # 模型选择和参数配置，有修改时保存到服务端
+    update_chat(
+        current_chat,
+        model=st.selectbox(
+            get_text("select_model"), models, index=models.index(current_chat["model"]),
+            format_func=lambda name: format_model(name, model_info.get(name))),
+        temperature=st.slider(
+            "Temperature", min_value=0.0, max_value=1.0, value=current_chat["temperature"], step=0.1),
+        system_prompt=st.text_area(
+            get_text("system_prompt"), current_chat["system_prompt"], height=100),
+        web_search=st.toggle(
+            get_text("web_search"), value=current_chat.get("web_search", False))
+    )
     
     # 添加模型下载功能
     st.header(get_text("download_model"))
     new_model = st.text_input(get_text("model_name"),
                               placeholder=get_text("model_placeholder"))
-    if st.button(get_text("download_button")):
+    download_col, cancel_col = st.columns(2)
+    with cancel_col:
+        if st.button(get_text("cancel_download")) and new_model:
+            requests.delete(f"http://localhost:8000/models/download/{new_model}")
+            st.info(get_text("download_cancelled"))
+    with download_col:
+        start_download = st.button(get_text("download_button"))
+    if start_download:
         if new_model:
             try:
                 response = requests.post(f"http://localhost:8000/models/download/{new_model}")
@@ -152,33 +296,38 @@ with st.expander("⚙️ " + get_text("settings")):
                     progress_bar = st.progress(0)
                     status_text = st.empty()
 
-                    while True:
-                        status_response = requests.get(f"http://localhost:8000/models/download/{new_model}/status")
-                        if status_response.status_code == 200:
-                            status_data = status_response.json()
+                    # 通过SSE接收服务端推送的进度，不再每秒轮询
+                    with requests.get(f"http://localhost:8000/models/download/{new_model}/events",
+                                      stream=True) as events:
+                        for line in events.iter_lines():
+                            if not line or not line.startswith(b"data: "):
+                                continue
+                            status_data = json.loads(line[6:])
                             status = status_data["status"]
                             progress = status_data.get("progress", 0)
 
-                            if status == "downloading":
+                            if status in ("queued", "downloading"):
                                 progress_bar.progress(progress / 100)
-                                status_text.text(
-                                    get_text("download_progress").format(progress))
+                                text = get_text("download_progress").format(progress)
+                                if status_data.get("rate"):
+                                    text += " · " + get_text("download_rate").format(
+                                        status_data["rate"] / 1024 / 1024, status_data.get("eta") or "-")
+                                status_text.text(text)
                             elif status == "verifying":
                                 progress_bar.progress(0.99)
                                 status_text.text(get_text("verifying_model"))
                             elif status == "writing":
                                 progress_bar.progress(0.99)
                                 status_text.text(get_text("writing_model"))
-                            elif status_data["status"] == "completed":
+                            elif status == "completed":
                                 progress_bar.progress(100)
                                 status_text.text(get_text("download_complete"))
                                 st.success(get_text("download_success"))
-                                break
-                            elif status_data["status"] == "failed":
+                            elif status == "cancelled":
+                                status_text.text(get_text("download_cancelled"))
+                            elif status == "failed":
                                 st.error(get_text("download_failed").format(
                                     status_data.get("error", "未知错误")))
-                                break
-                        time.sleep(1)
                 else:
                     st.error(get_text("request_failed").format(response.text))
             except Exception as e:
@@ -186,21 +335,27 @@ with st.expander("⚙️ " + get_text("settings")):
         else:
             st.warning(get_text("enter_model_name"))
 
-# 显示当前会话的聊天历史
-current_chat = st.session_state.chats[st.session_state.current_chat_id]
-for message in current_chat["messages"]:
+# 显示当前会话的聊天历史：只渲染已加载的最近一页，更早的消息按需加载
+current_chat = find_chat(st.session_state.current_chat_id)
+history = chat_history(current_chat["id"])
+if history["has_more"] and st.button(get_text("load_earlier")):
+    load_earlier_messages(current_chat["id"])
+    st.rerun()
+for message in history["messages"]:
     with st.chat_message(message["role"]):
         if "thought" in message and message["thought"]:
             with st.expander(get_text("view_thoughts"), expanded=False):
                 st.markdown(message["thought"])
         st.markdown(message["content"])
+        if message.get("sources"):
+            st.caption(format_sources(message["sources"]))
 
 # 创建固定在底部的输入区域
 chat_input = st.chat_input(get_text("input_placeholder"))
 
 if chat_input:
-    # 添加用户消息到历史
-    current_chat["messages"].append({"role": "user", "content": chat_input})
+    # 添加用户消息到历史（服务端在回答完成后一起保存）
+    history["messages"].append({"role": "user", "content": chat_input})
     with st.chat_message("user"):
         st.markdown(chat_input)
     
@@ -208,31 +363,19 @@ if chat_input:
     with st.chat_message("assistant"):
         with st.spinner(get_text("thinking")):
             try:
-                # 构建消息数组
-                messages = []
-                if current_chat["system_prompt"]:
-                    messages.append(
-                        {"role": "system", "content": current_chat["system_prompt"]})
-                messages.extend(current_chat["messages"])
-                
-                # 创建响应占位符
-                response_placeholder = st.empty()
+                # 排队提示、推理过程和回答分别占一个区域；推理和回答按帧率节流渲染，
+                # 已完成的段落只渲染一次，之后只重绘末尾
+                status_placeholder = st.empty()
+                thought_area = st.empty()
+                thought_renderer = StreamRenderer(thought_area.container())
                 thought_expander = st.expander(
                     get_text("view_thoughts"), expanded=False)
-                full_response = ""
-                thought_extracted = False
+                answer_renderer = StreamRenderer(st.container())
+                sources = []
                 
-                # 使用SSE接收流式响应
-                with requests.post(
-                    "http://localhost:8000/chat",
-                    json={
-                        "model": current_chat["model"],
-                        "messages": messages,
-                        "temperature": current_chat["temperature"],
-                        "stream": True
-                    },
-                    stream=True
-                ) as response:
+                # 使用SSE接收流式响应，历史保存在服务端会话中，每轮只发送新消息；
+                # 服务端已拆分好推理过程和回答，每个chunk只需追加文本
+                with open_session_stream(current_chat, chat_input) as response:
                     if response.status_code == 200:
                         for line in response.iter_lines():
                             if line:
@@ -244,39 +387,48 @@ if chat_input:
                                             st.error(
                                                 get_text("error_occurred").format(data['error']))
                                             break
-                                        content = data['content']
-                                        full_response += content
-
-                                        if not thought_extracted and "<think>" in full_response and "</think>" in full_response:
-                                            parts = full_response.split("</think>")
-                                            thought = parts[0].split("<think>")[1].strip()
-                                            answer = parts[1].strip()
+                                        if 'queue' in data:
+                                            status_placeholder.markdown(
+                                                get_text("queue_position").format(data['queue']['position']))
+                                            continue
+                                        if 'sources' in data:
+                                            sources = data['sources']
+                                            continue
 
-                                            if thought:
-                                                with thought_expander:
-                                                    st.markdown(thought)
-                                            thought_extracted = True
-                                            full_response = answer
-
-                                        response_placeholder.markdown(full_response)
+                                        event_type = data.get('type')
+                                        if event_type == 'thought_delta':
+                                            status_placeholder.empty()
+                                            thought_renderer.feed(data['content'])
+                                        elif event_type == 'answer_delta':
+                                            if not answer_renderer.text:
+                                                status_placeholder.empty()
+                                                if thought_renderer.text.strip():
+                                                    # 推理结束，移入折叠区域
+                                                    thought_area.empty()
+                                                    with thought_expander:
+                                                        st.markdown(thought_renderer.text)
+                                            answer_renderer.feed(data['content'])
                                     except json.JSONDecodeError:
                                         continue
                     else:
                         st.error(
                             get_text("request_failed").format(response.text))
+
+                # 补上节流期间还没显示的末尾
+                answer = answer_renderer.finish()
+                thought = thought_renderer.text
+                if not answer and thought.strip():
+                    thought_renderer.finish()
                 
+                if sources:
+                    st.caption(format_sources(sources))
+
                 # 将完整响应添加到会话历史
-                if "<think>" in full_response and "</think>" in full_response:
-                    parts = full_response.split("</think>")
-                    answer = parts[1].strip()
-                    current_chat["messages"].append({
-                        "role": "assistant",
-                        "content": answer
-                    })
-                else:
-                    current_chat["messages"].append({
-                        "role": "assistant",
-                        "content": full_response
-                    })
+                history["messages"].append({
+                    "role": "assistant",
+                    "content": answer,
+                    "thought": thought.strip(),
+                    "sources": sources
+                })
             except Exception as e:
                 st.error(get_text("error_occurred").format(str(e)))